@@ -5,8 +5,26 @@
 Generate changelogs based on tag messages and shortlogs
 """
 
+from typing import Any, TYPE_CHECKING
+
 from .__version__ import __version__
-from .project import Project
-from .tag import Tag
+
+if TYPE_CHECKING:
+    from .project import Project
+    from .tag import Tag
 
 __author__ = "Amethyst Reese"
+__all__ = ["__version__", "Project", "Tag"]
+
+
+def __getattr__(name: str) -> Any:
+    # load the project and tag modules on first use, to keep CLI startup fast
+    if name == "Project":
+        from .project import Project
+
+        return Project
+    if name == "Tag":
+        from .tag import Tag
+
+        return Tag
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
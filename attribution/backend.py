@@ -0,0 +1,647 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT license
+
+import logging
+import re
+import subprocess
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from importlib.util import find_spec
+from pathlib import Path
+from typing import (
+    Any,
+    Collection,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Protocol,
+    Tuple,
+    Type,
+    Union,
+)
+
+from .helpers import git_batch, sh
+from .profile import GIT, profiled
+from .refs import read_tag_refs
+from .types import parse_version
+
+LOG = logging.getLogger(__name__)
+
+# fields are NUL separated, and each record is terminated by NUL + newline
+TAG_FIELDS = (
+    "%(refname:strip=2)",
+    "%(objectname)",
+    "%(objecttype)",
+    "%(taggername) %(taggeremail)",
+    "%(taggerdate:iso-strict)",
+    "%(contents)",
+)
+TAG_FORMAT = "".join(f"{field}%00" for field in TAG_FIELDS)
+
+# commit sha, parent shas, mailmapped author name, tag decorations
+LOG_FORMAT = "%H%x00%P%x00%aN%x00%D"
+WALK_CMD = (
+    "git",
+    "log",
+    "--tags",
+    "--topo-order",
+    "--reverse",
+    "--decorate-refs=refs/tags/",
+    f"--format={LOG_FORMAT}",
+)
+
+BACKENDS = ("auto", "cli", "pygit2", "dulwich")
+
+TAGGER_RE = re.compile(r"(.+) (\d+) ([+-])(\d\d)(\d\d)$")
+
+
+class BackendUnavailable(Exception):
+    pass
+
+
+class TagData(NamedTuple):
+    kind: str  # "tag" for annotated tags, otherwise the type of the tagged object
+    tagger: str
+    date: str
+    content: str  # full message, including any signature
+
+
+class TagRef(NamedTuple):
+    name: str
+    sha: str
+    data: Optional[TagData]  # only when available without extra work
+
+
+class Commit(NamedTuple):
+    sha: str
+    parents: Tuple[str, ...]
+    author: str  # mailmapped author name
+    tags: List[str]
+
+
+class GitBackend(Protocol):
+    """
+    Operations attribution needs from git, independent of how they're performed.
+    """
+
+    name: str
+
+    def list_tags(self) -> List[TagRef]:
+        """List all tags in the repo, in no particular order"""
+
+    def read_tags(self, shas: Collection[str]) -> Dict[str, TagData]:
+        """Read tag data for the given object shas, skipping unknown objects"""
+
+    def read_tag(self, name: str) -> Optional[TagData]:
+        """Read tag data for a single tag by name, or None if it can't be read"""
+
+    def walk(
+        self, tags: Optional[Collection[str]] = None, base: Optional[str] = None
+    ) -> Iterator[Commit]:
+        """
+        Walk commits reachable from the given tags, or all tags, yielding parents first.
+
+        With a base tag, the walk stops at that tag's commit, leaving out its history.
+        """
+
+    def shortlog(self, rev: str, exclude: Optional[str] = None) -> str:
+        """Summarize commit counts by author, equivalent to `git shortlog -s`"""
+
+    def head(self) -> Optional[str]:
+        """Commit sha at HEAD, or None in a repo without any commits"""
+
+    def describe(self, rev: str) -> Optional[str]:
+        """
+        Name of the nearest tag reachable from rev, or None if there isn't one.
+
+        Raises an exception if rev doesn't resolve to a commit.
+        """
+
+    def log(self, *args: str, raw: bool = False) -> str:
+        """Output of `git log` with the given args, or sent straight to stdout if raw"""
+
+    def author(self) -> str:
+        """Name of the author for new commits, after applying any mailmap"""
+
+    def create_tag(
+        self, name: str, message: str, *, signed: bool = False, force: bool = False
+    ) -> None:
+        """Create (or replace) an annotated or signed tag at HEAD"""
+
+    def add(self, *paths: Union[str, Path]) -> None:
+        """Stage the given paths"""
+
+    def commit(
+        self,
+        message: Optional[str] = None,
+        *,
+        amend: bool = False,
+        allow_empty: bool = False,
+    ) -> None:
+        """Commit staged changes, keeping the existing message if amending"""
+
+    def reset(self, rev: Optional[str], *paths: Union[str, Path]) -> None:
+        """
+        Like `git reset --soft rev`, or `git reset rev -- paths` when given paths.
+
+        A rev of None resets to a repo without commits.
+        """
+
+
+def parse_tag_records(out: str) -> Iterator[TagRef]:
+    """Parse `git for-each-ref --format={TAG_FORMAT}` output"""
+    for record in out.split("\0\n"):
+        if not record:
+            continue
+        name, sha, kind, tagger, date, content, *_ = record.split("\0")
+        yield TagRef(name, sha, TagData(kind, tagger, date, content))
+
+
+def walk_args(
+    tags: Optional[Collection[str]] = None, base: Optional[str] = None
+) -> List[str]:
+    """Arguments for `git log`, like `WALK_CMD` but limited to the given tags"""
+    args = list(WALK_CMD[1:])
+    if tags is not None:
+        args.remove("--tags")
+        args += [f"refs/tags/{name}" for name in tags]
+    if base is not None:
+        args.append(f"^refs/tags/{base}^@")
+    return args
+
+
+def parse_tag_object(out: str) -> Optional[TagData]:
+    """Parse the raw contents of an annotated tag object, like from `git cat-file`"""
+    header, _, content = out.partition("\n\n")
+    fields = dict(line.split(" ", 1) for line in header.splitlines() if " " in line)
+    if "object" not in fields:
+        return None
+    return TagData("tag", *parse_tagger(fields.get("tagger", "")), content)
+
+
+def parse_walk(out: str) -> Iterator[Commit]:
+    """Parse `git log --format={LOG_FORMAT}` output"""
+    for line in out.split("\n"):
+        if not line:
+            continue
+        sha, parents, author, decorations = line.split("\0")
+        tags = [d[5:] for d in decorations.split(", ") if d.startswith("tag: ")]
+        yield Commit(sha, tuple(parents.split()), author, tags)
+
+
+def format_shortlog(counts: "Counter[str]") -> str:
+    """Format author counts the same as `git shortlog -s`"""
+    return "\n".join(
+        f"{count:6d}\t{author}" for author, count in sorted(counts.items())
+    ).rstrip()
+
+
+class CliBackend:
+    """Run git commands, in the given repo or the current directory"""
+
+    name = "cli"
+
+    def __init__(self, root: Optional[Path] = None):
+        self.root = root
+
+    def __repr__(self) -> str:
+        return f"CliBackend({self.root!r})"
+
+    def git(self, *args: str, raw: bool = False) -> str:
+        cmd = ("git",) if self.root is None else ("git", "-C", str(self.root))
+        if raw:
+            return sh(*cmd, *args, raw=True)
+        return sh(*cmd, *args)
+
+    def list_tags(self) -> List[TagRef]:
+        refs = read_tag_refs(Path.cwd() if self.root is None else self.root)
+        if refs is not None:
+            return [TagRef(name, sha, None) for name, sha in refs.items()]
+
+        out = self.git("for-each-ref", f"--format={TAG_FORMAT}", "refs/tags")
+        return list(parse_tag_records(out))
+
+    def read_tags(self, shas: Collection[str]) -> Dict[str, TagData]:
+        # only the requested objects are read, from a single cat-file process
+        result: Dict[str, TagData] = {}
+        for sha in shas:
+            data = self._read_object(sha)
+            if data is not None:
+                result[sha] = data
+        return result
+
+    def read_tag(self, name: str) -> Optional[TagData]:
+        return self._read_object(f"refs/tags/{name}")
+
+    def _read_object(self, rev: str) -> Optional[TagData]:
+        obj = git_batch(self.root).read(rev)
+        if obj is None:
+            return None
+        if obj.type != "tag":
+            return TagData(obj.type, "", "", "")
+
+        out = obj.data.decode("utf-8", errors="replace")
+        data = parse_tag_object(out)
+        if data is None:
+            LOG.debug(out)
+        return data
+
+    def walk(
+        self, tags: Optional[Collection[str]] = None, base: Optional[str] = None
+    ) -> Iterator[Commit]:
+        if tags is not None and not tags:
+            return iter(())
+        return parse_walk(self.git(*walk_args(tags, base)))
+
+    def shortlog(self, rev: str, exclude: Optional[str] = None) -> str:
+        revs = [rev] if exclude is None else [rev, f"^{exclude}"]
+        return self.git("shortlog", "-s", *revs).rstrip()
+
+    def head(self) -> Optional[str]:
+        try:
+            return self.git("rev-parse", "--verify", "--quiet", "HEAD^{commit}").strip()
+        except subprocess.CalledProcessError:
+            return None
+
+    def describe(self, rev: str) -> Optional[str]:
+        base = self.git("describe", "--tags", "--abbrev=0", "--always", rev).strip()
+        # Without a reachable tag, this is just the abbreviated commit sha. To save
+        # commands, assume any version-like name is a tag, and check anything else.
+        if parse_version(base) is None and not self.git("tag", "-l", base).strip():
+            return None
+        return base
+
+    def log(self, *args: str, raw: bool = False) -> str:
+        return self.git("log", *args, raw=raw)
+
+    def author(self) -> str:
+        ident = self.git("var", "GIT_AUTHOR_IDENT").strip()
+        ident = ident.rsplit(" ", 2)[0]  # drop timestamp and offset
+        ident = self.git("check-mailmap", ident).strip()
+        return ident.rsplit(" <", 1)[0]
+
+    def create_tag(
+        self, name: str, message: str, *, signed: bool = False, force: bool = False
+    ) -> None:
+        flags = ["--force"] if force else []
+        flags.append("--sign" if signed else "--annotate")
+        self.git("tag", *flags, name, "-m", message)
+
+    def add(self, *paths: Union[str, Path]) -> None:
+        if paths:
+            self.git("add", "--", *(str(path) for path in paths))
+
+    def commit(
+        self,
+        message: Optional[str] = None,
+        *,
+        amend: bool = False,
+        allow_empty: bool = False,
+    ) -> None:
+        flags = []
+        if amend:
+            flags.append("--amend")
+        if allow_empty:
+            flags.append("--allow-empty")
+        if message is None:
+            flags.append("--no-edit")
+        else:
+            flags += ["-m", message]
+        self.git("commit", *flags)
+
+    def reset(self, rev: Optional[str], *paths: Union[str, Path]) -> None:
+        names = [str(path) for path in paths]
+        if not paths:
+            if rev is None:
+                self.git("update-ref", "-d", "HEAD")
+            else:
+                self.git("reset", "-q", "--soft", rev)
+        elif rev is None:
+            self.git("rm", "-q", "--cached", "--ignore-unmatch", "--", *names)
+        else:
+            self.git("reset", "-q", rev, "--", *names)
+
+
+def format_time(timestamp: int, offset: timedelta) -> str:
+    """Format a commit or tag time like `--date=iso-strict`"""
+    return datetime.fromtimestamp(timestamp, timezone(offset)).isoformat()
+
+
+def parse_tagger(line: str) -> Tuple[str, str]:
+    """Split a raw tagger line into the tagger identity and time"""
+    match = TAGGER_RE.match(line)
+    if match is None:
+        return line.strip(), ""
+    ident, timestamp, sign, hours, minutes = match.groups()
+    offset = timedelta(hours=int(hours), minutes=int(minutes))
+    return ident, format_time(int(timestamp), -offset if sign == "-" else offset)
+
+
+class Pygit2Backend(CliBackend):
+    """
+    Read tag objects and history in process with pygit2.
+
+    Tags are listed from the refs like the CLI backend, and pygit2 is only imported
+    once objects or history are read. Writes go through the git CLI, to respect
+    signing config, hooks, and the index.
+    """
+
+    name = "pygit2"
+
+    def __init__(self, root: Optional[Path] = None):
+        if find_spec("pygit2") is None:
+            raise BackendUnavailable("pygit2 not installed")
+        super().__init__(root)
+        self._repo: Any = None
+
+    def __repr__(self) -> str:
+        return f"Pygit2Backend({self.root!r})"
+
+    @property
+    def pygit2(self) -> Any:
+        try:
+            import pygit2
+        except ImportError as e:
+            raise BackendUnavailable(f"pygit2 failed to import: {e}") from e
+
+        return pygit2
+
+    @property
+    def repo(self) -> Any:
+        """Repository, opened on first use"""
+        if self._repo is None:
+            pygit2 = self.pygit2
+            path = pygit2.discover_repository(
+                str(Path.cwd() if self.root is None else self.root)
+            )
+            if path is None:
+                raise BackendUnavailable(f"no repository found for {self.root}")
+            self._repo = pygit2.Repository(path)
+        return self._repo
+
+    @profiled(GIT)
+    def read_tags(self, shas: Collection[str]) -> Dict[str, TagData]:
+        try:
+            repo = self.repo
+        except BackendUnavailable as e:
+            LOG.debug(f"{self!r} unavailable, reading tags with git cli: {e}")
+            return super().read_tags(shas)
+
+        result: Dict[str, TagData] = {}
+        for sha in shas:
+            try:
+                obj = repo[sha]
+            except (KeyError, ValueError):
+                continue
+            if obj.type_str == "tag":
+                tagger = obj.tagger
+                result[sha] = TagData(
+                    "tag",
+                    f"{tagger.name} <{tagger.email}>",
+                    format_time(tagger.time, timedelta(minutes=tagger.offset)),
+                    obj.message,
+                )
+            else:
+                result[sha] = TagData(obj.type_str, "", "", "")
+        return result
+
+    def _mailmap(self) -> Any:
+        return self.pygit2.Mailmap.from_repository(self.repo)
+
+    @profiled(GIT)
+    def walk(
+        self, tags: Optional[Collection[str]] = None, base: Optional[str] = None
+    ) -> Iterator[Commit]:
+        try:
+            repo = self.repo
+        except BackendUnavailable as e:
+            LOG.debug(f"{self!r} unavailable, walking with git cli: {e}")
+            yield from super().walk(tags, base)
+            return
+
+        pygit2 = self.pygit2
+        names: Dict[str, List[str]] = {}
+        commit_for: Dict[str, Any] = {}
+        for ref in self.list_tags():
+            commit = repo[ref.sha].peel(pygit2.Commit)
+            names.setdefault(str(commit.id), []).append(ref.name)
+            commit_for[ref.name] = commit
+        heads = [
+            commit_for[name].id
+            for name in (commit_for if tags is None else tags)
+            if name in commit_for
+        ]
+        if not heads:
+            return
+
+        mailmap = self._mailmap()
+        walker = repo.walk(heads[0], pygit2.GIT_SORT_TOPOLOGICAL)
+        for head in heads[1:]:
+            walker.push(head)
+        if base is not None and base in commit_for:
+            for parent in commit_for[base].parent_ids:
+                walker.hide(parent)
+        # reversing the walk (instead of GIT_SORT_REVERSE) keeps parents first
+        commits = list(walker)
+        for commit in reversed(commits):
+            sha = str(commit.id)
+            yield Commit(
+                sha,
+                tuple(str(parent) for parent in commit.parent_ids),
+                mailmap.resolve_signature(commit.author).name,
+                names.get(sha, []),
+            )
+
+    @profiled(GIT)
+    def shortlog(self, rev: str, exclude: Optional[str] = None) -> str:
+        try:
+            repo = self.repo
+        except BackendUnavailable as e:
+            LOG.debug(f"{self!r} unavailable, reading shortlog with git cli: {e}")
+            return super().shortlog(rev, exclude)
+
+        pygit2 = self.pygit2
+        walker = repo.walk(repo.revparse_single(rev).peel(pygit2.Commit).id)
+        if exclude is not None:
+            walker.hide(repo.revparse_single(exclude).peel(pygit2.Commit).id)
+        mailmap = self._mailmap()
+        counts = Counter(
+            mailmap.resolve_signature(commit.author).name for commit in walker
+        )
+        return format_shortlog(counts)
+
+
+class DulwichBackend(CliBackend):
+    """
+    Read tag objects and history in process with dulwich.
+
+    Tags are listed from the refs like the CLI backend, and dulwich is only imported
+    once objects or history are read. Writes go through the git CLI, to respect
+    signing config, hooks, and the index.
+    """
+
+    name = "dulwich"
+
+    def __init__(self, root: Optional[Path] = None):
+        if find_spec("dulwich") is None:
+            raise BackendUnavailable("dulwich not installed")
+        super().__init__(root)
+        self._repo: Any = None
+
+    def __repr__(self) -> str:
+        return f"DulwichBackend({self.root!r})"
+
+    @property
+    def repo(self) -> Any:
+        """Repository, opened on first use"""
+        if self._repo is None:
+            try:
+                from dulwich.errors import NotGitRepository
+                from dulwich.repo import Repo
+            except ImportError as e:
+                raise BackendUnavailable(f"dulwich failed to import: {e}") from e
+
+            try:
+                self._repo = Repo.discover(
+                    str(Path.cwd() if self.root is None else self.root)
+                )
+            except NotGitRepository as e:
+                raise BackendUnavailable(f"no repository found for {self.root}") from e
+        return self._repo
+
+    @profiled(GIT)
+    def read_tags(self, shas: Collection[str]) -> Dict[str, TagData]:
+        try:
+            repo = self.repo
+        except BackendUnavailable as e:
+            LOG.debug(f"{self!r} unavailable, reading tags with git cli: {e}")
+            return super().read_tags(shas)
+
+        result: Dict[str, TagData] = {}
+        for sha in shas:
+            try:
+                obj = repo[sha.encode("ascii")]
+            except KeyError:
+                continue
+            kind = obj.type_name.decode("ascii")
+            if kind == "tag":
+                content = obj.message + (getattr(obj, "signature", None) or b"")
+                result[sha] = TagData(
+                    "tag",
+                    obj.tagger.decode("utf-8", errors="replace"),
+                    format_time(obj.tag_time, timedelta(seconds=obj.tag_timezone)),
+                    content.decode("utf-8", errors="replace"),
+                )
+            else:
+                result[sha] = TagData(kind, "", "", "")
+        return result
+
+    def _peel(self, sha: bytes) -> bytes:
+        obj = self.repo[sha]
+        while obj.type_name == b"tag":
+            sha = obj.object[1]
+            obj = self.repo[sha]
+        return sha
+
+    def _author(self, mailmap: Any, identity: bytes) -> str:
+        if mailmap is not None:
+            identity = mailmap.lookup(identity)
+        name = identity.split(b" <", 1)[0]
+        return name.decode("utf-8", errors="replace")
+
+    def _mailmap(self) -> Any:
+        from dulwich.mailmap import Mailmap
+
+        path = Path(self.repo.path) / ".mailmap"
+        return Mailmap.from_path(str(path)) if path.is_file() else None
+
+    @profiled(GIT)
+    def walk(
+        self, tags: Optional[Collection[str]] = None, base: Optional[str] = None
+    ) -> Iterator[Commit]:
+        try:
+            repo = self.repo
+        except BackendUnavailable as e:
+            LOG.debug(f"{self!r} unavailable, walking with git cli: {e}")
+            yield from super().walk(tags, base)
+            return
+
+        from dulwich.walk import ORDER_TOPO
+
+        names: Dict[bytes, List[str]] = {}
+        commit_for: Dict[str, bytes] = {}
+        for ref in self.list_tags():
+            commit = self._peel(ref.sha.encode("ascii"))
+            names.setdefault(commit, []).append(ref.name)
+            commit_for[ref.name] = commit
+        include = list(
+            dict.fromkeys(
+                commit_for[name]
+                for name in (commit_for if tags is None else tags)
+                if name in commit_for
+            )
+        )
+        if not include:
+            return
+
+        exclude = []
+        if base is not None and base in commit_for:
+            exclude = list(repo[commit_for[base]].parents)
+
+        mailmap = self._mailmap()
+        walker = repo.get_walker(include=include, exclude=exclude, order=ORDER_TOPO)
+        commits = [entry.commit for entry in walker]
+        for commit in reversed(commits):
+            yield Commit(
+                commit.id.decode("ascii"),
+                tuple(parent.decode("ascii") for parent in commit.parents),
+                self._author(mailmap, commit.author),
+                names.get(commit.id, []),
+            )
+
+    @profiled(GIT)
+    def shortlog(self, rev: str, exclude: Optional[str] = None) -> str:
+        try:
+            repo = self.repo
+        except BackendUnavailable as e:
+            LOG.debug(f"{self!r} unavailable, reading shortlog with git cli: {e}")
+            return super().shortlog(rev, exclude)
+
+        from dulwich.objectspec import parse_commit
+
+        # parse_commit returns annotated tags as-is, so peel them to commits
+        include = self._peel(parse_commit(repo, rev.encode("utf-8")).id)
+        excludes = []
+        if exclude is not None:
+            excludes.append(self._peel(parse_commit(repo, exclude.encode("utf-8")).id))
+        mailmap = self._mailmap()
+        walker = repo.get_walker(include=[include], exclude=excludes)
+        counts = Counter(self._author(mailmap, entry.commit.author) for entry in walker)
+        return format_shortlog(counts)
+
+
+def select_backend(root: Optional[Path] = None, name: str = "auto") -> GitBackend:
+    """
+    Pick a git backend by name, or the first available in-process backend.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"unknown git backend {name!r}")
+
+    in_process: Dict[str, List[Type[CliBackend]]] = {
+        "auto": [Pygit2Backend, DulwichBackend],
+        "pygit2": [Pygit2Backend],
+        "dulwich": [DulwichBackend],
+    }
+    candidates = in_process.get(name, [])
+    for cls in candidates:
+        try:
+            return cls(root)
+        except BackendUnavailable as e:
+            if name != "auto":
+                LOG.warning(f"git backend {name} unavailable, using git cli: {e}")
+            else:
+                LOG.debug(f"git backend {cls.name} unavailable: {e}")
+
+    return CliBackend(root)
@@ -0,0 +1,11 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT license
+
+"""
+Benchmarks for changelog generation on synthetic repositories
+"""
+
+from .repo import build_repo, RepoSpec
+from .suite import CASE_NAMES, run_benchmarks
+
+__all__ = ["build_repo", "CASE_NAMES", "RepoSpec", "run_benchmarks"]
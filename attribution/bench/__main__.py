@@ -0,0 +1,87 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT license
+
+import json
+import logging
+import sys
+from pathlib import Path
+from typing import IO, Optional, Tuple
+
+import click
+
+from .repo import RepoSpec
+from .suite import CASE_NAMES, run_benchmarks
+
+
+@click.command()
+@click.option("--tags", type=click.IntRange(min=1), default=RepoSpec.tags)
+@click.option(
+    "--commits", type=click.IntRange(min=1), default=RepoSpec.commits, help="Per tag"
+)
+@click.option("--authors", type=click.IntRange(min=1), default=RepoSpec.authors)
+@click.option(
+    "--message-lines", type=click.IntRange(min=0), default=RepoSpec.message_lines
+)
+@click.option("--signed", is_flag=True, help="Add PGP signature blocks to tags")
+@click.option(
+    "--packages",
+    type=click.IntRange(min=0),
+    default=RepoSpec.packages,
+    help="Number of Cargo and npm packages",
+)
+@click.option(
+    "--files",
+    type=click.IntRange(min=0),
+    default=RepoSpec.files,
+    help="Number of extra files in the tree",
+)
+@click.option("-r", "--repeat", type=click.IntRange(min=1), default=3)
+@click.option("-c", "--case", "cases", multiple=True, type=click.Choice(CASE_NAMES))
+@click.option(
+    "--repo",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=None,
+    help="Build (or reuse) the repo here instead of a temporary directory",
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.File("w"),
+    default="-",
+    help="Write JSON results to file",
+)
+@click.option("-d", "--debug", is_flag=True, help="Enable debug logging")
+def bench(
+    tags: int,
+    commits: int,
+    authors: int,
+    message_lines: int,
+    signed: bool,
+    packages: int,
+    files: int,
+    repeat: int,
+    cases: Tuple[str, ...],
+    repo: Optional[Path],
+    output: IO[str],
+    debug: bool,
+) -> None:
+    """Time attribution against a synthetic repository, and output JSON results"""
+    logging.basicConfig(
+        level=logging.DEBUG if debug else logging.WARNING, stream=sys.stderr
+    )
+    spec = RepoSpec(
+        tags=tags,
+        commits=commits,
+        authors=authors,
+        message_lines=message_lines,
+        signed=signed,
+        packages=packages,
+        files=files,
+    )
+    results = run_benchmarks(spec, repeat=repeat, cases=cases or None, path=repo)
+    json.dump(results, output, indent=2)
+    output.write("\n")
+
+
+if __name__ == "__main__":
+    bench(prog_name="attribution.bench")  # pylint: disable=unexpected-keyword-arg
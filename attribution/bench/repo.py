@@ -0,0 +1,154 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT license
+
+import json
+import logging
+import subprocess
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+from ..helpers import sh
+
+LOG = logging.getLogger(__name__)
+
+# fixed timestamps keep generated repos (and their shas) identical between runs
+EPOCH = 1600000000
+FAKE_SIGNATURE = (
+    "-----BEGIN PGP SIGNATURE-----\n\n"
+    "iQIzBAABCAAdFiEEbenchmarkbenchmarkbenchmarkbenchmarkFAmBench\n"
+    "=fake\n"
+    "-----END PGP SIGNATURE-----\n"
+)
+
+
+@dataclass
+class RepoSpec:
+    """Shape of a synthetic repository"""
+
+    tags: int = 50
+    commits: int = 20  # per tag
+    authors: int = 10
+    message_lines: int = 5  # per tag message
+    signed: bool = False
+    packages: int = 0  # each of Cargo.toml and package.json
+    files: int = 0  # extra files spread through the tree
+
+    @property
+    def cargo_packages(self) -> List[str]:
+        return [f"crate-{index}" for index in range(self.packages)]
+
+    @property
+    def npm_packages(self) -> List[str]:
+        return [f"@bench/pkg-{index}" for index in range(self.packages)]
+
+
+def tag_name(index: int) -> str:
+    return f"v1.{index}.0"
+
+
+def data(content: str) -> str:
+    """Format a fast-import data block"""
+    return f"data {len(content.encode('utf-8'))}\n{content}\n"
+
+
+def initial_files(spec: RepoSpec) -> Iterator[Tuple[str, str]]:
+    """Yield (path, content) for every file in the first commit"""
+    config = {
+        "name": "bench",
+        "package": "bench",
+        "signed_tags": False,
+        "version_file": True,
+        "cargo_packages": spec.cargo_packages,
+        "npm_packages": spec.npm_packages,
+    }
+    lines = ["[tool.attribution]"]
+    lines += [f"{key} = {json.dumps(value)}" for key, value in config.items()]
+    yield "pyproject.toml", "\n".join(lines) + "\n"
+    yield "bench/__init__.py", ""
+    yield "bench/__version__.py", '__version__ = "0.0.0"\n'
+    yield ".mailmap", ""
+
+    for index, (crate, npm) in enumerate(zip(spec.cargo_packages, spec.npm_packages)):
+        base = f"packages/group-{index % 10}/pkg-{index}"
+        yield f"{base}/Cargo.toml", (
+            f'[package]\nname = "{crate}"\nversion = "0.0.0"\nedition = "2021"\n'
+        )
+        yield f"{base}/Cargo.lock", (
+            f'version = 3\n\n[[package]]\nname = "{crate}"\nversion = "0.0.0"\n'
+        )
+        package = {"name": npm, "version": "0.0.0", "private": True}
+        yield f"{base}/package.json", json.dumps(package, indent=4) + "\n"
+        lock = {
+            "name": npm,
+            "version": "0.0.0",
+            "lockfileVersion": 2,
+            "packages": {"": {"name": npm, "version": "0.0.0"}},
+        }
+        yield f"{base}/package-lock.json", json.dumps(lock, indent=4) + "\n"
+
+    for index in range(spec.files):
+        yield f"src/dir-{index % 100}/sub-{index % 7}/file-{index}.txt", f"{index}\n"
+
+
+def fast_import_stream(spec: RepoSpec) -> Iterator[str]:
+    """Generate a `git fast-import` stream for the repository described by spec"""
+    timestamp = EPOCH
+    mark = 0
+
+    def author(index: int) -> str:
+        return (
+            f"Author {index % spec.authors} <author{index % spec.authors}@example.com>"
+        )
+
+    mark += 1
+    yield f"commit refs/heads/main\nmark :{mark}\n"
+    yield f"author {author(0)} {timestamp} +0000\n"
+    yield f"committer {author(0)} {timestamp} +0000\n"
+    yield data("initial commit")
+    for path, content in initial_files(spec):
+        yield f"M 100644 inline {path}\n" + data(content)
+
+    commit = 0
+    for tag in range(spec.tags):
+        for _ in range(spec.commits):
+            commit += 1
+            timestamp += 60
+            mark += 1
+            yield f"commit refs/heads/main\nmark :{mark}\n"
+            yield f"author {author(commit)} {timestamp} +0000\n"
+            yield f"committer {author(0)} {timestamp} +0000\n"
+            yield data(f"commit {commit}\n\nchange number {commit}")
+            yield f"from :{mark - 1}\n"
+            yield "M 100644 inline CHANGES.txt\n" + data(f"{commit}\n")
+
+        timestamp += 60
+        message = "\n".join(
+            f"- change {line} in release {tag}" for line in range(spec.message_lines)
+        )
+        message = f"Release {tag_name(tag)}\n\n{message}\n"
+        if spec.signed:
+            message += FAKE_SIGNATURE
+        yield f"tag {tag_name(tag)}\nfrom :{mark}\n"
+        yield f"tagger {author(0)} {timestamp} +0000\n"
+        yield data(message)
+
+
+def build_repo(path: Path, spec: RepoSpec) -> Path:
+    """Create a synthetic git repository at path, returning the path"""
+    path.mkdir(parents=True, exist_ok=True)
+    sh("git", "-C", str(path), "init", "-q", "-b", "main")
+    sh("git", "-C", str(path), "config", "user.name", "Benchmark")
+    sh("git", "-C", str(path), "config", "user.email", "bench@example.com")
+    sh("git", "-C", str(path), "config", "commit.gpgsign", "false")
+    sh("git", "-C", str(path), "config", "tag.gpgsign", "false")
+
+    LOG.debug(f"building {spec} at {path}")
+    subprocess.run(
+        ("git", "-C", str(path), "fast-import", "--quiet"),
+        input="".join(fast_import_stream(spec)),
+        encoding="utf-8",
+        check=True,
+    )
+    sh("git", "-C", str(path), "checkout", "-q", "-f", "main")
+    return path
@@ -0,0 +1,188 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT license
+
+import contextlib
+import logging
+import os
+import platform
+import shutil
+import statistics
+import sys
+import time
+from dataclasses import asdict
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+from click.testing import CliRunner
+
+from ..__version__ import __version__
+from ..generate import CargoFile, Changelog, NpmFile
+from ..helpers import git_batch, sh
+from ..project import Project
+from ..tag import Tag
+from .repo import build_repo, RepoSpec
+
+LOG = logging.getLogger(__name__)
+
+
+class Case(NamedTuple):
+    """
+    A single benchmark: `setup` runs untimed before every repetition, and its
+    result is passed to the timed `run`.
+    """
+
+    name: str
+    setup: Callable[[Path, RepoSpec], Any]
+    run: Callable[[Any], Any]
+
+
+@contextlib.contextmanager
+def chdir(path: Path) -> Iterator[None]:
+    cwd = Path.cwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def fresh_project(root: Path, spec: RepoSpec) -> Project:
+    """Load the project without persistent caches or running git processes"""
+    git_batch(root).close()
+    project = Project.load(root)
+    project.cache = False
+    return project
+
+
+def fresh_tags(root: Path, spec: RepoSpec) -> List[Tag]:
+    git_batch(root).close()
+    return Tag.all_tags(root)
+
+
+def copy_repo(root: Path, spec: RepoSpec) -> Path:
+    """Copy the repo for cases that modify it; copies are removed after the run"""
+    target = root.parent / f"{root.name}-copy"
+    if target.exists():
+        shutil.rmtree(target)
+    shutil.copytree(root, target, symlinks=True)
+    return target
+
+
+def tag_flow(root: Path) -> None:
+    from ..main import main
+
+    with chdir(root):
+        result = CliRunner().invoke(
+            main, ["tag", "--no-cache", "-m", "Benchmark release", "v2.0.0"]
+        )
+    if result.exception is not None:
+        raise result.exception
+
+
+CASES = [
+    Case(
+        "all_tags",
+        lambda root, spec: git_batch(root).close(),
+        lambda _: Tag.all_tags(),
+    ),
+    Case(
+        "tag_message",
+        fresh_tags,
+        lambda tags: [tag.message for tag in tags],
+    ),
+    Case(
+        "tag_shortlog",
+        fresh_tags,
+        lambda tags: [tag.shortlog for tag in tags],
+    ),
+    Case(
+        "changelog_generate",
+        fresh_project,
+        lambda project: Changelog(project).generate(),
+    ),
+    Case(
+        "cargo_search",
+        fresh_project,
+        lambda project: CargoFile.search(project, project.config["cargo_packages"]),
+    ),
+    Case(
+        "npm_search",
+        fresh_project,
+        lambda project: NpmFile.search(project, project.config["npm_packages"]),
+    ),
+    Case("tag_flow", copy_repo, tag_flow),
+]
+CASE_NAMES = [case.name for case in CASES]
+
+
+def time_case(case: Case, root: Path, spec: RepoSpec, repeat: int) -> Dict[str, Any]:
+    """Run a case `repeat` times in the repo, returning timings in seconds"""
+    timings: List[float] = []
+    with chdir(root):
+        for _ in range(repeat):
+            state = case.setup(root, spec)
+            before = time.perf_counter()
+            case.run(state)
+            timings.append(time.perf_counter() - before)
+
+    return {
+        "runs": repeat,
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings),
+        "max": max(timings),
+    }
+
+
+def environment() -> Dict[str, str]:
+    return {
+        "attribution": __version__,
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "git": sh("git", "--version").strip(),
+    }
+
+
+def run_benchmarks(
+    spec: RepoSpec,
+    *,
+    repeat: int = 3,
+    cases: Optional[Sequence[str]] = None,
+    path: Optional[Path] = None,
+) -> Dict[str, Any]:
+    """
+    Build a synthetic repo from spec and time each of the selected cases.
+
+    The repo is built in a temporary directory unless a path is given, which lets
+    the same repo be reused between runs to compare changes. Results are returned
+    as a JSON-serializable dict.
+    """
+    selected = [case for case in CASES if cases is None or case.name in cases]
+    results: Dict[str, Any] = {}
+    with TemporaryDirectory(prefix="attribution-bench-") as td:
+        if path is None:
+            root = Path(td) / "repo"
+            before = time.perf_counter()
+            build_repo(root, spec)
+            results["build"] = time.perf_counter() - before
+        else:
+            root = path.resolve()
+            if not (root / ".git").exists():
+                build_repo(root, spec)
+
+        timings: Dict[str, Any] = {}
+        for case in selected:
+            LOG.info(f"running {case.name}")
+            timings[case.name] = time_case(case, root, spec, repeat)
+        results["cases"] = timings
+
+        shutil.rmtree(root.parent / f"{root.name}-copy", ignore_errors=True)
+        git_batch(root).close()
+
+    return {
+        "environment": environment(),
+        "spec": asdict(spec),
+        "results": results,
+    }
@@ -0,0 +1,176 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT license
+
+import hashlib
+import json
+import logging
+import os
+import subprocess
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .helpers import ash, sh
+from .profile import PARSE, span
+from .tag import Tag
+
+LOG = logging.getLogger(__name__)
+
+CACHE_DIR = "attribution-cache"
+CACHE_VERSION = 3
+DEFAULT_MAX_SIZE = 32 * 1024 * 1024
+
+# fingerprint of the tags a shortlog from the given base depends on, if cacheable
+Context = Callable[[str], Optional[str]]
+
+
+class TagCache:
+    """
+    Persistent cache of tag messages and shortlogs, stored in the git directory.
+
+    Entries are keyed by the tag object and any config or mailmap that affects the
+    computed values. Each entry also records the base tag its shortlog was computed
+    from, along with a fingerprint of every tag ref in the repo, and is only used
+    while that fingerprint still matches. Adding, moving, or deleting any tag, even
+    one that isn't a version, results in a cache miss rather than a stale value.
+    """
+
+    FIELDS = ("_message", "_signature", "_shortlog_cmd", "_shortlog")
+
+    def __init__(self, path: Path, max_size: int = DEFAULT_MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+
+    def __repr__(self) -> str:
+        return f"TagCache({self.path!r}, max_size={self.max_size!r})"
+
+    @classmethod
+    def for_repo(cls, root: Path) -> Optional["TagCache"]:
+        """Find the cache location for the git repo at the given path"""
+        try:
+            git_dir = sh("git", "-C", str(root), "rev-parse", "--git-common-dir")
+        except subprocess.CalledProcessError:
+            LOG.debug(f"no git directory found for {root}, tag cache disabled")
+            return None
+
+        return TagCache(root / git_dir.strip() / CACHE_DIR)
+
+    @classmethod
+    async def afor_repo(cls, root: Path) -> Optional["TagCache"]:
+        """Async version of `for_repo`"""
+        try:
+            git_dir = await ash("git", "rev-parse", "--git-common-dir", cwd=root)
+        except subprocess.CalledProcessError:
+            LOG.debug(f"no git directory found for {root}, tag cache disabled")
+            return None
+
+        return TagCache(root / git_dir.strip() / CACHE_DIR)
+
+    def key(self, tag: Tag, salt: Sequence[Any]) -> str:
+        """Build a cache key for the given tag, or an empty string if uncacheable"""
+        if not tag.sha:
+            return ""
+        value = [CACHE_VERSION, tag.name, tag.sha, *salt]
+        return hashlib.sha256(json.dumps(value).encode("utf-8")).hexdigest()
+
+    def entry(self, key: str) -> Path:
+        return self.path / f"{key}.json"
+
+    def load(self, tag: Tag, key: str, context: Context) -> bool:
+        """
+        Fill in cached values for the given tag, returning True on cache hit.
+
+        `context(base)` must match the fingerprint stored with the entry, for the
+        shortlog base that the entry was computed from.
+        """
+        if not key:
+            return False
+        path = self.entry(key)
+        try:
+            with span(PARSE, "json"):
+                data = json.loads(path.read_text())
+        except (OSError, ValueError):
+            return False
+
+        base = data.get("base")
+        if not isinstance(base, str) or data.get("context") != context(base):
+            return False
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        for name in self.FIELDS:
+            setattr(tag, name, data.get(name))
+        return True
+
+    def store(self, tag: Tag, key: str, context: Context) -> None:
+        """
+        Save computed values for the given tag, with the context of its base.
+
+        Tags whose shortlog failed to load aren't saved, so the next run tries again.
+        """
+        if not key or tag._shortlog_cmd is None or tag._shortlog_failed:
+            return
+        base = tag.shortlog_base
+        fingerprint = context(base)
+        if fingerprint is None:
+            return
+        data: Dict[str, Optional[str]] = {
+            name: getattr(tag, name) for name in self.FIELDS
+        }
+        data["base"] = base
+        data["context"] = fingerprint
+        self._write(self.entry(key), data)
+
+    def _write(self, path: Path, data: Any) -> None:
+        tmp = path.with_suffix(".tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp.write_text(json.dumps(data))
+            os.replace(tmp, path)
+        except OSError:
+            LOG.warning(f"failed to write tag cache entry {path}", exc_info=True)
+
+    def sections_entry(self, name: str) -> Path:
+        digest = hashlib.sha256(name.encode("utf-8")).hexdigest()
+        return self.path / "sections" / f"{digest}.json"
+
+    def load_sections(self, name: str) -> Dict[str, List[str]]:
+        """Fingerprints of rendered changelog sections, keyed by tag name"""
+        try:
+            with span(PARSE, "json"):
+                data = json.loads(self.sections_entry(name).read_text())
+        except (OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def store_sections(self, name: str, sections: Dict[str, List[str]]) -> None:
+        """Save fingerprints of the sections in a rendered changelog"""
+        self._write(self.sections_entry(name), sections)
+
+    def entries(self) -> List[Tuple[float, int, Path]]:
+        """List existing entries as (last use, size, path), oldest first"""
+        result: List[Tuple[float, int, Path]] = []
+        try:
+            with os.scandir(self.path) as it:
+                for entry in it:
+                    if entry.name.endswith(".json"):
+                        stat = entry.stat()
+                        result.append((stat.st_mtime, stat.st_size, Path(entry.path)))
+        except OSError:
+            pass
+        result.sort()
+        return result
+
+    def prune(self) -> None:
+        """Remove least recently used entries until the cache fits in max_size"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
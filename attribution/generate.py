@@ -1,15 +1,123 @@
 # Copyright 2022 Amethyst Reese
 # Licensed under the MIT license
 
+import hashlib
 import json
+import logging
+import os
+import re
 import textwrap
+from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import Any, List, Tuple
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    IO,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+)
 
 import tomlkit
-from jinja2 import Template
+from jinja2 import BaseLoader, Environment, Template, TemplateNotFound
+from jinja2.bccache import Bucket, BytecodeCache, FileSystemBytecodeCache
 
+from .helpers import replace_file, write_file
+from .lockfile import patch_cargo_lock, patch_package_lock, UnsupportedLockfile
+from .profile import iterate, PARSE, span, TEMPLATE
 from .project import Project
+from .search import cargo_lock_file, cargo_package_name, npm_lock_file, npm_package_name
+from .tag import Tag, Tags
+
+LOG = logging.getLogger(__name__)
+
+SECTION_HEADING_RE = re.compile(r"\n\n\n([^\n]+)\n(-+)\n\n")
+TEMPLATE_FILE_PREFIX = "file:"
+
+
+class TemplateBytecodeCache(BytecodeCache):
+    """
+    Keep compiled template bytecode in memory, and optionally on disk.
+
+    The on-disk cache is only used after calling `use_directory`, and is shared
+    between processes; jinja checks the template source checksum before using
+    any cached bytecode.
+    """
+
+    def __init__(self) -> None:
+        self.mapping: Dict[str, bytes] = {}
+        self.filesystem: Optional[FileSystemBytecodeCache] = None
+
+    def use_directory(self, path: Optional[Path]) -> None:
+        if path is None:
+            self.filesystem = None
+        elif self.filesystem is None or self.filesystem.directory != str(path):
+            self.filesystem = FileSystemBytecodeCache(str(path))
+
+    def load_bytecode(self, bucket: Bucket) -> None:
+        code = self.mapping.get(bucket.key)
+        if code is not None:
+            bucket.bytecode_from_string(code)
+        elif self.filesystem is not None:
+            self.filesystem.load_bytecode(bucket)
+            if bucket.code is not None:
+                self.mapping[bucket.key] = bucket.bytecode_to_string()
+
+    def dump_bytecode(self, bucket: Bucket) -> None:
+        self.mapping[bucket.key] = bucket.bytecode_to_string()
+        if self.filesystem is not None:
+            try:
+                os.makedirs(self.filesystem.directory, exist_ok=True)
+                self.filesystem.dump_bytecode(bucket)
+            except OSError:
+                LOG.debug("failed to write template bytecode", exc_info=True)
+
+    def clear(self) -> None:
+        self.mapping.clear()
+        if self.filesystem is not None:
+            self.filesystem.clear()
+
+
+class TemplateLoader(BaseLoader):
+    """
+    Load builtin templates by class name, or user templates by `file:<path>`.
+    """
+
+    def get_source(
+        self, environment: Environment, template: str
+    ) -> Tuple[str, Optional[str], Callable[[], bool]]:
+        if template.startswith(TEMPLATE_FILE_PREFIX):
+            path = Path(template[len(TEMPLATE_FILE_PREFIX) :])
+            try:
+                mtime = path.stat().st_mtime
+                source = path.read_text()
+            except OSError:
+                raise TemplateNotFound(template)
+
+            def uptodate() -> bool:
+                try:
+                    return path.stat().st_mtime == mtime
+                except OSError:
+                    return False
+
+            return source, str(path), uptodate
+
+        cls = GENERATED_FILES.get(template)
+        if cls is None:
+            raise TemplateNotFound(template)
+        original = cls.TEMPLATE
+        return textwrap.dedent(original), None, lambda: cls.TEMPLATE is original
+
+
+BYTECODE_CACHE = TemplateBytecodeCache()
+ENVIRONMENT = Environment(loader=TemplateLoader(), bytecode_cache=BYTECODE_CACHE)
+GENERATED_FILES: Dict[str, Type["GeneratedFile"]] = {}
 
 
 class GeneratedFile:
@@ -17,11 +125,16 @@ class GeneratedFile:
     FILENAME: str = "FAKE.md"
     TEMPLATE: str = "FAKE FILE, DO NOT COMMIT!"
 
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        super().__init_subclass__(**kwargs)
+        GENERATED_FILES[f"{cls.__module__}.{cls.__qualname__}"] = cls
+
     def __init__(self, project: Project, **kwargs: str):
         self.project = project
         assert all(kw in kwargs for kw in self.EXPECTS)
         self.kwargs = kwargs
         self.filename = project.root / self.FILENAME.format(project=project, **kwargs)
+        self.changed = False
 
     def __eq__(self, other: Any) -> bool:
         return (  # noqa E721
@@ -33,32 +146,83 @@ class GeneratedFile:
     def __repr__(self) -> str:
         return f"CargoFile({self.project!r}, **{self.kwargs!r})"
 
-    def generate(self) -> str:
-        tags = self.project.tags
-        template = Template(textwrap.dedent(self.TEMPLATE))
-        output = template.render(
+    def template_name(self) -> str:
+        """Name of the template to load, preferring any configured override"""
+        cls = type(self)
+        overrides = self.project.config.get("templates", {})
+        override = overrides.get(cls.__name__.lower())
+        if override:
+            return TEMPLATE_FILE_PREFIX + str(self.project.root / override)
+        return f"{cls.__module__}.{cls.__qualname__}"
+
+    def template(self) -> Template:
+        tag_cache = self.project.tag_cache
+        BYTECODE_CACHE.use_directory(
+            tag_cache.path / "templates" if tag_cache else None
+        )
+        with span(TEMPLATE, "load"):
+            return ENVIRONMENT.get_template(self.template_name())
+
+    def context(self, tags: Optional[Iterable[Tag]] = None) -> Dict[str, Any]:
+        return dict(
             project=self.project,
-            tags=tags,
+            tags=self.project.tags if tags is None else tags,
             len=len,
             **self.kwargs,
         )
+
+    def generate(self) -> str:
+        template = self.template()
+        with span(TEMPLATE, type(self).__name__):
+            output = template.render(**self.context())
         return output
 
+    async def agenerate(self) -> str:
+        """Async version of `generate`, loading tag data without blocking the loop"""
+        await self.project.aprefetch()
+        return self.generate()
+
+    def chunks(self) -> Iterator[str]:
+        """Render the file in chunks, for subclasses that support streaming"""
+        yield self.generate()
+
+    def stream(self, fp: IO[str]) -> None:
+        """Write rendered chunks to the given file as they're generated"""
+        for chunk in self.chunks():
+            fp.write(chunk)
+
     def write(self) -> Path:
-        content = self.generate()
-        self.filename.write_text(content)
+        """
+        Write the rendered file, leaving it untouched if the content is unchanged.
+
+        Sets `changed` to whether the file was modified.
+        """
+        tmp = self.filename.with_name(f".{self.filename.name}.tmp")
+        try:
+            with tmp.open("w") as fp:
+                self.stream(fp)
+            self.changed = replace_file(tmp, self.filename)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
         return self.filename
 
 
+GENERATED_FILES[f"{__name__}.GeneratedFile"] = GeneratedFile
+
+
 class Changelog(GeneratedFile):
     FILENAME = "CHANGELOG.md"
     TEMPLATE = """
-        {{- project.name }}
+        {%- macro header() -%}
+        {{ project.name }}
         {{ "=" * len(project.name) }}
 
         [![Generated by attribution][attribution-badge]][attribution-url]
 
-        {% for tag in tags %}
+        {% endmacro -%}
+
+        {% macro section(tag) %}
         {{ tag.name }}
         {{ "-" * len(tag.name) }}
 
@@ -70,14 +234,171 @@ class Changelog(GeneratedFile):
         ```
         {%- endif %}
 
-        {% endfor -%}
+        {% endmacro -%}
 
+        {% macro footer() -%}
         [attribution-badge]:
             https://img.shields.io/badge/generated%20by-attribution-informational
         [attribution-url]: https://attribution.omnilib.dev
+        {% endmacro -%}
 
+        {{ header() }}
+        {%- for tag in tags %}{{ section(tag) }}{% endfor %}
+        {{- footer() }}
     """
 
+    def generate(self, tags: Optional[Sequence[Tag]] = None) -> str:
+        """Render the changelog, or only sections for the given tags"""
+        if tags is None:
+            self.project.prefetch()
+            return super().generate()
+        return "".join(self.chunks(tags))
+
+    async def agenerate(self) -> str:
+        """Async version of `generate`, loading tag data only with `aprefetch`"""
+        await self.project.aprefetch()
+        return super().generate()
+
+    def chunks(self, tags: Optional[Sequence[Tag]] = None) -> Iterator[str]:
+        """
+        Render the changelog in chunks, loading tag data once the header is done.
+
+        Given a subset of tags, such as from `Project.tag_range`, only those tags
+        are loaded and rendered.
+        """
+        template = self.template()
+        return iterate(
+            TEMPLATE,
+            type(self).__name__,
+            template.generate(**self.context(tags=self.project.iter_tags(tags))),
+        )
+
+    def macros(self) -> Any:
+        """Template module with the header, section, and footer macros"""
+        return self.template().make_module(self.context(tags=[]))
+
+    def sections(self, content: str, tags: Tags) -> Optional[Dict[str, str]]:
+        """
+        Split an existing changelog into rendered sections for the given tags.
+
+        Returns None if the content doesn't match the current template, or contains
+        sections for tags that no longer exist.
+        """
+        module = self.macros()
+        if not all(hasattr(module, name) for name in ("header", "section", "footer")):
+            return None  # custom template without the builtin macros
+
+        header = str(module.header())
+        footer = str(module.footer())
+        if not (content.startswith(header) and content.endswith(footer)):
+            return None
+
+        body = content[len(header) : len(content) - len(footer)]
+        positions: List[Tuple[int, str]] = []
+        offset = 0
+        for tag in tags:
+            heading = f"\n{tag.name}\n{'-' * len(tag.name)}\n\n"
+            index = body.find(heading, offset)
+            if index >= 0:
+                positions.append((index, tag.name))
+                offset = index + len(heading)
+
+        if (positions[0][0] if positions else len(body)) != 0:
+            return None
+
+        sections: Dict[str, str] = {}
+        ends = [index for index, _ in positions[1:]] + [len(body)]
+        for (start, name), end in zip(positions, ends):
+            section = body[start:end]
+            for match in SECTION_HEADING_RE.finditer(section):
+                if len(match.group(1)) == len(match.group(2)):
+                    return None  # section for an unknown or deleted tag
+            sections[name] = section
+
+        return sections
+
+    def update(self, *, verify: bool = False) -> Path:
+        """
+        Rewrite the changelog, only rendering sections for new or modified tags.
+
+        Rendered sections are fingerprinted in the tag cache, along with the tag data,
+        tag refs, and template they came from. Existing sections are kept as-is while
+        their fingerprint still matches, and everything else is loaded and rendered
+        again, including every section when the tag cache is disabled. Falls back to a
+        full render if the existing changelog can't be split into sections.
+        """
+        if not self.filename.is_file():
+            return self.write()
+
+        tags = self.project.tags
+        existing = self.filename.read_text()
+        sections = self.sections(existing, tags)
+        if sections is None:
+            LOG.info(f"unable to split {self.filename}, rendering in full")
+            return self.write()
+
+        cache = self.project.tag_cache
+        record = str(self.filename)
+        known = cache.load_sections(record) if cache is not None else {}
+        salt = self.project.cache_salt()
+        source, _, _ = TemplateLoader().get_source(ENVIRONMENT, self.template_name())
+
+        def fingerprint(tag: Tag, base: str, section: str) -> Optional[List[str]]:
+            key = cache.key(tag, salt) if cache is not None else ""
+            context = self.project.shortlog_context(tag, base)
+            if not key or context is None:
+                return None
+            value = [key, context, source, section]
+            digest = hashlib.sha256(json.dumps(value).encode("utf-8")).hexdigest()
+            return [digest, base]
+
+        stale: Tags = []
+        for tag in tags:
+            section = sections.get(tag.name)
+            entry = known.get(tag.name)
+            if (
+                section is None
+                or not isinstance(entry, list)
+                or len(entry) != 2
+                or fingerprint(tag, entry[1], section) != entry
+            ):
+                stale.append(tag)
+        self.project.prefetch(stale)
+
+        module = self.macros()
+        stale_ids = {id(tag) for tag in stale}
+        chunks = [str(module.header())]
+        fingerprints: Dict[str, List[str]] = {}
+        for tag in tags:
+            if id(tag) in stale_ids:
+                section = str(module.section(tag))
+                entry = None
+                if tag._shortlog_cmd is not None:
+                    entry = fingerprint(tag, tag.shortlog_base, section)
+            else:
+                section = sections[tag.name]
+                entry = known[tag.name]
+            if entry is not None:
+                fingerprints[tag.name] = entry
+            chunks.append(section)
+        chunks.append(str(module.footer()))
+        content = "".join(chunks)
+
+        if verify:
+            full = self.generate()
+            if content != full:
+                LOG.warning(
+                    f"incremental render of {self.filename} does not match full "
+                    "render, writing full render instead"
+                )
+                content = full
+                fingerprints = {}
+
+        self.changed = write_file(self.filename, content)
+        if cache is not None:
+            cache.store_sections(record, fingerprints)
+        return self.filename
+
 
 class Contributors(GeneratedFile):
     FILENAME = "CONTRIBUTORS"
@@ -103,51 +424,175 @@ class VersionFile(GeneratedFile):
         '''
 
 
-class CargoFile(GeneratedFile):
+class LockFile(ABC):
+    """
+    A lockfile shared by one or more packages, such as the lockfile at the root of
+    a workspace, updated with a single read and write for all of them.
+
+    Versions are patched in place, preserving every other byte of the file, with a
+    full parse and reserialize as the fallback for anything the patcher rejects.
+    """
+
+    def __init__(self, filename: Path, version: str = "") -> None:
+        self.filename = filename
+        self.version = version
+        self.package_names: Set[str] = set()
+        self.package_dirs: Set[str] = set()  # relative to the lockfile
+        self.changed = False
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.filename!r}, {self.version!r})"
+
+    @abstractmethod
+    def patch(self, content: bytes) -> bytes:
+        """Update versions in place, or raise `UnsupportedLockfile`"""
+
+    @abstractmethod
+    def reserialize(self, content: bytes) -> bytes:
+        """Update versions by parsing and writing out the whole lockfile"""
+
+    def generate(self) -> bytes:
+        content = self.filename.read_bytes()
+        try:
+            with span(PARSE, "patch"):
+                return self.patch(content)
+        except UnsupportedLockfile as e:
+            LOG.debug(f"unable to patch {self.filename}, parsing in full: {e}")
+        return self.reserialize(content)
+
+    def write(self) -> Path:
+        self.changed = write_file(self.filename, self.generate())
+        return self.filename
+
+
+class CargoLock(LockFile):
+    def patch(self, content: bytes) -> bytes:
+        return patch_cargo_lock(content, self.package_names, self.version)
+
+    def reserialize(self, content: bytes) -> bytes:
+        with span(PARSE, "tomlkit"):
+            lock_data = tomlkit.loads(content.decode("utf-8"))
+            assert 3 <= lock_data.get("version", 0) <= 4
+            for package_data in lock_data.get("package", ()):
+                # local crates have no source, unlike any registry crate of the same name
+                if (
+                    package_data.get("name", "") in self.package_names
+                    and "source" not in package_data
+                ):
+                    package_data["version"] = self.version
+            return tomlkit.dumps(lock_data).encode("utf-8")
+
+
+class NpmLock(LockFile):
+    def patch(self, content: bytes) -> bytes:
+        return patch_package_lock(
+            content, self.package_names, self.version, self.package_dirs
+        )
+
+    def reserialize(self, content: bytes) -> bytes:
+        with span(PARSE, "json"):
+            lock_data = json.loads(content)
+            assert lock_data.get("lockfileVersion", 0) in (2, 3)
+            if lock_data.get("name", "") in self.package_names:
+                lock_data["version"] = self.version
+            for dep_name, dep_data in lock_data.get("packages", {}).items():
+                if (
+                    dep_name in self.package_names
+                    or dep_name in self.package_dirs
+                    or dep_data.get("name", "") in self.package_names
+                ):
+                    dep_data["version"] = self.version
+            return (json.dumps(lock_data, indent=4) + "\n").encode("utf-8")
+
+
+class PackageFile(GeneratedFile, ABC):
+    """
+    A package manifest whose version is also recorded in a lockfile, which may be
+    shared with other packages in the same workspace.
+    """
+
     EXPECTS = ("package_name", "package_dir")
+    LOCK_FILE: Type[LockFile]
+
+    @abstractmethod
+    def lock_file(self, workspaces: Optional[Dict[Path, Any]] = None) -> Optional[Path]:
+        """
+        The lockfile recording this package, if any. Pass the same `workspaces` dict
+        between calls to avoid reading parent manifests more than once.
+        """
+
+    def write(self) -> Path:
+        self.write_all([self])
+        return self.filename
+
+    @classmethod
+    def write_all(cls, package_files: Sequence["PackageFile"]) -> List[Path]:
+        """
+        Write each manifest, then update each lockfile once for all of its packages.
+
+        Returns the paths of manifests and lockfiles that changed.
+        """
+        paths: List[Path] = []
+        locks: Dict[Path, LockFile] = {}
+        workspaces: Dict[Path, Any] = {}
+        for package_file in package_files:
+            GeneratedFile.write(package_file)
+            if package_file.changed:
+                paths.append(package_file.filename)
+            lock_file = package_file.lock_file(workspaces)
+            if lock_file is not None:
+                lock = locks.setdefault(lock_file, package_file.LOCK_FILE(lock_file))
+                lock.version = str(package_file.project.latest.version)
+                lock.package_names.add(package_file.kwargs["package_name"])
+                package_dir = os.path.relpath(
+                    package_file.filename.parent, lock_file.parent
+                )
+                lock.package_dirs.add(
+                    "" if package_dir == os.curdir else Path(package_dir).as_posix()
+                )
+
+        for lock in locks.values():
+            lock.write()
+            if lock.changed:
+                paths.append(lock.filename)
+        return paths
+
+
+class CargoFile(PackageFile):
     FILENAME = "{package_dir}/Cargo.toml"
+    LOCK_FILE = CargoLock
 
     def generate(self) -> str:
         assert self.filename.is_file()
         package_name = self.kwargs["package_name"]
 
-        data = tomlkit.loads(self.filename.read_text())
-        assert "package" in data
-        package_data: tomlkit.items.Table = data.get("package", tomlkit.table())
-        assert package_data.get("name", "") == package_name
-        package_data["version"] = str(self.project.latest.version)
-        return tomlkit.dumps(data)
+        with span(PARSE, "tomlkit"):
+            data = tomlkit.loads(self.filename.read_text())
+            assert "package" in data
+            package_data: tomlkit.items.Table = data.get("package", tomlkit.table())
+            assert package_data.get("name", "") == package_name
+            package_data["version"] = str(self.project.latest.version)
+            return tomlkit.dumps(data)
 
-    def write(self) -> Path:
-        fn = super().write()
-        assert fn.name == "Cargo.toml"
-        lock_file = fn.with_suffix(".lock")
-        if lock_file.is_file():
-            package_name = self.kwargs["package_name"]
-            lock_data = tomlkit.loads(lock_file.read_text())
-            assert 3 <= lock_data.get("version", 0) <= 4
-            for package_data in lock_data.get("package", ()):
-                if package_data.get("name", "") == package_name:
-                    package_data["version"] = str(self.project.latest.version)
-            lock_file.write_text(tomlkit.dumps(lock_data))
-
-        return fn
+    def lock_file(self, workspaces: Optional[Dict[Path, Any]] = None) -> Optional[Path]:
+        """The Cargo.lock recording this crate, shared with its workspace if any"""
+        return cargo_lock_file(self.filename.parent, self.project.root, workspaces)
 
     @classmethod
     def search(cls, project: Project, cargo_packages: List[str]) -> List["CargoFile"]:
+        if not cargo_packages:
+            return []
+
         found_packages: List[Tuple[str, Path]] = []
-        queue = [project.root]
-        while queue:
-            path = queue.pop(0)
-            if path.is_dir():
-                queue += list(path.iterdir())
-            elif path.is_file() and path.name == "Cargo.toml":
-                cargo_data = tomlkit.loads(path.read_text())
-                assert "package" in cargo_data
-                package_data = cargo_data.get("package", tomlkit.table())
-                package_name = package_data.get("name", "")
-                if package_name in cargo_packages:
-                    found_packages.append((package_name, path.parent))
+        for path in project.manifests["Cargo.toml"]:
+            text = path.read_text()
+            if not any(name in text for name in cargo_packages):
+                continue
+            package_name = cargo_package_name(text)
+            if package_name is None:
+                LOG.debug(f"no [package] table in {path}, skipping")
+            elif package_name in cargo_packages:
+                found_packages.append((package_name, path.parent))
 
         return [
             CargoFile(
@@ -159,51 +604,35 @@ class CargoFile(GeneratedFile):
         ]
 
 
-class NpmFile(GeneratedFile):
-    EXPECTS = ("package_name", "package_dir")
+class NpmFile(PackageFile):
     FILENAME = "{package_dir}/package.json"
+    LOCK_FILE = NpmLock
 
     def generate(self) -> str:
         assert self.filename.is_file()
         package_name = self.kwargs["package_name"]
 
-        data = json.loads(self.filename.read_text())
-        assert package_name == data.get("name", None)
-        assert "version" in data
-        data["version"] = str(self.project.latest.version)
-        return json.dumps(data, indent=4) + "\n"
+        with span(PARSE, "json"):
+            data = json.loads(self.filename.read_text())
+            assert package_name == data.get("name", None)
+            assert "version" in data
+            data["version"] = str(self.project.latest.version)
+            return json.dumps(data, indent=4) + "\n"
 
-    def write(self) -> Path:
-        fn = super().write()
-        assert fn.name == "package.json"
-        lock_file = fn.with_name("package-lock.json")
-        if lock_file.is_file():
-            package_name = self.kwargs["package_name"]
-            package_version = str(self.project.latest.version)
-            lock_data = json.loads(lock_file.read_text())
-            assert lock_data.get("lockfileVersion", 0) == 2
-            if lock_data.get("name", "") == package_name:
-                lock_data["version"] = package_version
-            for dep_name, dep_data in list(lock_data.get("packages", {}).items()):
-                if dep_name == package_name or dep_data.get("name", "") == package_name:
-                    lock_data["packages"][dep_name]["version"] = package_version
-            lock_file.write_text(json.dumps(lock_data, indent=4) + "\n")
-
-        return fn
+    def lock_file(self, workspaces: Optional[Dict[Path, Any]] = None) -> Optional[Path]:
+        """The package-lock.json recording this package, shared with its workspace"""
+        return npm_lock_file(self.filename.parent, self.project.root, workspaces)
 
     @classmethod
     def search(cls, project: Project, npm_packages: List[str]) -> List["NpmFile"]:
+        if not npm_packages:
+            return []
+
         found_packages: List[Tuple[str, Path]] = []
-        queue = [project.root]
-        while queue:
-            path = queue.pop(0)
-            if path.is_dir() and path.name != "node_modules":
-                queue += list(path.iterdir())
-            elif path.is_file() and path.name == "package.json":
-                package_data = json.loads(path.read_text())
-                package_name = package_data.get("name", "")
-                if package_name in npm_packages:
-                    found_packages.append((package_name, path.parent))
+        for path in project.manifests["package.json"]:
+            package_name = npm_package_name(path.read_text(), npm_packages)
+            if package_name is not None:
+                found_packages.append((package_name, path.parent))
 
         return [
             NpmFile(
@@ -1,14 +1,44 @@
 # Copyright 2022 Amethyst Reese
 # Licensed under the MIT license
 
+import atexit
 import logging
+import os
 import shlex
 import subprocess
+import sys
+import threading
+import time
+import weakref
+from dataclasses import fields
+from pathlib import Path
+from typing import Any, Dict, NamedTuple, Optional, Type, TYPE_CHECKING, TypeVar, Union
 
-from packaging.utils import canonicalize_name
+from .profile import command_name, GIT, PARSE, PROFILER, span
+
+try:
+    import tomllib
+except ImportError:  # pragma: no cover
+    try:
+        import tomli as tomllib  # type: ignore[no-redef]
+    except ImportError:
+        tomllib = None  # type: ignore[assignment]
+
+if TYPE_CHECKING:
+    import asyncio
+
+T = TypeVar("T")
 
 LOG = logging.getLogger(__name__)
 
+# maximum number of concurrent ash() subprocesses per event loop
+ASH_LIMIT = 8
+ASH_TIMEOUT: Optional[float] = None
+
+_ASH_SEMAPHORES: (
+    "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]"
+) = weakref.WeakKeyDictionary()
+
 
 def sh(*cmd: str, raw: bool = False) -> str:
     """Run a simple command and return mixed stdout/stderr; raise on non-zero exit"""
@@ -16,20 +46,21 @@ def sh(*cmd: str, raw: bool = False) -> str:
         cmd = tuple(shlex.split(cmd[0]))
     LOG.debug(f"running $ {' '.join(shlex.quote(c) for c in cmd)}")
     try:
-        if raw:
-            p = subprocess.run(
-                cmd,
-                check=True,
-                encoding="utf-8",
-            )
-        else:
-            p = subprocess.run(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                check=True,
-                encoding="utf-8",
-            )
+        with span(GIT, command_name(cmd)):
+            if raw:
+                p = subprocess.run(
+                    cmd,
+                    check=True,
+                    encoding="utf-8",
+                )
+            else:
+                p = subprocess.run(
+                    cmd,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    check=True,
+                    encoding="utf-8",
+                )
         return p.stdout
     except subprocess.CalledProcessError as e:
         LOG.debug(
@@ -38,6 +69,245 @@ def sh(*cmd: str, raw: bool = False) -> str:
         raise
 
 
+def sh_stdout(*cmd: str) -> str:
+    """Run a simple command and return stdout, discarding stderr; raise on non-zero exit"""
+    LOG.debug(f"running $ {' '.join(shlex.quote(c) for c in cmd)}")
+    with span(GIT, command_name(cmd)):
+        p = subprocess.run(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+            encoding="utf-8",
+        )
+    return p.stdout
+
+
+async def ash(
+    *cmd: str, cwd: Optional[Path] = None, timeout: Optional[float] = None
+) -> str:
+    """
+    Async version of sh(), returning mixed stdout/stderr; raise on non-zero exit
+
+    At most ASH_LIMIT commands run at once per event loop. Commands running longer
+    than `timeout` (or ASH_TIMEOUT) seconds are killed, raising TimeoutExpired.
+    """
+    import asyncio
+
+    if len(cmd) == 1:
+        cmd = tuple(shlex.split(cmd[0]))
+    if timeout is None:
+        timeout = ASH_TIMEOUT
+
+    loop = asyncio.get_running_loop()
+    if loop not in _ASH_SEMAPHORES:
+        _ASH_SEMAPHORES[loop] = asyncio.Semaphore(ASH_LIMIT)
+
+    async with _ASH_SEMAPHORES[loop]:
+        LOG.debug(f"running $ {' '.join(shlex.quote(c) for c in cmd)}")
+        started = time.perf_counter()
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            cwd=cwd,
+        )
+        try:
+            stdout, _ = await asyncio.wait_for(proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise subprocess.TimeoutExpired(cmd, timeout or 0)
+        except BaseException:
+            proc.kill()
+            await proc.wait()
+            raise
+        finally:
+            PROFILER.record(GIT, command_name(cmd), started)
+
+    output = stdout.decode("utf-8")
+    if proc.returncode:
+        LOG.debug(f"exit code: {proc.returncode}\nstdout:\n{output}")
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output=output)
+    return output
+
+
+class GitObject(NamedTuple):
+    sha: str
+    type: str
+    size: int
+    data: bytes
+
+
+class GitBatch:
+    """
+    Persistent `git cat-file --batch` worker for reading objects.
+
+    Each request is a single line written to an already running process, rather
+    than spawning a new git process for every object read.
+    """
+
+    def __init__(self, root: Optional[Path] = None) -> None:
+        self.root = root
+        self._proc: Optional[subprocess.Popen] = None
+        self._lock = threading.Lock()
+
+    def _start(self) -> subprocess.Popen:
+        proc = self._proc
+        if proc is None or proc.poll() is not None:
+            cmd = ("git", "cat-file", "--batch")
+            LOG.debug(f"starting $ {' '.join(cmd)}")
+            proc = subprocess.Popen(
+                cmd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                cwd=self.root,
+            )
+            self._proc = proc
+        return proc
+
+    def read(self, rev: str) -> Optional[GitObject]:
+        """Return the contents of the given object, or None if missing"""
+        if "\n" in rev:
+            raise ValueError(f"invalid revision {rev!r}")
+
+        with self._lock, span(GIT, "cat-file"):
+            proc = self._start()
+            assert proc.stdin is not None and proc.stdout is not None
+            proc.stdin.write(rev.encode("utf-8") + b"\n")
+            proc.stdin.flush()
+            header = proc.stdout.readline().decode("utf-8")
+            if not header:
+                raise subprocess.CalledProcessError(
+                    proc.poll() or 1, ("git", "cat-file", "--batch")
+                )
+
+            parts = header.rstrip("\n").split(" ")
+            if len(parts) != 3 or parts[-1] in ("missing", "ambiguous"):
+                LOG.debug(f"cat-file {rev!r}: {header.rstrip()}")
+                return None
+            sha, kind, size = parts[0], parts[1], int(parts[2])
+            data = proc.stdout.read(size)
+            proc.stdout.read(1)  # trailing newline
+            return GitObject(sha, kind, size, data)
+
+    def close(self) -> None:
+        """Stop the running worker, if any"""
+        with self._lock:
+            proc, self._proc = self._proc, None
+            if proc is not None:
+                if proc.stdin is not None:
+                    proc.stdin.close()
+                proc.wait()
+                if proc.stdout is not None:
+                    proc.stdout.close()
+
+
+_BATCHES: Dict[Path, GitBatch] = {}
+_BATCHES_LOCK = threading.Lock()
+
+
+def git_batch(root: Optional[Path] = None) -> GitBatch:
+    """Get the shared cat-file worker for the given repo, defaulting to cwd"""
+    key = (root or Path.cwd()).resolve()
+    with _BATCHES_LOCK:
+        if key not in _BATCHES:
+            _BATCHES[key] = GitBatch(key)
+        return _BATCHES[key]
+
+
+@atexit.register
+def _close_batches() -> None:
+    for batch in _BATCHES.values():
+        batch.close()
+    _BATCHES.clear()
+
+
+def read_toml(text: str) -> Dict[str, Any]:
+    """Parse TOML with tomllib when available, only falling back to tomlkit"""
+    if tomllib is not None:
+        with span(PARSE, "tomllib"):
+            return tomllib.loads(text)
+
+    import tomlkit  # pragma: no cover
+
+    with span(PARSE, "tomlkit"):  # pragma: no cover
+        return tomlkit.loads(text)
+
+
+def _move_file(tmp: Path, path: Path) -> None:
+    """Atomically replace path with tmp, keeping the existing file's mode"""
+    import shutil
+
+    if path.exists():
+        shutil.copymode(path, tmp)
+    os.replace(tmp, path)
+
+
+def replace_file(tmp: Path, path: Path) -> bool:
+    """
+    Move a temporary file over path, unless path already has the same content.
+
+    Compares sizes before contents, and leaves an identical file untouched, so
+    that mtimes only change along with content. Returns True if path changed.
+    """
+    import filecmp
+
+    if path.is_file() and filecmp.cmp(tmp, path, shallow=False):
+        tmp.unlink()
+        return False
+    _move_file(tmp, path)
+    return True
+
+
+def write_file(path: Path, content: Union[str, bytes]) -> bool:
+    """
+    Atomically write content to path, unless the file already has that content.
+
+    Returns True if path changed.
+    """
+    data = content.encode("utf-8") if isinstance(content, str) else content
+    try:
+        if path.stat().st_size == len(data) and path.read_bytes() == data:
+            return False
+    except FileNotFoundError:
+        pass
+
+    tmp = path.with_name(f".{path.name}.tmp")
+    try:
+        tmp.write_bytes(data)
+        _move_file(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return True
+
+
+def slotted(cls: Type[T]) -> Type[T]:
+    """
+    Recreate a dataclass with `__slots__` for its fields, dropping `__dict__`.
+
+    Equivalent to `@dataclass(slots=True)` from Python 3.10. The new class has
+    no `__class__` cell, so decorated classes must not use zero-argument `super()`.
+    """
+    names = tuple(field.name for field in fields(cls))  # type: ignore[arg-type]
+    namespace = dict(cls.__dict__)
+    for name in names:
+        namespace.pop(name, None)  # defaults live in __init__, and clash with slots
+    namespace.pop("__dict__", None)
+    namespace.pop("__weakref__", None)
+    namespace["__slots__"] = names
+    metaclass: Any = type(cls)
+    return metaclass(cls.__name__, cls.__bases__, namespace)
+
+
+def intern(value: Optional[str]) -> Optional[str]:
+    """Intern a repeated string value, like a tagger or author, to share memory"""
+    return None if value is None else sys.intern(value)
+
+
 def canonical_namespace(name: str) -> str:
+    from packaging.utils import canonicalize_name
+
     cname = canonicalize_name(name)
     return cname.replace("-", "_")
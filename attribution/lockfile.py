@@ -0,0 +1,225 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT license
+
+"""
+Patch package versions in lockfiles without parsing and reserializing them.
+
+Only the spans of the version strings being changed are rewritten, so every other
+byte is preserved, including formatting choices like indentation that a full
+round trip would lose. Anything that doesn't look like a lockfile written by cargo
+or npm raises `UnsupportedLockfile`, so callers can fall back to a full parse.
+"""
+
+import json
+import re
+from json.decoder import scanstring  # type: ignore[attr-defined]
+from typing import Any, AnyStr, Callable, Collection, Generator, List, Tuple
+
+# cargo always writes name, version, then source (for non-local packages) first
+CARGO_LOCK_PACKAGE_RE = re.compile(
+    rb'^\[\[package\]\]\nname = "([^"\\\n]*)"\nversion = "([^"\\\n]*)"\n(source = )?',
+    re.MULTILINE,
+)
+CARGO_LOCK_HEADER_RE = re.compile(rb"^\[\[package\]\]\r?$", re.MULTILINE)
+CARGO_LOCK_VERSION_RE = re.compile(rb"^version = ([0-9]+)\r?$", re.MULTILINE)
+JSON_WHITESPACE_RE = re.compile(r"[ \t\n\r]*")
+# skip strings and anything else up to the next bracket, or an unterminated string
+JSON_SKIP_RE = re.compile(
+    r'(?:[^"\[\]{}]+|"[^"\\]*(?:\\.[^"\\]*)*")*([\[\]{}"]|$)', re.DOTALL
+)
+
+# (start, end) offsets of a value to replace
+Span = Tuple[int, int]
+# keys leading to a member of a JSON document
+Path = Tuple[str, ...]
+
+
+class UnsupportedLockfile(Exception):
+    pass
+
+
+def replace_spans(content: AnyStr, spans: List[Span], value: AnyStr) -> AnyStr:
+    """Replace each of the given, non-overlapping spans with the same value"""
+    # slicing a memoryview doesn't copy, so bytes are only copied once, by join()
+    source: Any = memoryview(content) if isinstance(content, bytes) else content
+    chunks: List[Any] = []
+    index = 0
+    for start, end in sorted(spans):
+        chunks += [source[index:start], value]
+        index = end
+    chunks.append(source[index:])
+    return content[:0].join(chunks)
+
+
+def patch_cargo_lock(
+    content: bytes, package_names: Collection[str], version: str
+) -> bytes:
+    """
+    Set the version of local packages with the given names in a Cargo.lock.
+
+    Registry and git packages of the same name have a `source`, and are left as-is.
+    """
+    match = CARGO_LOCK_VERSION_RE.search(content)
+    header = CARGO_LOCK_HEADER_RE.search(content)
+    if match is None or (header is not None and header.start() < match.start()):
+        raise UnsupportedLockfile("no lockfile version")
+    if not 3 <= int(match.group(1)) <= 4:
+        raise UnsupportedLockfile(f"unsupported lockfile version {match.group(1)!r}")
+
+    names = {name.encode("utf-8") for name in package_names}
+    spans: List[Span] = []
+    count = 0
+    for match in CARGO_LOCK_PACKAGE_RE.finditer(content):
+        count += 1
+        if match.group(1) in names and match.group(3) is None:
+            spans.append(match.span(2))
+
+    if count != len(CARGO_LOCK_HEADER_RE.findall(content)):
+        raise UnsupportedLockfile("unrecognized [[package]] entries")
+
+    return replace_spans(content, spans, version.encode("utf-8"))
+
+
+def skip_whitespace(text: str, index: int) -> int:
+    return JSON_WHITESPACE_RE.match(text, index).end()  # type: ignore[union-attr]
+
+
+def skip_container(text: str, index: int) -> int:
+    """
+    Return the offset just past the JSON object or array at index, without decoding.
+
+    Only strings and bracket depth are tracked, so nothing is built for the contents,
+    and malformed contents are left for the C decoder to find if they're ever read.
+    """
+    depth = 0
+    while True:
+        match = JSON_SKIP_RE.match(text, index)
+        token = match.group(1)  # type: ignore[union-attr]
+        if token == "" or token == '"':
+            raise UnsupportedLockfile(f"unterminated value at offset {index}")
+        index = match.end()  # type: ignore[union-attr]
+        if token == "{" or token == "[":
+            depth += 1
+        elif token == "}" or token == "]":
+            depth -= 1
+            if depth == 0:
+                return index
+
+
+def json_members(
+    text: str,
+    index: int = 0,
+    expand: Callable[[Path], bool] = lambda path: False,
+    decode: Callable[[Path], bool] = lambda path: False,
+    path: Path = (),
+) -> Generator[Tuple[Path, Any, int, int], None, int]:
+    """
+    Yield (path, value, start, end) for each member of the JSON object at index.
+
+    Strings, numbers, and literals are decoded with the C decoder, as are objects and
+    arrays where `decode(path)` is true. Objects where `expand(path)` is true have
+    their members yielded first, and any other objects and arrays are skipped without
+    being built, so memory use depends on the values asked for rather than the size of
+    the document. Expanded and skipped values are yielded as None. Returns the offset
+    just past the object.
+    """
+    decoder = json.JSONDecoder()
+    index = skip_whitespace(text, index)
+    if text[index : index + 1] != "{":
+        raise UnsupportedLockfile(f"expected object at offset {index}")
+
+    index = skip_whitespace(text, index + 1)
+    if text[index : index + 1] == "}":
+        return index + 1
+
+    while True:
+        if text[index : index + 1] != '"':
+            raise UnsupportedLockfile(f"expected key at offset {index}")
+        key, index = scanstring(text, index + 1)
+        index = skip_whitespace(text, index)
+        if text[index : index + 1] != ":":
+            raise UnsupportedLockfile(f"expected ':' at offset {index}")
+
+        member = (*path, key)
+        start = skip_whitespace(text, index + 1)
+        value: Any = None
+        char = text[start : start + 1]
+        if char == "{" and expand(member):
+            end = yield from json_members(text, start, expand, decode, member)
+        elif (char == "{" or char == "[") and not decode(member):
+            end = skip_container(text, start)
+        else:
+            try:
+                value, end = decoder.raw_decode(text, start)
+            except ValueError as e:
+                raise UnsupportedLockfile(str(e)) from e
+        yield member, value, start, end
+
+        index = skip_whitespace(text, end)
+        char = text[index : index + 1]
+        if char == "}":
+            return index + 1
+        if char != ",":
+            raise UnsupportedLockfile(f"expected ',' or '}}' at offset {index}")
+        index = skip_whitespace(text, index + 1)
+
+
+def patch_package_lock(
+    content: bytes,
+    package_names: Collection[str],
+    version: str,
+    package_dirs: Collection[str] = (),
+) -> bytes:
+    """
+    Set the version of packages with the given names in a package-lock.json.
+
+    Matches the root package, and entries in `packages` that have a matching `name`
+    field, or are keyed by one of the names or by one of the package directories,
+    as for workspace packages. Links in `node_modules` have no version of their own.
+    """
+    text = content.decode("utf-8")
+    lockfile_version = None
+    root_name = None
+    root_version: List[Span] = []
+    spans: List[Span] = []
+
+    def expand(path: Path) -> bool:
+        return path == ("packages",)
+
+    def decode(path: Path) -> bool:
+        # entries in `packages` are small, unlike the legacy `dependencies` tree
+        return len(path) == 2 and path[0] == "packages"
+
+    def matches(key: str, entry: Any) -> bool:
+        name = entry.get("name") if isinstance(entry, dict) else None
+        return (
+            key in package_names
+            or key in package_dirs
+            or (isinstance(name, str) and name in package_names)
+        )
+
+    for path, value, start, end in json_members(text, 0, expand, decode):
+        if path == ("lockfileVersion",):
+            lockfile_version = value
+        elif path == ("name",):
+            root_name = value
+        elif path == ("version",):
+            root_version.append((start, end))
+        elif len(path) == 2 and matches(path[1], value):
+            # only walk the entries being changed, to find their version spans
+            for member, _, version_start, version_end in json_members(text, start):
+                if member == ("version",):
+                    spans.append((version_start, version_end))
+
+    if lockfile_version not in (2, 3):
+        raise UnsupportedLockfile(f"unsupported lockfile version {lockfile_version!r}")
+
+    if matches("", {"name": root_name}):
+        spans.extend(root_version)
+    value = json.dumps(version)
+    if len(text) != len(content):
+        return replace_spans(text, spans, value).encode("utf-8")
+
+    # only ASCII, so offsets match, and the original bytes can be patched directly
+    del text
+    return replace_spans(content, spans, value.encode("utf-8"))
@@ -3,34 +3,91 @@
 
 import logging
 import sys
+import time
 from pathlib import Path
-from typing import Any, Callable, Optional
+from typing import Any, Callable, Optional, TYPE_CHECKING
 
 import click
-import tomlkit
 
-from attribution import __version__
-from .generate import CargoFile, Changelog, NpmFile, VersionFile
-from .helpers import sh
-from .project import Project
-from .tag import Tag
-from .types import Version
+from .__version__ import __version__
+
+if TYPE_CHECKING:
+    from .tag import Tag
+    from .types import Version
+
+# Subcommands import what they need when they run, so that `--version` or `log`
+# don't pay for loading jinja2, tomlkit, or asyncio at startup.
 
 LOG = logging.getLogger(__name__)
 
 
+class VersionType(click.ParamType):
+    """Version parameter, only importing packaging when a value is converted"""
+
+    name = "version"
+
+    def convert(
+        self, value: Any, param: Optional[click.Parameter], ctx: Optional[click.Context]
+    ) -> "Version":
+        from .types import InvalidVersion, Version
+
+        if isinstance(value, Version):
+            return value
+        try:
+            return Version(value)
+        except InvalidVersion as e:
+            self.fail(str(e), param, ctx)
+
+
 @click.group()
 @click.version_option(__version__, "-V", "--version", prog_name="attribution")
 @click.option("-d", "--debug", is_flag=True, help="Enable debug logging")
-def main(debug: bool = False) -> None:
+@click.option(
+    "--profile", is_flag=True, help="Print time spent in git, parsing, and templates"
+)
+@click.option(
+    "--profile-trace",
+    type=click.Path(dir_okay=False, writable=True, path_type=Path),
+    default=None,
+    help="Write a Chrome trace of profiled spans to file (implies --profile)",
+)
+@click.pass_context
+def main(
+    ctx: click.Context,
+    debug: bool = False,
+    profile: bool = False,
+    profile_trace: Optional[Path] = None,
+) -> None:
     """Generate changelogs from tags and shortlog"""
     logging.basicConfig(
         level=logging.DEBUG if debug else logging.WARNING, stream=sys.stderr
     )
 
+    if profile or profile_trace:
+        from .profile import PROFILER
+
+        PROFILER.enable()
+        started = time.perf_counter()
+
+        def report() -> None:
+            PROFILER.disable()
+            elapsed = time.perf_counter() - started
+            title = ctx.invoked_subcommand or "attribution"
+            click.echo(PROFILER.summary(title, elapsed), err=True)
+            if profile_trace:
+                PROFILER.write_trace(profile_trace)
+                click.echo(f"trace written to {profile_trace}", err=True)
+
+        ctx.call_on_close(report)
+
 
 @main.command("init")
 def init() -> None:
+    import tomlkit
+
+    from .generate import VersionFile
+    from .project import Project
+
     project = Project.load()
     name = click.prompt("Project name", default=project.name)
     package = click.prompt("Package namespace", default=project.package)
@@ -76,8 +133,11 @@ def init() -> None:
 
 
 @main.command("debug")
-def debug() -> None:
+@click.option("--no-cache", is_flag=True, help="Ignore the persistent tag cache")
+def debug(no_cache: bool) -> None:
     """Dump debug info about project"""
+    from .project import Project
+
     pprint: Callable[[Any], None]
     try:
         import rich
@@ -87,31 +147,79 @@ def debug() -> None:
         pprint = click.echo
 
     project = Project.load()
+    project.cache = not no_cache
     project.tags
     pprint(f"pyproject.toml: {project.pyproject_path()}")
+    pprint(f"git backend: {project.backend.name}")
+    if project.tag_cache is not None:
+        entries = project.tag_cache.entries()
+        size = sum(size for _, size, _ in entries)
+        pprint(
+            f"tag cache: {project.tag_cache.path} ({len(entries)} entries, {size} bytes)"
+        )
     pprint(project)
 
 
 @main.command("log")
-@click.argument("version", type=Version, default=None, required=False)
-def show_log(version: Version) -> None:
+@click.argument("version", type=VersionType(), default=None, required=False)
+def show_log(version: Optional["Version"]) -> None:
     """Show log of revisions since last tag"""
+    from .project import Project
+
     project = Project.load()
-    tag: Optional[Tag] = None
+    tag: Optional["Tag"] = None
     if version:
         tag = project.get_tag(version)
     elif project.tags:
         tag = project.tags[0]
 
-    sh(*project.log_since_tag_cmd(tag), raw=True)
+    project.log_since_tag(tag, raw=True)
 
 
 @main.command("generate")
-def generate() -> None:
+@click.option("--no-cache", is_flag=True, help="Ignore the persistent tag cache")
+@click.option(
+    "-j", "--jobs", type=click.IntRange(min=1), default=1, help="Parallel git jobs"
+)
+@click.option(
+    "--since",
+    type=VersionType(),
+    default=None,
+    help="Only include tags from this version onward",
+)
+@click.option(
+    "--until",
+    type=VersionType(),
+    default=None,
+    help="Only include tags up to and including this version",
+)
+@click.option(
+    "--last",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Only include the newest N tags in range",
+)
+def generate(
+    no_cache: bool,
+    jobs: int,
+    since: Optional["Version"],
+    until: Optional["Version"],
+    last: Optional[int],
+) -> None:
     """Regenerate changelog from existing tags"""
+    from .generate import Changelog
+    from .project import Project
+
     project = Project.load()
+    project.cache = not no_cache
+    project.jobs = jobs
     LOG.debug(f"project: {project}")
-    click.echo(Changelog(project).generate())
+    tags = None
+    if since is not None or until is not None or last is not None:
+        tags = project.tag_range(since, until, last)
+    for chunk in Changelog(project).chunks(tags):
+        click.echo(chunk, nl=False)
+    click.echo()
 
 
 @main.command("tag")
@@ -122,10 +230,36 @@ def generate() -> None:
     default=None,
     help="Use the given message instead of prompting",
 )
-@click.argument("version", type=Version)
-def tag_release(version: Version, message: Optional[str]) -> None:
+@click.option("--no-cache", is_flag=True, help="Ignore the persistent tag cache")
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="Only render changelog sections for new or modified tags",
+)
+@click.option(
+    "--verify",
+    is_flag=True,
+    help="Check the incremental changelog against a full render",
+)
+@click.option(
+    "-j", "--jobs", type=click.IntRange(min=1), default=1, help="Parallel git jobs"
+)
+@click.argument("version", type=VersionType())
+def tag_release(
+    version: "Version",
+    message: Optional[str],
+    no_cache: bool,
+    incremental: bool,
+    verify: bool,
+    jobs: int,
+) -> None:
     """Create new tagged release with changelog"""
+    from .project import Project
+    from .release import Release
+
     project = Project.load()
+    project.cache = not no_cache
+    project.jobs = jobs
     LOG.debug(f"project: {project}")
 
     for tag in project.tags:
@@ -141,7 +275,7 @@ def tag_release(version: Version, message: Optional[str]) -> None:
 
         if project.tags:
             tag = project.tags[0]
-            git_log = sh(*project.log_since_tag_cmd(tag))
+            git_log = project.log_since_tag(tag)
             tpl += f"#\n# Changes since {tag.name}:\n#\n"
             tpl += "".join(f"# {line}\n" for line in git_log.splitlines(keepends=False))
 
@@ -157,41 +291,13 @@ def tag_release(version: Version, message: Optional[str]) -> None:
         )
 
     try:
-        # XXX: This is a really hacky wall of commands
-        project = Project.load()
-        LOG.debug(f"project: {project}")
-
-        # create empty commit and tag with new version
-        sh(f"git commit -m 'Version bump v{version}' --allow-empty")
-        tag = Tag.create(version, message=message, signed=False)
-
-        # update changelog and version file
-        changelog = Changelog(project).write()
-        sh(f"git add {changelog}")
-        if project.config.get("version_file"):
-            path = VersionFile(project).write()
-            sh(f"git add {path}")
-        if cargo_packages := project.config.get("cargo_packages"):
-            for cargo_file in CargoFile.search(project, cargo_packages):
-                path = cargo_file.write()
-                sh(f"git add {path}")
-                sh(f"git add {path.with_suffix('.lock')}")
-        if npm_packages := project.config.get("npm_packages"):
-            for npm_file in NpmFile.search(project, npm_packages):
-                path = npm_file.write()
-                sh(f"git add {path}")
-                sh(f"git add {path.with_name('package-lock.json')}")
-
-        # update commit and tag
-        sh("git commit --amend --no-edit")
-        tag.update(message=message, signed=project.config["signed_tags"])
+        Release(project, version, message).run(incremental=incremental, verify=verify)
 
     except Exception:
         mfile = Path(f".attribution-{version}.txt").resolve()
         mfile.write_text(message)
         click.secho(
-            f"Bump failed, version message in {mfile}, "
-            r"repo state unknown ¯\_(ツ)_/¯",
+            f"Bump failed, version message in {mfile}, changes have been rolled back",
             fg="yellow",
             bold=True,
         )
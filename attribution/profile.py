@@ -0,0 +1,272 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT license
+
+import contextlib
+import functools
+import os
+import threading
+import time
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+# same as inspect.CO_GENERATOR, without importing inspect at startup
+CO_GENERATOR = 0x20
+
+T = TypeVar("T")
+F = TypeVar("F", bound=Callable[..., Any])
+
+# categories used for spans throughout attribution
+GIT = "git"
+PARSE = "parse"
+TEMPLATE = "template"
+WALK = "walk"
+
+
+class Span(NamedTuple):
+    category: str
+    name: str
+    start: float  # seconds since the profiler started
+    duration: float
+    self_time: float  # duration minus nested spans on the same thread
+    thread: int
+
+
+class Stat(NamedTuple):
+    category: str
+    name: str
+    calls: int
+    total: float
+    self_time: float
+    max: float
+
+
+class Profiler:
+    """
+    Collects timed spans while enabled, and summarizes them by category and name.
+
+    Spans record their own time separately from nested spans, so that git commands
+    run while rendering a template are not counted twice in the summary.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.origin = time.perf_counter()
+        self.spans: List[Span] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def enable(self) -> None:
+        self.enabled = True
+        self.origin = time.perf_counter()
+        self.spans = []
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def _push(self) -> float:
+        self._local.__dict__.setdefault("stack", []).append(0.0)
+        return time.perf_counter()
+
+    def _pop(self, start: float) -> Tuple[float, float]:
+        """Finish the innermost span on this thread, returning (duration, self)"""
+        duration = time.perf_counter() - start
+        stack: List[float] = self._local.stack
+        nested = stack.pop()  # time spent in nested spans
+        if stack:
+            stack[-1] += duration
+        return duration, duration - nested
+
+    def _add(
+        self, category: str, name: str, start: float, times: Tuple[float, float]
+    ) -> None:
+        span = Span(category, name, start - self.origin, *times, threading.get_ident())
+        with self._lock:
+            self.spans.append(span)
+
+    @contextlib.contextmanager
+    def span(self, category: str, name: str) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+
+        start = self._push()
+        try:
+            yield
+        finally:
+            self._add(category, name, start, self._pop(start))
+
+    def iterate(self, category: str, name: str, iterable: Iterable[T]) -> Iterator[T]:
+        """
+        Time each step of an iterator as a single span, excluding time spent by the
+        consumer between steps, such as writing out streamed output.
+        """
+        if not self.enabled:
+            yield from iterable
+            return
+
+        iterator = iter(iterable)
+        first: Optional[float] = None
+        duration = self_time = 0.0
+        try:
+            while True:
+                start = self._push()
+                first = start if first is None else first
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    step, step_self = self._pop(start)
+                    duration += step
+                    self_time += step_self
+                yield item
+        finally:
+            if first is not None:
+                self._add(category, name, first, (duration, self_time))
+
+    def record(self, category: str, name: str, start: float) -> None:
+        """
+        Record a span that started at the given `perf_counter()` time and ends now.
+
+        For work that can't be wrapped with `span()`, such as coroutines that
+        interleave on the same thread. These are never counted as nested time.
+        """
+        if not self.enabled:
+            return
+        duration = time.perf_counter() - start
+        self._add(category, name, start, (duration, duration))
+
+    def stats(self) -> List[Stat]:
+        """Aggregate spans by category and name, slowest first"""
+        groups: Dict[Tuple[str, str], List[Span]] = {}
+        for span in self.spans:
+            groups.setdefault((span.category, span.name), []).append(span)
+        stats = [
+            Stat(
+                category,
+                name,
+                len(spans),
+                sum(span.duration for span in spans),
+                sum(span.self_time for span in spans),
+                max(span.duration for span in spans),
+            )
+            for (category, name), spans in groups.items()
+        ]
+        return sorted(stats, key=lambda stat: (-stat.self_time, stat.category))
+
+    def summary(self, title: str, elapsed: float) -> str:
+        """Format a table of stats, with per-category self times"""
+        stats = self.stats()
+        lines = [f"profile: {title} ({elapsed:.3f}s)"]
+        header = ("category", "name", "calls", "total", "self", "max")
+        rows = [header] + [
+            (
+                stat.category,
+                stat.name,
+                str(stat.calls),
+                f"{stat.total:.3f}s",
+                f"{stat.self_time:.3f}s",
+                f"{stat.max:.3f}s",
+            )
+            for stat in stats
+        ]
+        widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+        for row in rows:
+            cells = [
+                cell.ljust(width) if i < 2 else cell.rjust(width)
+                for i, (cell, width) in enumerate(zip(row, widths))
+            ]
+            lines.append("  ".join(cells).rstrip())
+
+        totals: Dict[str, float] = {}
+        for stat in stats:
+            totals[stat.category] = totals.get(stat.category, 0.0) + stat.self_time
+        # overlapping async or threaded spans can add up to more than elapsed time
+        other = max(0.0, elapsed - sum(totals.values()))
+        lines.append(
+            "  ".join(f"{category}={total:.3f}s" for category, total in totals.items())
+            + f"  other={other:.3f}s"
+        )
+        return "\n".join(lines)
+
+    def trace(self) -> Dict[str, Any]:
+        """Spans in Chrome trace event format, for chrome://tracing or Perfetto"""
+        pid = os.getpid()
+        events = [
+            {
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": span.start * 1e6,
+                "dur": span.duration * 1e6,
+                "pid": pid,
+                "tid": span.thread,
+            }
+            for span in self.spans
+        ]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_trace(self, path: Path) -> None:
+        import json
+
+        path.write_text(json.dumps(self.trace()))
+
+
+PROFILER = Profiler()
+span = PROFILER.span
+iterate = PROFILER.iterate
+
+
+def profiled(category: str) -> Callable[[F], F]:
+    """
+    Decorate methods of named objects, like git backends, to time each call.
+
+    Spans are named for the object and method, eg `pygit2 walk`. Generator methods
+    are timed with `iterate()`, to exclude time spent by the consumer.
+    """
+
+    def decorator(fn: F) -> F:
+        if fn.__code__.co_flags & CO_GENERATOR:
+
+            @functools.wraps(fn)
+            def wrapped_generator(self: Any, *args: Any, **kwargs: Any) -> Any:
+                name = f"{self.name} {fn.__name__}"
+                return PROFILER.iterate(category, name, fn(self, *args, **kwargs))
+
+            return wrapped_generator  # type: ignore[return-value]
+
+        @functools.wraps(fn)
+        def wrapped(self: Any, *args: Any, **kwargs: Any) -> Any:
+            with PROFILER.span(category, f"{self.name} {fn.__name__}"):
+                return fn(self, *args, **kwargs)
+
+        return wrapped  # type: ignore[return-value]
+
+    return decorator
+
+
+def command_name(cmd: Sequence[str]) -> str:
+    """Name a command by its git subcommand, skipping global options"""
+    if not cmd:
+        return ""
+    if Path(cmd[0]).name != "git":
+        return Path(cmd[0]).name
+    args = iter(cmd[1:])
+    for arg in args:
+        if arg in ("-C", "-c"):
+            next(args, None)
+        elif not arg.startswith("-"):
+            return arg
+    return "git"
@@ -1,18 +1,23 @@
 # Copyright 2022 Amethyst Reese
 # Licensed under the MIT license
 
+import hashlib
+import json
 import logging
 import re
 import subprocess
+from bisect import bisect_left, bisect_right
 from dataclasses import dataclass, field
+from functools import partial
 from pathlib import Path
-from typing import Any, Dict, Optional, Sequence
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
 
-import tomlkit
-
-from .helpers import canonical_namespace, sh
+from .backend import BACKENDS, GitBackend, select_backend
+from .cache import TagCache
+from .helpers import canonical_namespace, read_toml, sh_stdout
+from .search import search_manifests, SEARCH_STRATEGIES
 from .tag import Tag, Tags
-from .types import Version
+from .types import Version, version_key
 
 LOG = logging.getLogger(__name__)
 
@@ -23,27 +28,339 @@ class Project:
     package: str
     config: Dict[str, Any] = field(default_factory=dict)
     root: Path = field(default_factory=Path.cwd)
+    cache: bool = field(default=True, compare=False)
+    jobs: int = field(default=1, compare=False)
     _shortlog: Optional[str] = field(default=None, compare=False)
     _tags: Tags = field(default_factory=list, compare=False)
+    _tag_cache: Optional[TagCache] = field(default=None, compare=False, repr=False)
+    _manifests: Optional[Dict[str, List[Path]]] = field(
+        default=None, compare=False, repr=False
+    )
+    _backend: Optional[GitBackend] = field(default=None, compare=False, repr=False)
+    _tag_index: Optional[Tuple[Tags, int, List[Any], Dict[str, int]]] = field(
+        default=None, compare=False, repr=False
+    )
+    _tag_refs: Optional[Tuple[Dict[str, str], str]] = field(
+        default=None, compare=False, repr=False
+    )
+    _mailmap_digest: Optional[str] = field(default=None, compare=False, repr=False)
 
     def __eq__(self, other: Any) -> bool:
         if isinstance(other, Project):
             return self.name == other.name and self.package == other.package
         return False
 
+    @property
+    def backend(self) -> GitBackend:
+        """Git backend for this project, preferring in-process backends"""
+        if self._backend is None:
+            name = self.config.get("git_backend", "auto")
+            self._backend = select_backend(self.root, name)
+
+        return self._backend
+
     @property
     def tags(self) -> Tags:
         if not self._tags:
-            self._tags = Tag.all_tags()
+            self._tags = Tag.all_tags(backend=self.backend)
 
         return self._tags
 
+    def iter_tags(self, tags: Optional[Sequence[Tag]] = None) -> Iterator[Tag]:
+        """
+        Yield tags in order, only loading tag data once iteration starts.
+
+        Defaults to all tags; otherwise, only loads data for the given tags.
+        """
+        if tags is None:
+            self.prefetch()
+            yield from self.tags
+        else:
+            self.prefetch(tags)
+            yield from tags
+
+    def tag_index(self) -> List[Any]:
+        """
+        Sort keys for all tags, oldest first, for bisecting by version.
+
+        Tags are kept newest first, so index `i` here is `tags[-1 - i]`. The index is
+        rebuilt whenever the tag list is replaced or resized.
+        """
+        tags = self.tags
+        if (
+            self._tag_index is None
+            or self._tag_index[0] is not tags
+            or self._tag_index[1] != len(tags)
+        ):
+            keys = [version_key(tag.version) for tag in reversed(tags)]
+            positions = {tag.name: index for index, tag in enumerate(tags)}
+            self._tag_index = (tags, len(tags), keys, positions)
+        return self._tag_index[2]
+
+    def tag_position(self, name: str) -> Optional[int]:
+        """Index of the named tag in `tags`, or None if there is no such tag"""
+        self.tag_index()
+        assert self._tag_index is not None
+        return self._tag_index[3].get(name)
+
     def get_tag(self, version: Version) -> Optional[Tag]:
-        for tag in self.tags:
-            if tag.version == version:
-                return tag
+        keys = self.tag_index()
+        index = bisect_right(keys, version_key(version)) - 1
+        if index >= 0 and self.tags[-1 - index].version == version:
+            return self.tags[-1 - index]
+        return None
+
+    def tag_range(
+        self,
+        since: Optional[Version] = None,
+        until: Optional[Version] = None,
+        last: Optional[int] = None,
+    ) -> Tags:
+        """
+        Tags with versions from `since` through `until`, inclusive, newest first.
+
+        Either bound may be omitted, and neither needs to match an existing tag.
+        With `last`, only the newest `last` tags in that range are returned.
+        """
+        keys = self.tag_index()
+        low = 0 if since is None else bisect_left(keys, version_key(since))
+        high = len(keys) if until is None else bisect_right(keys, version_key(until))
+        if last is not None:
+            low = max(low, high - last)
+        if low >= high:
+            return []
+        return self.tags[len(keys) - high : len(keys) - low]
+
+    @property
+    def manifests(self) -> Dict[str, List[Path]]:
+        """Paths to Cargo and npm manifests in the project, found in a single pass"""
+        if self._manifests is None:
+            strategy = self.config.get("manifest_search", "auto")
+            self._manifests = search_manifests(self.root, strategy=strategy)
+
+        return self._manifests
+
+    @property
+    def tag_cache(self) -> Optional[TagCache]:
+        """Persistent tag cache for this project, unless disabled"""
+        if self.cache and self._tag_cache is None:
+            self._tag_cache = TagCache.for_repo(self.root)
+            if self._tag_cache is None:
+                self.cache = False
+
+        return self._tag_cache if self.cache else None
+
+    def cache_salt(self) -> List[str]:
+        """Config and mailmap values that affect cached tag data"""
+        return [*self.config.get("ignored_authors", []), self.mailmap_digest()]
+
+    def mailmap_digest(self) -> str:
+        """
+        Hash the contents of every mailmap that git applies to this repo.
+
+        That's `.mailmap` at the top of the work tree, which may be above the project
+        root, along with any `mailmap.file` or `mailmap.blob` from git config.
+        """
+        if self._mailmap_digest is None:
+            root = str(self.root)
+            try:
+                out = sh_stdout("git", "-C", root, "rev-parse", "--show-toplevel")
+                top = Path(out.strip())
+            except (OSError, subprocess.CalledProcessError):
+                top = self.root
+            try:
+                out = sh_stdout(
+                    "git",
+                    "-C",
+                    root,
+                    "config",
+                    "--type=path",
+                    "--get-regexp",
+                    r"^mailmap\.(file|blob)$",
+                )
+            except (OSError, subprocess.CalledProcessError):
+                out = ""  # neither is set
+            options = dict(line.partition(" ")[::2] for line in out.splitlines())
+
+            paths = [top / ".mailmap"]
+            if options.get("mailmap.file"):
+                paths.append(top / options["mailmap.file"])
+            values: List[str] = []
+            for path in paths:
+                try:
+                    values.append(hashlib.sha256(path.read_bytes()).hexdigest())
+                except OSError:
+                    values.append("")
+            blob = options.get("mailmap.blob", "")
+            if blob:
+                try:
+                    blob = sh_stdout(
+                        "git", "-C", root, "rev-parse", "--verify", f"{blob}^{{blob}}"
+                    ).strip()
+                except (OSError, subprocess.CalledProcessError):
+                    blob = ""
+            values.append(blob)  # blob shas already hash their contents
+
+            value = json.dumps(values).encode("utf-8")
+            self._mailmap_digest = hashlib.sha256(value).hexdigest()
+        return self._mailmap_digest
+
+    def tag_refs(self) -> Tuple[Dict[str, str], str]:
+        """
+        Names and object shas of every tag ref, including non-version tags.
+
+        Also returns a digest of all of them, computed once per project.
+        """
+        if self._tag_refs is None:
+            refs = {ref.name: ref.sha for ref in self.backend.list_tags()}
+            value = json.dumps(sorted(refs.items()))
+            digest = hashlib.sha256(value.encode("utf-8")).hexdigest()
+            self._tag_refs = (refs, digest)
+        return self._tag_refs
+
+    def shortlog_context(self, tag: Tag, base: str) -> Optional[str]:
+        """
+        Fingerprint the tags that a shortlog from `base` to `tag` depends on.
+
+        `git describe` picks the base by walking the commit graph, and considers every
+        tag ref, not just version tags, so any new, moved, or deleted tag could change
+        it. That makes this a fingerprint of every tag ref in the repo, along with the
+        base itself. An empty base covers all preceding history. Returns None if the
+        tag or base isn't a tag ref, so the shortlog can't be validated.
+        """
+        refs, digest = self.tag_refs()
+        if tag.name not in refs or (base and base not in refs):
+            return None
+        value = [base, digest]
+        return hashlib.sha256(json.dumps(value).encode("utf-8")).hexdigest()
+
+    def walk_base(self, tags: Sequence[Tag]) -> Optional[str]:
+        """
+        Where to stop walking history for the shortlogs of a subset of tags.
+
+        This is the newest tag older than all of the given tags, which is the usual
+        base for the oldest of them. Returns None if that's the oldest tag.
+        """
+        positions = [self.tag_position(tag.name) for tag in tags]
+        oldest = max((index for index in positions if index is not None), default=-1)
+        if 0 <= oldest < len(self.tags) - 1:
+            return self.tags[oldest + 1].name
         return None
 
+    def prefetch(self, tags: Optional[Sequence[Tag]] = None) -> List[Tag]:
+        """
+        Load messages and shortlogs for the given tags, defaulting to all tags.
+
+        For a subset of tags, only their own history is walked, down to the tag just
+        older than the range. Returns the subset of tags that were not already in the
+        tag cache.
+        """
+        if tags is None:
+            tags = self.tags
+        limit = len(tags) < len(self.tags)
+        misses = self._cache_lookup(tags)
+        Tag.load_messages([tag for tag, _ in misses], self.backend)
+        Tag.load_shortlogs(
+            tags,
+            self.backend,
+            limit=limit,
+            base=self.walk_base(tags) if limit else None,
+        )
+        self.fetch_tags([tag for tag, _ in misses])
+        self._cache_store(misses)
+        return [tag for tag, _ in misses]
+
+    async def aprefetch(self, tags: Optional[Sequence[Tag]] = None) -> List[Tag]:
+        """Async version of `prefetch`, running git in the project root."""
+        if not self._tags:
+            self._tags = await Tag.aall_tags(self.root)
+        if tags is None:
+            tags = self._tags
+        if self.cache and self._tag_cache is None:
+            self._tag_cache = await TagCache.afor_repo(self.root)
+            if self._tag_cache is None:
+                self.cache = False
+
+        limit = len(tags) < len(self._tags)
+        misses = self._cache_lookup(tags)
+        await Tag.aload_shortlogs(
+            tags,
+            self.root,
+            limit=limit,
+            base=self.walk_base(tags) if limit else None,
+        )
+        await self.afetch_tags([tag for tag, _ in misses])
+        self._cache_store(misses)
+        return [tag for tag, _ in misses]
+
+    def _cache_lookup(self, tags: Sequence[Tag]) -> List[Tuple[Tag, str]]:
+        """Fill in cached tag data, and return tags that missed with their keys"""
+        cache = self.tag_cache
+        if cache is None:
+            return [(tag, "") for tag in tags]
+
+        salt = self.cache_salt()
+        misses: List[Tuple[Tag, str]] = []
+        for tag in tags:
+            key = cache.key(tag, salt)
+            if not cache.load(tag, key, partial(self.shortlog_context, tag)):
+                misses.append((tag, key))
+        return misses
+
+    def _cache_store(self, misses: Sequence[Tuple[Tag, str]]) -> None:
+        cache = self.tag_cache
+        if cache is not None and misses:
+            for tag, key in misses:
+                cache.store(tag, key, partial(self.shortlog_context, tag))
+            cache.prune()
+
+    def fetch_tags(self, tags: Sequence[Tag]) -> None:
+        """
+        Run per-tag git commands for anything the history walk didn't cover.
+
+        Uses up to `jobs` worker threads, and logs any failures per tag in order.
+        """
+        pending = [tag for tag in tags if tag._message is None or tag._shortlog is None]
+
+        def fetch(tag: Tag) -> Optional[Exception]:
+            try:
+                tag.fetch_message(self.backend)
+                tag.fetch_shortlog(self.backend)
+            except Exception as e:
+                return e
+            return None
+
+        if self.jobs > 1 and len(pending) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+
+            with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                errors = list(pool.map(fetch, pending))
+        else:
+            errors = [fetch(tag) for tag in pending]
+
+        for tag, error in zip(pending, errors):
+            if error is not None:
+                LOG.warning(f"failed to load tag {tag.name}: {error}")
+
+    async def afetch_tags(self, tags: Sequence[Tag]) -> None:
+        """Async version of `fetch_tags`, limited by the concurrency of `ash()`."""
+        pending = [tag for tag in tags if tag._message is None or tag._shortlog is None]
+
+        async def fetch(tag: Tag) -> None:
+            await tag.amessage(self.root)
+            await tag.ashortlog(self.root)
+
+        import asyncio
+
+        errors = await asyncio.gather(
+            *(fetch(tag) for tag in pending), return_exceptions=True
+        )
+        for tag, error in zip(pending, errors):
+            if isinstance(error, Exception):
+                LOG.warning(f"failed to load tag {tag.name}: {error}")
+            elif isinstance(error, BaseException):
+                raise error
+
     @property
     def latest(self) -> Tag:
         tags = self.tags
@@ -62,32 +379,39 @@ class Project:
         """Generate the project's combined shortlog."""
         if self._shortlog is None:
             try:
-                self._shortlog = sh(self.shortlog_cmd).rstrip()
+                self._shortlog = self.backend.shortlog("HEAD").rstrip()
 
-            except subprocess.CalledProcessError:
+            except Exception:
                 LOG.exception(f"failed to generate shortlog for {self.name}")
                 self._shortlog = ""
 
         return self._shortlog
 
+    def log_since_tag(self, tag: Optional[Tag] = None, *, raw: bool = False) -> str:
+        """Log of revisions since the given tag, sent straight to stdout if raw."""
+        return self.backend.log(*self.log_since_tag_args(tag), raw=raw)
+
     def log_since_tag_cmd(self, tag: Optional[Tag] = None) -> Sequence[str]:
+        return ["git", "log", *self.log_since_tag_args(tag)]
+
+    def log_since_tag_args(self, tag: Optional[Tag] = None) -> List[str]:
         if tag:
-            log_cmd = ["git", "log", "--reverse", f"{tag.name}.."]
+            log_args = ["--reverse", f"{tag.name}.."]
         else:
-            log_cmd = ["git", "log", "--reverse"]
+            log_args = ["--reverse"]
 
         ignored_authors = self.config.get("ignored_authors", [])
         if ignored_authors:
             inner_pattern = "|".join(
                 re.escape(author) for author in self.config["ignored_authors"]
             )
-            log_cmd += [
+            log_args += [
                 "--perl-regexp",
                 "--regexp-ignore-case",
                 rf"--author=^((?!({inner_pattern})).*)$",
             ]
 
-        return log_cmd
+        return log_args
 
     @classmethod
     def load(cls, path: Optional[Path] = None) -> "Project":
@@ -105,7 +429,7 @@ class Project:
         }
 
         if cls.pyproject_path(path).is_file():
-            pyproject = tomlkit.loads(cls.pyproject_path(path).read_text())
+            pyproject = read_toml(cls.pyproject_path(path).read_text())
             tool = pyproject.get("tool", {})
             tool_attribution = tool.get("attribution", {})
             if tool_attribution:
@@ -129,6 +453,18 @@ class Project:
                         ignored_authors = []
                     config["ignored_authors"] = ignored_authors
 
+                manifest_search = config.get("manifest_search", "auto")
+                if manifest_search not in SEARCH_STRATEGIES:
+                    LOG.warning(
+                        f"manifest_search must be one of {', '.join(SEARCH_STRATEGIES)}"
+                    )
+                    del config["manifest_search"]
+
+                git_backend = config.get("git_backend", "auto")
+                if git_backend not in BACKENDS:
+                    LOG.warning(f"git_backend must be one of {', '.join(BACKENDS)}")
+                    del config["git_backend"]
+
         if not name:
             name = path.name
 
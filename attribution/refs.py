@@ -0,0 +1,124 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT license
+
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+LOG = logging.getLogger(__name__)
+
+SHA_RE = re.compile(r"^(?:[0-9a-f]{40}|[0-9a-f]{64})$")
+TAGS_PREFIX = "refs/tags/"
+
+# any of these change where or how git finds refs, so leave them to git itself
+GIT_ENV_VARS = (
+    "GIT_DIR",
+    "GIT_COMMON_DIR",
+    "GIT_WORK_TREE",
+    "GIT_CEILING_DIRECTORIES",
+    "GIT_DISCOVERY_ACROSS_FILESYSTEM",
+)
+
+
+class UnsupportedLayout(Exception):
+    pass
+
+
+def find_git_dirs(root: Path) -> Tuple[Path, Path]:
+    """
+    Find the git directory and common directory for the work tree containing root.
+
+    Supports plain repos, and worktrees or submodules using a `.git` file, with
+    a `commondir` pointing at the main repo. Raises `UnsupportedLayout` otherwise.
+    """
+    if any(var in os.environ for var in GIT_ENV_VARS):
+        raise UnsupportedLayout("git environment variables set")
+
+    root = root.resolve()
+    for path in (root, *root.parents):
+        dot_git = path / ".git"
+        if dot_git.is_dir():
+            git_dir = dot_git
+            break
+        elif dot_git.is_file():
+            content = dot_git.read_text().strip()
+            if not content.startswith("gitdir:"):
+                raise UnsupportedLayout(f"unknown .git file contents in {dot_git}")
+            git_dir = path / content[len("gitdir:") :].strip()
+            break
+    else:
+        raise UnsupportedLayout(f"no .git found for {root}")
+
+    common_dir = git_dir
+    commondir_file = git_dir / "commondir"
+    if commondir_file.is_file():
+        common_dir = git_dir / commondir_file.read_text().strip()
+
+    if not (common_dir / "refs").is_dir():
+        raise UnsupportedLayout(f"no refs directory in {common_dir}")
+    if (common_dir / "reftable").exists():
+        raise UnsupportedLayout(f"reftable repository in {common_dir}")
+    config = common_dir / "config"
+    if config.is_file() and "refstorage" in config.read_text().lower():
+        raise UnsupportedLayout(f"unknown ref storage in {common_dir}")
+
+    return git_dir, common_dir
+
+
+def read_packed_refs(path: Path, prefix: str = TAGS_PREFIX) -> Dict[str, str]:
+    """Read refs with the given prefix from a packed-refs file, as name -> sha"""
+    refs: Dict[str, str] = {}
+    try:
+        content = path.read_text()
+    except FileNotFoundError:
+        return refs
+
+    for line in content.splitlines():
+        if not line or line[0] in "#^":
+            continue  # header, or peeled commit of the previous tag
+        sha, _, ref = line.partition(" ")
+        if not SHA_RE.match(sha) or not ref:
+            raise UnsupportedLayout(f"unknown line in {path}: {line!r}")
+        if ref.startswith(prefix):
+            refs[ref[len(prefix) :]] = sha
+    return refs
+
+
+def read_loose_refs(path: Path, name: str = "") -> Dict[str, str]:
+    """Read loose refs below the given directory, as name -> sha"""
+    refs: Dict[str, str] = {}
+    try:
+        with os.scandir(path) as it:
+            entries = list(it)
+    except FileNotFoundError:
+        return refs
+
+    for entry in entries:
+        ref = f"{name}{entry.name}"
+        if entry.is_dir():
+            refs.update(read_loose_refs(Path(entry.path), f"{ref}/"))
+        elif not entry.name.endswith(".lock"):
+            sha = Path(entry.path).read_text().strip()
+            if not SHA_RE.match(sha):
+                raise UnsupportedLayout(f"unknown ref contents in {entry.path}")
+            refs[ref] = sha
+    return refs
+
+
+def read_tag_refs(root: Path) -> Optional[Dict[str, str]]:
+    """
+    Read tag names and object shas directly from the repo containing root.
+
+    Returns None if the repo can't be read without git, such as repos using
+    reftable or an unfamiliar layout, so that callers can fall back to git.
+    """
+    try:
+        _, common_dir = find_git_dirs(root)
+        refs = read_packed_refs(common_dir / "packed-refs")
+        refs.update(read_loose_refs(common_dir / "refs" / "tags"))
+        return refs
+    except (OSError, UnicodeDecodeError, UnsupportedLayout) as e:
+        LOG.debug(f"unable to read refs directly, falling back to git: {e}")
+        return None
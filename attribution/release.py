@@ -0,0 +1,135 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT license
+
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .generate import (
+    CargoFile,
+    Changelog,
+    GeneratedFile,
+    NpmFile,
+    PackageFile,
+    VersionFile,
+)
+from .helpers import write_file
+from .project import Project
+from .tag import Tag
+from .types import Version, version_key
+
+LOG = logging.getLogger(__name__)
+
+
+class Release:
+    """
+    Render, commit, and tag a new version as a single transaction.
+
+    All files are rendered before anything is committed, using a pending tag for
+    the new version, then staged with one `git add`, committed once, and tagged
+    once. If any step fails, the commit is undone and every file is restored to
+    its previous contents.
+    """
+
+    def __init__(self, project: Project, version: Version, message: str) -> None:
+        self.project = project
+        self.version = version
+        self.message = message
+        self.backend = project.backend
+        self.head: Optional[str] = None
+        self.staged = False
+        self.committed = False
+        self.originals: Dict[Path, Optional[bytes]] = {}
+        self.workspaces: Dict[Path, Any] = {}
+
+    def files(self) -> List[GeneratedFile]:
+        """Files to regenerate for the release, not counting lockfiles"""
+        project = self.project
+        files: List[GeneratedFile] = [Changelog(project)]
+        if project.config.get("version_file"):
+            files.append(VersionFile(project))
+        if cargo_packages := project.config.get("cargo_packages"):
+            files.extend(CargoFile.search(project, cargo_packages))
+        if npm_packages := project.config.get("npm_packages"):
+            files.extend(NpmFile.search(project, npm_packages))
+        return files
+
+    def paths(self, generated: GeneratedFile) -> List[Path]:
+        """Paths that writing the given file may change"""
+        path = generated.filename
+        if isinstance(generated, PackageFile):
+            lock_file = generated.lock_file(self.workspaces)
+            return [path] if lock_file is None else [path, lock_file]
+        return [path]
+
+    def snapshot(self, paths: List[Path]) -> None:
+        for path in paths:
+            if path not in self.originals:
+                self.originals[path] = path.read_bytes() if path.is_file() else None
+
+    def render(self, *, incremental: bool = False, verify: bool = False) -> List[Path]:
+        """Write all files for the new version, returning paths that changed"""
+        tag = Tag.pending(self.version, self.message, self.backend)
+        tags = [t for t in self.project.tags if t.name != tag.name] + [tag]
+        tags.sort(key=lambda t: version_key(t.version), reverse=True)
+        self.project._tags = tags
+
+        files = self.files()
+        for generated in files:
+            self.snapshot(self.paths(generated))
+
+        changed: List[Path] = []
+        package_files: List[PackageFile] = []
+        for generated in files:
+            if isinstance(generated, PackageFile):
+                package_files.append(generated)
+                continue
+            elif isinstance(generated, Changelog) and (incremental or verify):
+                generated.update(verify=verify)
+            else:
+                generated.write()
+            if generated.changed:
+                changed.append(generated.filename)
+        changed += PackageFile.write_all(package_files)
+
+        return changed
+
+    def commit(self, paths: List[Path]) -> Tag:
+        """Stage, commit, and tag the rendered files"""
+        self.staged = True
+        if paths:
+            self.backend.add(*paths)
+        self.backend.commit(f"Version bump v{self.version}", allow_empty=True)
+        self.committed = True
+
+        tag = Tag(name=f"v{self.version}", version=self.version)
+        signed = bool(self.project.config.get("signed_tags"))
+        self.backend.create_tag(tag.name, self.message, signed=signed)
+        return tag
+
+    def rollback(self) -> None:
+        """Undo the release commit, and restore all files to their previous state"""
+        if self.committed:
+            self.backend.reset(self.head)
+            self.committed = False
+        if self.staged:
+            self.backend.reset(self.head, *self.originals)
+            self.staged = False
+        for path, content in self.originals.items():
+            if content is None:
+                if path.exists():
+                    path.unlink()
+            else:
+                write_file(path, content)
+        self.originals.clear()
+
+    def run(self, *, incremental: bool = False, verify: bool = False) -> Tag:
+        """Make the release, rolling back any changes if it fails"""
+        self.head = self.backend.head()
+        try:
+            paths = self.render(incremental=incremental, verify=verify)
+            return self.commit(paths)
+        except BaseException:
+            LOG.warning(f"release v{self.version} failed, rolling back")
+            self.rollback()
+            raise
@@ -0,0 +1,389 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT license
+
+import json
+import logging
+import os
+import re
+import subprocess
+from collections import deque
+from pathlib import Path
+from typing import (
+    Any,
+    Collection,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Pattern,
+    Sequence,
+    Tuple,
+)
+
+from .helpers import read_toml, sh_stdout
+from .profile import PARSE, span, WALK
+
+LOG = logging.getLogger(__name__)
+
+MANIFEST_NAMES = ("Cargo.toml", "package.json")
+SEARCH_STRATEGIES = ("auto", "git", "filesystem")
+SKIP_DIRS = frozenset(
+    {
+        ".bzr",
+        ".git",
+        ".hg",
+        ".svn",
+        ".tox",
+        ".venv",
+        "__pycache__",
+        "node_modules",
+        "target",
+        "vendor",
+    }
+)
+
+TOML_TABLE_RE = re.compile(r"^\s*\[\s*([^\[\]]+?)\s*\]\s*(?:#.*)?$")
+TOML_NAME_RE = re.compile(r"""^\s*name\s*=\s*(?:"([^"\\]*)"|'([^']*)')\s*(?:#.*)?$""")
+
+# (compiled pattern, negated, directories only)
+Rule = Tuple[Pattern[str], bool, bool]
+# (base path relative to the search root, rules) for each .gitignore in scope
+Rules = Tuple[Tuple[str, List[Rule]], ...]
+
+
+def translate(pattern: str) -> Pattern[str]:
+    """
+    Convert a single gitignore pattern into a regex matching relative paths.
+
+    Patterns containing a slash are anchored to the directory of the .gitignore,
+    while others match a file or directory name at any depth below it.
+    """
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+    out: List[str] = [] if anchored else ["(?:.*/)?"]
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if pattern.startswith("**/", index):
+            out.append("(?:.*/)?")
+            index += 3
+            continue
+        elif pattern.startswith("**", index):
+            out.append(".*")
+            index += 2
+            continue
+        elif char == "*":
+            out.append("[^/]*")
+        elif char == "?":
+            out.append("[^/]")
+        elif char == "[" and (end := pattern.find("]", index + 2)) > 0:
+            body = pattern[index + 1 : end].replace("\\", "\\\\")
+            if body[0] == "!":
+                body = "^" + body[1:]
+            out.append(f"[{body}]")
+            index = end
+        elif char == "\\" and index + 1 < len(pattern):
+            index += 1
+            out.append(re.escape(pattern[index]))
+        else:
+            out.append(re.escape(char))
+        index += 1
+
+    return re.compile("".join(out) + r"\Z")
+
+
+def parse_gitignore(text: str) -> List[Rule]:
+    """Parse the contents of a .gitignore file into a list of rules"""
+    rules: List[Rule] = []
+    for line in text.splitlines():
+        line = line.rstrip()
+        if not line or line.startswith("#"):
+            continue
+        negated = line.startswith("!")
+        if negated:
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if line:
+            rules.append((translate(line), negated, dir_only))
+    return rules
+
+
+def is_ignored(rules: Rules, path: str, is_dir: bool) -> bool:
+    """Check a path relative to the search root against gitignore rules"""
+    ignored = False
+    for base, patterns in rules:
+        relative = path[len(base) :]
+        for regex, negated, dir_only in patterns:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(relative):
+                ignored = not negated
+    return ignored
+
+
+def find_manifests(
+    root: Path,
+    names: Sequence[str] = MANIFEST_NAMES,
+    *,
+    skip: Collection[str] = SKIP_DIRS,
+) -> Dict[str, List[Path]]:
+    """
+    Find all files with the given names below root, in a single breadth-first pass.
+
+    Directories named in `skip`, symlinked directories, and anything matched by a
+    .gitignore along the way are not searched. Results are ordered by depth, then
+    by name, so that shallower manifests are always found first.
+    """
+    found: Dict[str, List[Path]] = {name: [] for name in names}
+    queue: Deque[Tuple[str, str, Rules]] = deque([(str(root), "", ())])
+    while queue:
+        path, prefix, rules = queue.popleft()
+        try:
+            with os.scandir(path) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError:
+            LOG.debug(f"unable to search {path}", exc_info=True)
+            continue
+
+        if any(entry.name == ".gitignore" for entry in entries):
+            try:
+                text = Path(path, ".gitignore").read_text(errors="replace")
+                rules += ((prefix, parse_gitignore(text)),)
+            except OSError:
+                LOG.debug(f"unable to read {path}/.gitignore", exc_info=True)
+
+        for entry in entries:
+            relative = prefix + entry.name
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            if is_dir:
+                if entry.name not in skip and not is_ignored(rules, relative, True):
+                    queue.append((entry.path, relative + "/", rules))
+            elif entry.name in found and not is_ignored(rules, relative, False):
+                found[entry.name].append(Path(entry.path))
+
+    return found
+
+
+def git_manifests(
+    root: Path,
+    names: Sequence[str] = MANIFEST_NAMES,
+    *,
+    skip: Collection[str] = SKIP_DIRS,
+) -> Optional[Dict[str, List[Path]]]:
+    """
+    Find tracked files with the given names below root using the git index.
+
+    Returns None if root is not inside a git work tree. Results are ordered the
+    same as `find_manifests`, and exclude paths that no longer exist on disk.
+    """
+    pathspecs = [f":(glob)**/{name}" for name in names]
+    try:
+        out = sh_stdout(
+            "git", "-C", str(root), "ls-files", "-z", "--cached", "--", *pathspecs
+        )
+    except (OSError, subprocess.CalledProcessError):
+        LOG.debug(f"unable to list tracked files in {root}", exc_info=True)
+        return None
+
+    found: Dict[str, List[Path]] = {name: [] for name in names}
+    paths = sorted(
+        {tuple(path.split("/")) for path in out.split("\0") if path},
+        key=lambda parts: (len(parts), parts),
+    )
+    for parts in paths:
+        if parts[-1] in found and not any(part in skip for part in parts[:-1]):
+            path = root.joinpath(*parts)
+            if path.is_file():
+                found[parts[-1]].append(path)
+
+    return found
+
+
+def search_manifests(
+    root: Path,
+    names: Sequence[str] = MANIFEST_NAMES,
+    *,
+    strategy: str = "auto",
+    skip: Collection[str] = SKIP_DIRS,
+) -> Dict[str, List[Path]]:
+    """
+    Find manifests below root with the given strategy.
+
+    `auto` asks the git index when root is inside a work tree, and otherwise walks
+    the filesystem; `git` and `filesystem` only use the named strategy, though
+    `git` will still fall back to walking the filesystem outside of a work tree.
+    """
+    if strategy not in SEARCH_STRATEGIES:
+        raise ValueError(f"unknown manifest search strategy {strategy!r}")
+
+    if strategy != "filesystem":
+        with span(WALK, "git index"):
+            found = git_manifests(root, names, skip=skip)
+        if found is not None:
+            return found
+        if strategy == "git":
+            LOG.warning(f"{root} is not in a git work tree, searching filesystem")
+
+    with span(WALK, "filesystem"):
+        return find_manifests(root, names, skip=skip)
+
+
+def cargo_package_name(text: str) -> Optional[str]:
+    """
+    Get the package name from the contents of a Cargo.toml, or None if no package.
+
+    Scans lines until the name is found in the `[package]` table, only falling back
+    to a full parse for manifests the scanner doesn't understand.
+    """
+    if "package" not in text:
+        return None
+
+    table: Optional[str] = None
+    for line in text.splitlines():
+        if line.lstrip().startswith("["):
+            if table == "package":
+                break
+            match = TOML_TABLE_RE.match(line)
+            table = match.group(1) if match else None
+        elif table == "package":
+            match = TOML_NAME_RE.match(line)
+            if match:
+                return match.group(1) if match.group(2) is None else match.group(2)
+
+    name = read_toml(text).get("package", {}).get("name")
+    return name if isinstance(name, str) else None
+
+
+def cargo_workspace(text: str) -> Optional[str]:
+    """
+    Get the workspace root declared by a Cargo.toml, relative to the manifest.
+
+    Returns "." for manifests with a `[workspace]` table, the path given by
+    `package.workspace` for members that name their root, and otherwise None.
+    """
+    if "workspace" not in text:
+        return None
+
+    for line in text.splitlines():
+        match = TOML_TABLE_RE.match(line)
+        if match and match.group(1) == "workspace":
+            return "."
+
+    data = read_toml(text)
+    if "workspace" in data:
+        return "."
+    workspace = data.get("package", {}).get("workspace")
+    return workspace if isinstance(workspace, str) else None
+
+
+def cargo_lock_file(
+    package_dir: Path, root: Path, workspaces: Optional[Dict[Path, Any]] = None
+) -> Optional[Path]:
+    """
+    Find the Cargo.lock that records the crate in the given directory.
+
+    Crates in a workspace share the lockfile at the workspace root, found the same
+    way as cargo: from `package.workspace`, or the nearest ancestor manifest with a
+    `[workspace]` table, stopping at the project root. Otherwise, a crate only has
+    a lockfile of its own. Pass the same `workspaces` dict between calls to avoid
+    reading ancestor manifests more than once; it is keyed by manifest path, and
+    can be shared with `npm_lock_file`.
+    """
+    workspaces = {} if workspaces is None else workspaces
+    lock_file = package_dir / "Cargo.lock"
+    workspace = cargo_workspace((package_dir / "Cargo.toml").read_text())
+    if workspace is not None:
+        lock_file = Path(os.path.normpath(package_dir / workspace / "Cargo.lock"))
+
+    elif not lock_file.is_file():
+        for parent in package_dir.parents:
+            if parent != root and root not in parent.parents:
+                break
+            manifest = parent / "Cargo.toml"
+            if manifest not in workspaces:
+                workspaces[manifest] = (
+                    manifest.is_file() and cargo_workspace(manifest.read_text()) == "."
+                )
+            if workspaces[manifest]:
+                lock_file = parent / "Cargo.lock"
+                break
+
+    return lock_file if lock_file.is_file() else None
+
+
+def npm_package_name(text: str, candidates: Collection[str]) -> Optional[str]:
+    """
+    Get the package name from the contents of a package.json, if it's a candidate.
+
+    Manifests that don't contain any of the candidate names are skipped without
+    being parsed.
+    """
+    if not any(json.dumps(name) in text for name in candidates):
+        return None
+
+    with span(PARSE, "json"):
+        name = json.loads(text).get("name")
+    return name if name in candidates else None
+
+
+def npm_workspaces(text: str) -> Optional[List[Pattern[str]]]:
+    """
+    Get patterns for the workspace directories listed in a package.json, if any.
+
+    Supports both a list of globs, and the `{"packages": [...]}` form, matching
+    directory paths relative to the manifest.
+    """
+    if '"workspaces"' not in text:
+        return None
+
+    with span(PARSE, "json"):
+        workspaces = json.loads(text).get("workspaces")
+    if isinstance(workspaces, dict):
+        workspaces = workspaces.get("packages")
+    if not isinstance(workspaces, list):
+        return None
+
+    patterns: List[Pattern[str]] = []
+    for glob in workspaces:
+        if isinstance(glob, str):
+            glob = glob.strip()
+            while glob.startswith("./"):
+                glob = glob[2:]
+            patterns.append(translate("/" + glob.rstrip("/")))
+    return patterns
+
+
+def npm_lock_file(
+    package_dir: Path, root: Path, workspaces: Optional[Dict[Path, Any]] = None
+) -> Optional[Path]:
+    """
+    Find the package-lock.json that records the package in the given directory.
+
+    Packages in npm workspaces share the lockfile next to the nearest ancestor
+    package.json whose `workspaces` globs match the package directory, stopping at
+    the project root. Otherwise, a package only has a lockfile of its own. Shares
+    the `workspaces` cache with `cargo_lock_file`.
+    """
+    workspaces = {} if workspaces is None else workspaces
+    for parent in package_dir.parents:
+        if parent != root and root not in parent.parents:
+            break
+        manifest = parent / "package.json"
+        if manifest not in workspaces:
+            workspaces[manifest] = (
+                npm_workspaces(manifest.read_text()) if manifest.is_file() else None
+            )
+        patterns = workspaces[manifest]
+        relative = package_dir.relative_to(parent).as_posix()
+        if patterns and any(pattern.match(relative) for pattern in patterns):
+            lock_file = parent / "package-lock.json"
+            if lock_file.is_file():
+                return lock_file
+            break
+
+    lock_file = package_dir / "package-lock.json"
+    return lock_file if lock_file.is_file() else None
@@ -4,31 +4,66 @@
 import logging
 import re
 import subprocess
+from collections import Counter
 from dataclasses import dataclass
-from typing import Any, List, Match, Optional
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Match, Optional, Sequence, Tuple
 
-from .helpers import sh
-from .types import InvalidVersion, Version
+from .backend import (
+    CliBackend,
+    Commit,
+    format_shortlog,
+    GitBackend,
+    parse_tag_records,
+    parse_walk,
+    TAG_FORMAT,
+    TagData,
+    TagRef,
+    walk_args,
+)
+from .helpers import ash, intern, slotted
+from .types import parse_version, Version, version_key
 
 LOG = logging.getLogger(__name__)
 
-GIT_TAG_RE = re.compile(
-    r"object\s+(\w+)\ntype\s+(\w+)\ntag\s+(.+)\ntagger\s(.+)\n\n((?s:.*))$"
-)
 PGP_MSG_RE = re.compile(
     r"-----BEGIN PGP SIGNATURE-----.+-----END PGP SIGNATURE-----\n", re.DOTALL
 )
 
 
+def cleanup_message(message: str) -> str:
+    """
+    Clean up a tag message the way `git tag -m` does before storing it.
+
+    Strips comment lines and trailing whitespace, collapses runs of blank lines,
+    and drops leading and trailing blank lines, ending with a single newline.
+    """
+    lines: List[str] = []
+    for line in message.splitlines():
+        line = line.rstrip()
+        if line.startswith("#"):
+            continue
+        if line or (lines and lines[-1]):
+            lines.append(line)
+    while lines and not lines[-1]:
+        lines.pop()
+    return "".join(f"{line}\n" for line in lines)
+
+
+@slotted
 @dataclass(eq=False)
 class Tag:
     name: str
     version: Version
+    sha: Optional[str] = None
+    tagger: Optional[str] = None
+    date: Optional[str] = None
 
     _message: Optional[str] = None
     _signature: Optional[str] = None
     _shortlog_cmd: Optional[str] = None
     _shortlog: Optional[str] = None
+    _shortlog_failed: bool = False  # empty shortlog is a fallback, not a result
 
     def __eq__(self, other: Any) -> bool:
         if isinstance(other, Tag):
@@ -48,95 +83,408 @@ class Tag:
     @property
     def message(self) -> str:
         """Retrieve the tag's message and any PGP signature."""
-        if self._message is None:
-            out = sh(f"git cat-file tag {self.name}")
+        return self.fetch_message()
 
-            match = GIT_TAG_RE.match(out)
-            if not match:
+    def fetch_message(self, backend: Optional[GitBackend] = None) -> str:
+        """Version of `message` that reads the tag with the given git backend."""
+        if self._message is None:
+            if backend is None:
+                backend = CliBackend()
+            data = backend.read_tag(self.name)
+            if data is None:
                 LOG.warning(f"unmatched tag contents for {self.name}")
-                LOG.debug(out)
                 return ""
 
-            def pgp(match: Match) -> str:
-                self._signature = match.group(0)
+            self._apply_ref(data)
+
+        return self._message or ""
+
+    async def amessage(self, root: Optional[Path] = None) -> str:
+        """Async version of `message`, running git in the given repo path."""
+        if self._message is None:
+            ref = f"refs/tags/{self.name}"
+            out = await ash(
+                "git", "for-each-ref", f"--format={TAG_FORMAT}", ref, cwd=root
+            )
+            record = next(parse_tag_records(out), None)
+            if record is None or record.data is None:
+                LOG.warning(f"unmatched tag contents for {self.name}")
                 return ""
+            self._apply_ref(record.data)
+
+        return self._message or ""
+
+    def _apply_ref(self, data: TagData) -> None:
+        """Fill in tag details from backend tag data."""
+        if data.kind == "tag":
+            self.tagger = intern(data.tagger.strip())
+            self.date = data.date
+            self._parse_message(data.content)
+        else:
+            # lightweight tags have no message of their own
+            self._message = ""
 
-            content = match.group(5)
-            content = PGP_MSG_RE.sub(pgp, content)
-            self._message = content
+    def _parse_message(self, content: str) -> None:
+        """Split raw tag contents into message and PGP signature."""
 
-        return self._message
+        def pgp(match: Match) -> str:
+            self._signature = match.group(0)
+            return ""
+
+        self._message = PGP_MSG_RE.sub(pgp, content)
 
     @property
     def shortlog_cmd(self) -> str:
         """Generate the shortlog command to be run."""
+        return self.fetch_shortlog_cmd()
+
+    def fetch_shortlog_cmd(self, backend: Optional[GitBackend] = None) -> str:
+        """Version of `shortlog_cmd` that finds the base with the given git backend."""
         if self._shortlog_cmd is None:
-            base = sh(f"git describe --tags --abbrev=0 --always {self.name}~1").strip()
-
-            # If there is no preceding tag, the describe command above will just return
-            # the rev hash of the commit preceding the tag, resulting in a bad shortlog.
-            # We can use `git tag -l <name>` to see if it's a real tag or just a hash.
-            # If it's just a rev, then this is the earliest tag in that tree, and we
-            # should just generate a shortlog without a starting ref.
-            # To save shell commands, we assume that any Version-like name is a tag.
-            try:
-                Version(base)
-            except InvalidVersion:
-                base = sh(f"git tag -l {base}").strip()
-            if base:
-                spec = f"{base}...{self.name}"
-            else:
-                spec = self.name
+            if backend is None:
+                backend = CliBackend()
+            # If there is no preceding tag, this is the earliest tag in that tree, and
+            # we should just generate a shortlog without a starting ref. A tag on the
+            # root commit has no parent to describe at all, and raises instead.
+            base = backend.describe(f"{self.name}~1") or ""
+            self._shortlog_cmd = self._format_shortlog_cmd(base)
 
-            self._shortlog_cmd = f"git shortlog -s {spec}"
+        return self._shortlog_cmd
+
+    async def ashortlog_cmd(self, root: Optional[Path] = None) -> str:
+        """Async version of `shortlog_cmd`, running git in the given repo path."""
+        if self._shortlog_cmd is None:
+            base = await ash(
+                "git",
+                "describe",
+                "--tags",
+                "--abbrev=0",
+                "--always",
+                f"{self.name}~1",
+                cwd=root,
+            )
+            base = base.strip()
+            if parse_version(base) is None:
+                base = (await ash("git", "tag", "-l", base, cwd=root)).strip()
+
+            self._shortlog_cmd = self._format_shortlog_cmd(base)
 
         return self._shortlog_cmd
 
+    def _format_shortlog_cmd(self, base: str) -> str:
+        if base:
+            spec = f"{base}...{self.name}"
+        else:
+            spec = self.name
+
+        return f"git shortlog -s {spec}"
+
+    @property
+    def shortlog_base(self) -> str:
+        """Name of the tag the shortlog starts from, or "" for all preceding history."""
+        spec = self.shortlog_cmd.rpartition(" ")[2]
+        return spec.rpartition("...")[0]
+
     @property
     def shortlog(self) -> str:
         """Generate the tag's associated shortlog."""
+        return self.fetch_shortlog()
+
+    def fetch_shortlog(self, backend: Optional[GitBackend] = None) -> str:
+        """Version of `shortlog` that reads history with the given git backend."""
+        if self._shortlog is None:
+            if backend is None:
+                backend = CliBackend()
+            try:
+                self.fetch_shortlog_cmd(backend)
+                base = self.shortlog_base or None
+                self._shortlog = backend.shortlog(self.name, base).rstrip()
+
+            except Exception:
+                LOG.exception(f"failed to generate shortlog for {self.name}")
+                self._shortlog = ""
+                self._shortlog_failed = True
+
+        return self._shortlog
+
+    async def ashortlog(self, root: Optional[Path] = None) -> str:
+        """Async version of `shortlog`, running git in the given repo path."""
         if self._shortlog is None:
             try:
-                self._shortlog = sh(self.shortlog_cmd).rstrip()
+                cmd = await self.ashortlog_cmd(root)
+                self._shortlog = (await ash(cmd, cwd=root)).rstrip()
 
             except subprocess.CalledProcessError:
                 LOG.exception(f"failed to generate shortlog for {self.name}")
                 self._shortlog = ""
+                self._shortlog_failed = True
 
         return self._shortlog
 
     @classmethod
-    def all_tags(cls) -> List["Tag"]:
-        """Generate an ordered list of tag objects"""
-        names = [n.strip() for n in sh("git tag").splitlines() if n]
+    def all_tags(
+        cls, root: Optional[Path] = None, backend: Optional[GitBackend] = None
+    ) -> List["Tag"]:
+        """
+        Generate an ordered list of tag objects.
+
+        Messages are included when the backend can list them without extra work,
+        and are otherwise loaded on demand.
+        """
+        if backend is None:
+            backend = CliBackend(root)
+        return cls._from_refs(backend.list_tags())
+
+    @classmethod
+    async def aall_tags(cls, root: Optional[Path] = None) -> List["Tag"]:
+        """Async version of `all_tags`, running git in the given repo path."""
+        out = await ash(
+            "git", "for-each-ref", f"--format={TAG_FORMAT}", "refs/tags", cwd=root
+        )
+        return cls._parse_refs(out)
+
+    @classmethod
+    def load_messages(
+        cls, tags: Sequence["Tag"], backend: Optional[GitBackend] = None
+    ) -> None:
+        """Fill in messages for the given tags with a single backend request"""
+        pending = {tag.sha: tag for tag in tags if tag._message is None and tag.sha}
+        if not pending:
+            return
+
+        if backend is None:
+            backend = CliBackend()
+        try:
+            found = backend.read_tags(pending)
+        except Exception:
+            LOG.exception("failed to load tag messages")
+            return
+
+        for sha, data in found.items():
+            pending[sha]._apply_ref(data)
+
+    @classmethod
+    def _parse_refs(cls, out: str) -> List["Tag"]:
+        return cls._from_refs(parse_tag_records(out))
+
+    @classmethod
+    def _from_refs(cls, refs: Iterable[TagRef]) -> List["Tag"]:
         tags: List[Tag] = []
-        for name in names:
-            try:
-                tags.append(Tag(name=name, version=Version(name)))
-            except InvalidVersion:
-                LOG.warning(f"Skipping tag {name}")
+        for ref in refs:
+            version = parse_version(ref.name)
+            if version is None:
+                LOG.warning(f"Skipping tag {ref.name}")
+                continue
 
-        tags.sort(reverse=True)
+            tag = Tag(name=ref.name, version=version, sha=ref.sha)
+            if ref.data is not None:
+                tag._apply_ref(ref.data)
+            tags.append(tag)
+
+        tags.sort(key=lambda tag: version_key(tag.version), reverse=True)
 
         return tags
 
     @classmethod
-    def create(cls, version: Version, message: str, *, signed: bool = False) -> "Tag":
+    def load_shortlogs(
+        cls,
+        tags: Sequence["Tag"],
+        backend: Optional[GitBackend] = None,
+        *,
+        limit: bool = False,
+        base: Optional[str] = None,
+    ) -> None:
+        """
+        Fill in shortlogs for the given tags from a single walk of the history.
+
+        Each commit is assigned to the first tagged commit that contains it, visiting
+        tagged commits from oldest to newest. A tag's shortlog is only filled in when
+        that assignment is guaranteed to match the output of `git describe` and
+        `git shortlog`: a single parent commit, one nearest preceding tag that
+        contains every other preceding tag, and no history already claimed by tags
+        that aren't its ancestors. Anything else is left for the regular per-tag
+        commands to compute on demand.
+
+        With `limit`, only history reachable from the given tags is walked, stopping
+        at the `base` tag if given. Tags whose history runs past that point are left
+        for the per-tag commands too.
+        """
+        pending = [tag for tag in tags if tag._shortlog is None]
+        if not pending:
+            return
+
+        if backend is None:
+            backend = CliBackend()
+        heads = [tag.name for tag in pending] if limit else None
+        try:
+            commits = list(backend.walk(heads, base))
+        except Exception:
+            LOG.exception("failed to walk tag history")
+            return
+
+        cls._assign_shortlogs(pending, commits)
+
+    @classmethod
+    async def aload_shortlogs(
+        cls,
+        tags: Sequence["Tag"],
+        root: Optional[Path] = None,
+        *,
+        limit: bool = False,
+        base: Optional[str] = None,
+    ) -> None:
+        """Async version of `load_shortlogs`, running git in the given repo path."""
+        pending = [tag for tag in tags if tag._shortlog is None]
+        if not pending:
+            return
+
+        heads = [tag.name for tag in pending] if limit else None
+        try:
+            out = await ash("git", *walk_args(heads, base), cwd=root)
+        except subprocess.CalledProcessError:
+            LOG.exception("failed to walk tag history")
+            return
+
+        cls._assign_shortlogs(pending, parse_walk(out))
+
+    @classmethod
+    def _assign_shortlogs(
+        cls, pending: Sequence["Tag"], walk: Iterable[Commit]
+    ) -> None:
+        parents: Dict[str, Tuple[str, ...]] = {}
+        authors: Dict[str, str] = {}
+        tagged: List[str] = []
+        names: Dict[str, List[str]] = {}
+        for commit in walk:
+            parents[commit.sha] = commit.parents
+            authors[commit.sha] = commit.author
+            if commit.tags:
+                tagged.append(commit.sha)
+                names[commit.sha] = commit.tags
+
+        # tagged commits are visited parents-first, so every tagged commit reachable
+        # from the current one has already claimed itself and its own history
+        owner: Dict[str, str] = {}
+        claimed: Dict[str, List[str]] = {}
+        nearest: Dict[str, List[str]] = {}
+        reachable: Dict[str, int] = {}  # bitmask of tagged ancestors
+        bits: Dict[str, int] = {}
+        exact: Dict[str, bool] = {}
+        for index, head in enumerate(tagged):
+            bits[head] = 1 << index
+            owner[head] = head
+            commits = [head]
+            found: Dict[str, None] = {}  # tagged ancestors reached without another tag
+            owners: Dict[str, None] = {}  # tags that claimed other commits reached
+            queue = [head]
+            ok = True
+            while queue:
+                sha = queue.pop()
+                for parent in parents[sha]:
+                    if parent not in parents:
+                        ok = False  # shallow or otherwise incomplete history
+                    elif parent in bits:
+                        found[parent] = None
+                    elif parent in owner:
+                        owners[owner[parent]] = None
+                    else:
+                        owner[parent] = head
+                        commits.append(parent)
+                        queue.append(parent)
+
+            mask = 0
+            for sha in found:
+                mask |= bits[sha] | reachable[sha]
+            # A commit claimed by another tag is only part of an ancestor's history if
+            # that tag is itself an ancestor, like when a branch forked before a tag is
+            # merged after it. Tags on sibling branches can claim shared history first,
+            # and the claimed commits are then unknown, so leave those to git.
+            if any(not mask & bits[sha] for sha in owners):
+                ok = False
+            reachable[head] = mask
+            claimed[head] = commits
+            exact[head] = ok
+            nearest[head] = [
+                sha
+                for sha in found
+                if not any(reachable[other] & bits[sha] for other in found)
+            ]
+
+        commit_for = {name: sha for sha, refs in names.items() for name in refs}
+        for tag in pending:
+            head = commit_for.get(tag.name, "")
+            if len(parents.get(head, ())) != 1 or not exact[head]:
+                continue
+
+            bases = nearest[head]
+            if not bases:
+                spec = tag.name
+            elif len(bases) == 1 and len(names[bases[0]]) == 1:
+                spec = f"{names[bases[0]][0]}...{tag.name}"
+            else:
+                continue
+
+            counts = Counter(authors[sha] for sha in claimed[head])
+            tag._shortlog_cmd = f"git shortlog -s {spec}"
+            tag._shortlog = format_shortlog(counts)
+
+    @classmethod
+    def create(
+        cls,
+        version: Version,
+        message: str,
+        *,
+        signed: bool = False,
+        backend: Optional[GitBackend] = None,
+    ) -> "Tag":
         """Create a new tag with the given message"""
         name = f"v{version}"
-        flag = "--sign" if signed else "--annotate"
-        sh("git", "tag", flag, name, "-m", message)
+        if backend is None:
+            backend = CliBackend()
+        backend.create_tag(name, message, signed=signed)
 
         return Tag(name=name, version=version)
 
-    def update(self, message: Optional[str] = None, *, signed: bool = False) -> None:
+    @classmethod
+    def pending(cls, version: Version, message: str, backend: GitBackend) -> "Tag":
+        """
+        Tag for a release that will be made with a new commit on top of HEAD.
+
+        Message and shortlog are filled in ahead of time, matching what git will
+        report once the commit and tag exist, so that files can be rendered before
+        anything is committed.
+        """
+        tag = Tag(name=f"v{version}", version=version)
+        tag._message = cleanup_message(message)
+
+        head = backend.head()
+        base = backend.describe(head) if head else None
+        tag._shortlog_cmd = tag._format_shortlog_cmd(base or "")
+
+        counts: "Counter[str]" = Counter()
+        if head:
+            for line in backend.shortlog(head, base).splitlines():
+                count, _, author = line.strip().partition("\t")
+                counts[author] += int(count)
+        counts[backend.author()] += 1  # the release commit itself
+        tag._shortlog = format_shortlog(counts)
+        return tag
+
+    def update(
+        self,
+        message: Optional[str] = None,
+        *,
+        signed: bool = False,
+        backend: Optional[GitBackend] = None,
+    ) -> None:
         """Update an existing tag, reusing the existing message if not given"""
         if message is None:
             message = self.message
         else:
             self._message = None
-        flag = "--sign" if signed else "--annotate"
-        sh("git", "tag", "--force", flag, self.name, "-m", message)
+        if backend is None:
+            backend = CliBackend()
+        backend.create_tag(self.name, message, signed=signed, force=True)
 
     @classmethod
     def null(cls):
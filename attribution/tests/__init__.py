@@ -1,7 +1,17 @@
 # Copyright 2022 Amethyst Reese
 # Licensed under the MIT license
 
+from .backend import BackendTest
+from .bench import BenchTest
+from .cache import CacheTest
 from .generate import GenerateTest
 from .helpers import HelpersTest
+from .lockfile import LockfileTest
+from .main import MainTest
+from .profile import ProfileTest
 from .project import ProjectTest
+from .refs import RefsTest
+from .release import ReleaseTest
+from .search import SearchTest
 from .tag import TagTest
+from .types import TypesTest
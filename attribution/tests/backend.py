@@ -0,0 +1,361 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT license
+
+import subprocess
+from collections import Counter
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Collection, Dict, Iterator, List, Optional, Tuple, Union
+from unittest import skipUnless, TestCase
+from unittest.mock import patch, PropertyMock
+
+from ..backend import (
+    BackendUnavailable,
+    CliBackend,
+    Commit,
+    DulwichBackend,
+    format_shortlog,
+    GitBackend,
+    Pygit2Backend,
+    select_backend,
+    TagData,
+    TagRef,
+)
+from ..helpers import git_batch, sh
+from ..project import Project
+from ..tag import Tag
+from ..types import Version
+from .refs import init_repo
+
+
+def importable(name: str) -> bool:
+    try:
+        __import__(name)
+        return True
+    except ImportError:
+        return False
+
+
+class MemoryBackend:
+    """In-memory git backend, for testing without a repo"""
+
+    name = "memory"
+
+    def __init__(self) -> None:
+        self.tags: Dict[str, Tuple[str, TagData]] = {}
+        self.commits: Dict[str, Commit] = {}
+        self.staged: List[str] = []
+        self.actions: List[str] = []
+
+    def add_commit(self, sha: str, author: str, *parents: str) -> None:
+        self.commits[sha] = Commit(sha, parents, author, [])
+
+    def add_tag(self, name: str, commit: str, message: str = "") -> None:
+        self.tags[name] = (f"tag-{name}", TagData("tag", "A <a@b.c>", "", message))
+        self.commits[commit].tags.append(name)
+
+    def list_tags(self) -> List[TagRef]:
+        return [TagRef(name, sha, None) for name, (sha, _) in self.tags.items()]
+
+    def read_tags(self, shas: Collection[str]) -> Dict[str, TagData]:
+        return {sha: data for sha, data in self.tags.values() if sha in shas}
+
+    def read_tag(self, name: str) -> Optional[TagData]:
+        return self.tags[name][1] if name in self.tags else None
+
+    def walk(
+        self, tags: Optional[Collection[str]] = None, base: Optional[str] = None
+    ) -> Iterator[Commit]:
+        return iter(self.commits.values())  # insertion order is parents first
+
+    def resolve(self, rev: str) -> Optional[Commit]:
+        """Commit for a sha or tag name, optionally followed by `~1`"""
+        name, parent, _ = rev.partition("~1")
+        if name == "HEAD":
+            name = self.head() or ""
+        for commit in self.commits.values():
+            if name in (commit.sha, *commit.tags):
+                if not parent:
+                    return commit
+                return self.commits[commit.parents[0]] if commit.parents else None
+        return None
+
+    def ancestors(self, rev: Optional[str]) -> List[str]:
+        commit = self.resolve(rev) if rev else None
+        queue = [commit.sha] if commit else []
+        seen: List[str] = []
+        while queue:
+            sha = queue.pop()
+            if sha not in seen:
+                seen.append(sha)
+                queue += self.commits[sha].parents
+        return seen
+
+    def shortlog(self, rev: str, exclude: Optional[str] = None) -> str:
+        excluded = self.ancestors(exclude)
+        return format_shortlog(
+            Counter(
+                self.commits[sha].author
+                for sha in self.ancestors(rev)
+                if sha not in excluded
+            )
+        )
+
+    def head(self) -> Optional[str]:
+        return next(reversed(self.commits), None)
+
+    def describe(self, rev: str) -> Optional[str]:
+        commit = self.resolve(rev)
+        if commit is None:
+            raise ValueError(f"unknown revision {rev}")
+        while not commit.tags:
+            if not commit.parents:
+                return None
+            commit = self.commits[commit.parents[0]]
+        return commit.tags[0]
+
+    def log(self, *args: str, raw: bool = False) -> str:
+        return "".join(f"commit {sha}\n" for sha in self.commits)
+
+    def author(self) -> str:
+        return "Releaser"
+
+    def create_tag(
+        self, name: str, message: str, *, signed: bool = False, force: bool = False
+    ) -> None:
+        assert force or name not in self.tags
+        self.actions.append(f"tag {name}")
+
+    def add(self, *paths: Union[str, Path]) -> None:
+        self.staged += [str(path) for path in paths]
+
+    def commit(
+        self,
+        message: Optional[str] = None,
+        *,
+        amend: bool = False,
+        allow_empty: bool = False,
+    ) -> None:
+        self.actions.append(f"commit {message} amend={amend}")
+
+    def reset(self, rev: Optional[str], *paths: Union[str, Path]) -> None:
+        self.actions.append(f"reset {rev} {' '.join(str(path) for path in paths)}")
+
+
+class BackendTest(TestCase):
+    def test_memory_backend(self):
+        backend = MemoryBackend()
+        backend.add_commit("c1", "Alice")
+        backend.add_commit("c2", "Bob", "c1")
+        backend.add_tag("v1.0", "c2", "First\n")
+        backend.add_commit("c3", "Alice", "c2")
+        backend.add_commit("c4", "Alice", "c3")
+        backend.add_tag("v1.1", "c4", "Second\n")
+        backend.add_tag("other", "c4")
+
+        checked: GitBackend = backend
+        project = Project("foo", "foo", cache=False, _backend=checked)
+        self.assertEqual(["v1.1", "v1.0"], [tag.name for tag in project.tags])
+        self.assertEqual(["tag-v1.1", "tag-v1.0"], [tag.sha for tag in project.tags])
+
+        project.prefetch()
+        v11, v10 = project.tags
+        self.assertEqual("Second\n", v11.message)
+        self.assertEqual("A <a@b.c>", v11.tagger)
+        self.assertEqual("git shortlog -s v1.0...v1.1", v11.shortlog_cmd)
+        self.assertEqual("     2\tAlice", v11.shortlog)
+        self.assertEqual("git shortlog -s v1.0", v10.shortlog_cmd)
+        self.assertEqual("     1\tAlice\n     1\tBob", v10.shortlog)
+
+        pending = Tag.pending(Version("1.2"), "Third\n# comment\n", backend=backend)
+        self.assertEqual("Third\n", pending.message)
+        self.assertEqual("git shortlog -s v1.1...v1.2", pending.shortlog_cmd)
+        self.assertEqual("     1\tReleaser", pending.shortlog)
+
+        # per-tag reads go through the project's backend
+        fresh = Project("foo", "foo", cache=False, _backend=checked)
+        fresh.fetch_tags(fresh.tags)
+        v11, v10 = fresh.tags
+        self.assertEqual(("Second\n", "First\n"), (v11.message, v10.message))
+        self.assertEqual("git shortlog -s v1.0...v1.1", v11.shortlog_cmd)
+        self.assertEqual("     2\tAlice", v11.shortlog)
+        self.assertEqual("     1\tAlice\n     1\tBob", v10.shortlog)
+        self.assertEqual("     3\tAlice\n     1\tBob", fresh.shortlog)
+        self.assertIn("commit c4", fresh.log_since_tag(v11))
+
+        tag = Tag.create(Version("1.2"), "Third", backend=backend)
+        tag.update(message="Third!", backend=backend)
+        self.assertEqual(["tag v1.2", "tag v1.2"], backend.actions)
+
+    def test_cli_backend(self):
+        with TemporaryDirectory() as td:
+            tdp = Path(td)
+            git = init_repo(td)
+            backend = CliBackend(tdp)
+            self.assertEqual([], backend.list_tags())
+            self.assertEqual([], list(backend.walk()))
+
+            backend.commit("first", allow_empty=True)
+            self.assertIsNone(backend.describe("HEAD"))
+            backend.create_tag("v1.0", "Release 1.0")
+            (tdp / "file.txt").write_text("hello\n")
+            backend.add(tdp / "file.txt")
+            backend.commit("second")
+            sh(*git, "commit", "-q", "--allow-empty", "-m", "third", "--author=B <b@c>")
+            backend.create_tag("v1.1", "Release 1.1")
+            backend.create_tag("v1.1", "Release 1.1 again", force=True)
+            sh(*git, "tag", "v1.1.1")
+
+            refs = {ref.name: ref for ref in backend.list_tags()}
+            self.assertEqual(["v1.0", "v1.1", "v1.1.1"], sorted(refs))
+            data = backend.read_tags([refs["v1.1"].sha, refs["v1.1.1"].sha, "nope"])
+            self.assertEqual("Release 1.1 again\n", data[refs["v1.1"].sha].content)
+            self.assertEqual("commit", data[refs["v1.1.1"].sha].kind)
+            self.assertEqual(data[refs["v1.1"].sha], backend.read_tag("v1.1"))
+            self.assertEqual("commit", backend.read_tag("v1.1.1").kind)
+            self.assertIsNone(backend.read_tag("nope"))
+            git_batch(tdp).close()
+
+            commits = list(backend.walk())
+            self.assertEqual(3, len(commits))
+            self.assertEqual((), commits[0].parents)
+            self.assertEqual(["v1.0"], commits[0].tags)
+            self.assertEqual(["v1.1", "v1.1.1"], sorted(commits[2].tags))
+            self.assertEqual("B", commits[2].author)
+
+            self.assertEqual("     1\tA\n     1\tB", backend.shortlog("v1.1", "v1.0"))
+            self.assertEqual(
+                sh(*git, "shortlog", "-s", "v1.1").rstrip(), backend.shortlog("v1.1")
+            )
+
+            self.assertEqual(sh(*git, "rev-parse", "HEAD").strip(), backend.head())
+            self.assertEqual("v1.1", backend.describe("HEAD"))
+            self.assertEqual("v1.0", backend.describe("v1.1~1"))
+            with self.assertRaises(subprocess.CalledProcessError):
+                backend.describe("v1.0~1")  # root commit
+            self.assertEqual(
+                sh(*git, "log", "--reverse", "v1.0.."),
+                backend.log("--reverse", "v1.0.."),
+            )
+            with self.assertRaises(subprocess.CalledProcessError):
+                backend.describe("v1.0~0^{tree}")
+            self.assertEqual("A", backend.author())
+
+            (tdp / "file.txt").write_text("goodbye\n")
+            backend.add("file.txt")
+            backend.commit(amend=True)
+            self.assertIn("third", sh(*git, "log", "-1", "--format=%s"))
+
+            (tdp / "new.txt").write_text("new\n")
+            backend.add("file.txt", "new.txt")
+            backend.reset("HEAD", "file.txt")
+            backend.reset(None, "new.txt")
+            self.assertEqual("", sh(*git, "diff", "--cached", "--name-only"))
+            backend.reset(refs["v1.0"].sha)
+            self.assertEqual("first", sh(*git, "log", "-1", "--format=%s").strip())
+            backend.reset(None)
+            self.assertIsNone(backend.head())
+
+    def check_in_process(self, cls):
+        with TemporaryDirectory() as td:
+            tdp = Path(td)
+            git = init_repo(td)
+            (tdp / ".mailmap").write_text("Bee <b@c.d> <bee@old>\n")
+
+            sh(*git, "commit", "-q", "--allow-empty", "-m", "first")
+            sh(*git, "tag", "--annotate", "v1.0", "-m", "Release 1.0")
+            sh(*git, "checkout", "-q", "-b", "feature")
+            sh(*git, "commit", "-q", "--allow-empty", "-m", "f", "--author=B <bee@old>")
+            sh(*git, "checkout", "-q", "main")
+            sh(*git, "commit", "-q", "--allow-empty", "-m", "second")
+            sh(*git, "merge", "-q", "--no-ff", "feature", "-m", "merge")
+            sh(*git, "tag", "--annotate", "v1.1", "-m", "Release 1.1\n\nBody")
+            sh(*git, "tag", "v1.1-light")
+            sh(*git, "commit", "-q", "--allow-empty", "-m", "third")
+            sh(*git, "tag", "--annotate", "v2.0", "-m", "Release 2.0")
+
+            cli = CliBackend(tdp)
+            backend = cls(tdp)
+            refs = sorted(cli.list_tags())
+            self.assertEqual(refs, sorted(backend.list_tags()))
+
+            shas = [ref.sha for ref in refs]
+            expected = cli.read_tags(shas)
+            result = backend.read_tags(shas + ["0" * 40])
+            self.assertEqual(expected.keys(), result.keys())
+            for sha, data in expected.items():
+                if data.kind == "tag":
+                    self.assertEqual(data, result[sha])
+                else:
+                    self.assertEqual(data.kind, result[sha].kind)
+
+            def normalize(commits):
+                return {c.sha: (c.parents, c.author, sorted(c.tags)) for c in commits}
+
+            walk = list(backend.walk())
+            self.assertEqual(normalize(cli.walk()), normalize(walk))
+            seen = set()
+            for c in walk:
+                self.assertTrue(seen.issuperset(c.parents))
+                seen.add(c.sha)
+            self.assertIn("Bee", {c.author for c in walk})
+
+            for rev, exclude in (("v2.0", None), ("v1.1", "v1.0"), ("v2.0", "v1.1")):
+                self.assertEqual(
+                    cli.shortlog(rev, exclude), backend.shortlog(rev, exclude)
+                )
+
+            self.assertEqual(cls.name, select_backend(tdp, cls.name).name)
+
+            loaded = []
+            for git_backend in (cli, backend):
+                tags = Tag.all_tags(backend=git_backend)
+                Tag.load_messages(tags, git_backend)
+                Tag.load_shortlogs(tags, git_backend)
+                loaded.append([(t.message, t.tagger, t._shortlog) for t in tags])
+            self.assertEqual(loaded[0], loaded[1])
+            self.assertEqual("Release 1.1\n\nBody\n", loaded[1][1][0])
+
+            with self.subTest("fallback"):
+                fallback = cls(tdp)
+                with patch.object(
+                    cls, "repo", new_callable=PropertyMock
+                ) as repo_mock, self.assertLogs("attribution.backend", "DEBUG"):
+                    repo_mock.side_effect = BackendUnavailable("broken")
+                    self.assertEqual(expected, fallback.read_tags(shas))
+                    self.assertEqual(normalize(cli.walk()), normalize(fallback.walk()))
+                    self.assertEqual(
+                        cli.shortlog("v2.0", "v1.0"), fallback.shortlog("v2.0", "v1.0")
+                    )
+                self.assertIsNone(fallback._repo)
+
+    @skipUnless(importable("pygit2"), "pygit2 not available")
+    def test_pygit2_backend(self):
+        self.check_in_process(Pygit2Backend)
+
+    @skipUnless(importable("dulwich"), "dulwich not available")
+    def test_dulwich_backend(self):
+        self.check_in_process(DulwichBackend)
+
+    def test_select_backend(self):
+        with TemporaryDirectory() as td:
+            self.assertIsInstance(select_backend(Path(td), "cli"), CliBackend)
+            for name in ("pygit2", "dulwich"):
+                with self.subTest(name):
+                    with patch("attribution.backend.find_spec", return_value=None):
+                        with self.assertLogs("attribution.backend", "WARNING"):
+                            backend = select_backend(Path(td), name)
+                            self.assertEqual("cli", backend.name)
+
+                    if importable(name):
+                        # repos are opened lazily, so this doesn't look at td
+                        backend = select_backend(Path(td), name)
+                        self.assertEqual(name, backend.name)
+                        self.assertIsNone(backend._repo)  # type: ignore
+                        with self.assertRaises(BackendUnavailable):
+                            backend.repo  # type: ignore
+
+            with patch("attribution.backend.find_spec", return_value=None):
+                self.assertIsInstance(select_backend(Path(td)), CliBackend)
+            with self.assertRaises(ValueError):
+                select_backend(Path(td), "svn")
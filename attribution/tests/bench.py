@@ -0,0 +1,33 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT license
+
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from ..bench import build_repo, CASE_NAMES, RepoSpec, run_benchmarks
+from ..helpers import sh
+from ..tag import Tag
+
+
+class BenchTest(TestCase):
+    def test_build_repo(self):
+        spec = RepoSpec(tags=3, commits=2, authors=2, signed=True, packages=2)
+        with TemporaryDirectory() as td:
+            root = build_repo(Path(td) / "repo", spec)
+            tags = Tag.all_tags(root)
+            self.assertEqual(["v1.2.0", "v1.1.0", "v1.0.0"], [t.name for t in tags])
+            out = sh("git", "-C", str(root), "shortlog", "-s", "v1.2.0")
+            self.assertEqual(2, len(out.splitlines()))
+            self.assertTrue((root / "packages/group-1/pkg-1/Cargo.toml").is_file())
+            self.assertTrue((root / "packages/group-1/pkg-1/package.json").is_file())
+
+    def test_run_benchmarks(self):
+        spec = RepoSpec(tags=2, commits=2, packages=1, files=5)
+        cases = [name for name in CASE_NAMES if name != "tag_flow"]
+        results = run_benchmarks(spec, repeat=1, cases=cases)
+        self.assertEqual(cases, list(results["results"]["cases"]))
+        self.assertEqual(spec.tags, results["spec"]["tags"])
+        self.assertEqual(1, results["results"]["cases"]["tag_message"]["runs"])
+        json.dumps(results)
@@ -0,0 +1,116 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT license
+
+import os
+import subprocess
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from ..cache import TagCache
+from ..tag import Tag
+from ..types import Version
+
+
+class CacheTest(TestCase):
+    @patch("attribution.cache.sh")
+    def test_for_repo(self, sh_mock):
+        root = Path("/fake/repo")
+        sh_mock.return_value = ".git\n"
+        cache = TagCache.for_repo(root)
+        sh_mock.assert_called_with(
+            "git", "-C", str(root), "rev-parse", "--git-common-dir"
+        )
+        self.assertEqual(cache.path, root / ".git" / "attribution-cache")
+
+        sh_mock.side_effect = subprocess.CalledProcessError(128, ())
+        self.assertIsNone(TagCache.for_repo(root))
+
+    def test_key(self):
+        cache = TagCache(Path("/fake"))
+        tag = Tag("v1.1", Version("1.1"), sha="bbb")
+
+        key = cache.key(tag, ["dependabot", ""])
+        self.assertEqual(key, cache.key(tag, ["dependabot", ""]))
+        self.assertNotEqual(key, cache.key(tag, ["dependabot", "abc"]))
+        self.assertNotEqual(key, cache.key(tag, []))
+
+        rewritten = Tag("v1.1", Version("1.1"), sha="ccc")
+        self.assertNotEqual(key, cache.key(rewritten, ["dependabot", ""]))
+
+        unknown = Tag("v1.1", Version("1.1"))
+        self.assertEqual("", cache.key(unknown, []))
+
+    def test_load_store(self):
+        with TemporaryDirectory() as td:
+            cache = TagCache(Path(td) / "cache")
+            tag = Tag("v1.1", Version("1.1"), sha="bbb")
+            key = cache.key(tag, [])
+            contexts = {"v1.0": "aaa"}
+
+            self.assertFalse(cache.load(tag, key, contexts.get))
+            self.assertFalse(cache.load(tag, "", contexts.get))
+
+            tag._message = "Message\n"
+            tag._signature = "signature"
+            tag._shortlog = "     1\tSomeone"
+            cache.store(tag, key, contexts.get)
+            self.assertEqual(0, len(cache.entries()))  # shortlog base unknown
+
+            tag._shortlog_cmd = "git shortlog -s v1.0...v1.1"
+            tag._shortlog_failed = True
+            cache.store(tag, key, contexts.get)
+            self.assertEqual(0, len(cache.entries()))  # fallback after an error
+
+            tag._shortlog_failed = False
+            cache.store(tag, key, contexts.get)
+            cache.store(tag, "", contexts.get)
+            self.assertEqual(1, len(cache.entries()))
+
+            fresh = Tag("v1.1", Version("1.1"), sha="bbb")
+            self.assertTrue(cache.load(fresh, key, contexts.get))
+            self.assertEqual(fresh._message, "Message\n")
+            self.assertEqual(fresh._signature, "signature")
+            self.assertEqual(fresh._shortlog_cmd, "git shortlog -s v1.0...v1.1")
+            self.assertEqual(fresh._shortlog, "     1\tSomeone")
+
+            # base rewritten, or a new tag that might be the base now
+            fresh = Tag("v1.1", Version("1.1"), sha="bbb")
+            self.assertFalse(cache.load(fresh, key, {"v1.0": "ccc"}.get))
+            self.assertFalse(cache.load(fresh, key, {}.get))
+            self.assertIsNone(fresh._message)
+
+            # shortlogs without a known base aren't cached
+            tag._shortlog_cmd = "git shortlog -s stable...v1.1"
+            cache.entry(key).unlink()
+            cache.store(tag, key, contexts.get)
+            self.assertEqual(0, len(cache.entries()))
+
+            tag._shortlog_cmd = "git shortlog -s v1.1"
+            cache.store(tag, key, {"": "all"}.get)
+            self.assertTrue(cache.load(fresh, key, {"": "all"}.get))
+            self.assertEqual("", fresh.shortlog_base)
+
+            cache.entry(key).write_text("not json")
+            self.assertFalse(cache.load(fresh, key, {"": "all"}.get))
+
+    def test_prune(self):
+        with TemporaryDirectory() as td:
+            cache = TagCache(Path(td), max_size=0)
+            keys = []
+            for index in range(4):
+                tag = Tag(f"v{index}", Version(str(index)), sha=str(index))
+                tag._message = "x" * 100
+                tag._shortlog_cmd = f"git shortlog -s v{index}"
+                key = cache.key(tag, [])
+                cache.store(tag, key, lambda base: "")
+                os.utime(cache.entry(key), (index, index))
+                keys.append(key)
+
+            size = sum(size for _, size, _ in cache.entries())
+            cache.max_size = size // 2
+            cache.prune()
+
+            remaining = [path for _, _, path in cache.entries()]
+            self.assertEqual([cache.entry(key) for key in keys[2:]], remaining)
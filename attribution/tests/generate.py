@@ -1,14 +1,25 @@
 # Copyright Amethyst Reese
 # Licensed under the MIT license
 
+import asyncio
+import io
+import json
+import os
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from unittest import TestCase
+from unittest.mock import Mock, patch, PropertyMock
+
+from jinja2 import Environment, TemplateNotFound
 
 from .. import generate
+from ..backend import TagRef
+from ..cache import TagCache
+from ..helpers import sh
 from ..project import Project
 from ..tag import Tag
 from ..types import Version
+from .refs import init_repo
 
 FAKE_CARGO_TOML = """
 [package]
@@ -72,6 +83,375 @@ FAKE_NPM_LOCKFILE = """\
 
 
 class GenerateTest(TestCase):
+    def fake_tag(self, name, message, shortlog=""):
+        tag = Tag(name, Version(name))
+        tag._message = message
+        tag._shortlog_cmd = f"git shortlog -s {name}"
+        tag._shortlog = shortlog
+        return tag
+
+    def test_agenerate(self):
+        with TemporaryDirectory() as td:
+            tdp = Path(td).resolve()
+            git = init_repo(td)
+            for version in ("0.1", "0.2", "1.0"):
+                sh(*git, "commit", "-q", "--allow-empty", "-m", f"commit {version}")
+                sh(*git, "tag", "--annotate", f"v{version}", "-m", f"Release {version}")
+            sh(*git, "tag", "v1.0.1")
+            sh(*git, "tag", "--annotate", "not-a-version", "-m", "nope")
+
+            cwd = os.getcwd()
+            try:
+                os.chdir(td)
+                expected = generate.Changelog(
+                    Project("fluffy", "fluffy", root=tdp, cache=False)
+                ).generate()
+            finally:
+                os.chdir(cwd)
+
+            async def run():
+                # run a few projects sharing the same event loop
+                projects = [
+                    Project("fluffy", "fluffy", root=tdp, cache=False) for _ in range(3)
+                ]
+                return await asyncio.gather(
+                    *(generate.Changelog(project).agenerate() for project in projects)
+                )
+
+            with patch.object(Project, "prefetch", side_effect=AssertionError):
+                results = asyncio.run(run())
+            for result in results:
+                self.assertEqual(expected, result)
+            self.assertIn("Release 1.0", expected)
+            self.assertIn("$ git shortlog -s v0.1...v0.2", expected)
+
+            with self.subTest("async fallbacks"):
+
+                async def fallback():
+                    tags = await Tag.aall_tags(tdp)
+                    self.assertEqual(
+                        ["v1.0.1", "v1.0", "v0.2", "v0.1"], [t.name for t in tags]
+                    )
+                    fresh = [Tag(t.name, t.version) for t in tags]
+                    messages = [await t.amessage(tdp) for t in fresh]
+                    shortlogs = [await t.ashortlog(tdp) for t in fresh]
+                    missing = Tag("v9.9", Version("9.9"))
+                    return (
+                        messages,
+                        [t._shortlog_cmd for t in fresh],
+                        shortlogs,
+                        await missing.amessage(tdp),
+                    )
+
+                with self.assertLogs("attribution.tag", "WARNING") as logs:
+                    messages, cmds, shortlogs, missing = asyncio.run(fallback())
+                self.assertEqual(
+                    ["", "Release 1.0\n", "Release 0.2\n", "Release 0.1\n"], messages
+                )
+                self.assertEqual(
+                    [
+                        "git shortlog -s v0.2...v1.0.1",
+                        "git shortlog -s v0.2...v1.0",
+                        "git shortlog -s v0.1...v0.2",
+                        None,  # root commit
+                    ],
+                    cmds,
+                )
+                self.assertEqual(["     1\tA"] * 3 + [""], shortlogs)
+                self.assertEqual("", missing)
+                self.assertEqual(
+                    [
+                        "WARNING:attribution.tag:Skipping tag not-a-version",
+                        "ERROR:attribution.tag:failed to generate shortlog for v0.1",
+                        "WARNING:attribution.tag:unmatched tag contents for v9.9",
+                    ],
+                    [line.splitlines()[0] for line in logs.output],
+                )
+
+    def test_changelog_update(self):
+        with TemporaryDirectory() as td:
+            tdp = Path(td)
+            changelog_path = tdp / "CHANGELOG.md"
+            old_tags = [
+                self.fake_tag("v1.1", "Second release\n", "     2\tSomeone"),
+                self.fake_tag("v1.0", "First release\n\nv0.9\n----\n\nnope\n"),
+            ]
+            old_tags[0].sha = "bbb"
+            old_tags[0]._shortlog_cmd = "git shortlog -s v1.0...v1.1"
+            old_tags[1].sha = "aaa"
+            project = Project("fluffy", "fluffy", root=tdp)
+            project._tag_cache = TagCache(tdp / "cache")
+            project._tags = list(old_tags)
+            project._backend = Mock()
+            project._backend.list_tags.side_effect = lambda: [
+                TagRef(tag.name, tag.sha, None) for tag in project._tags if tag.sha
+            ]
+
+            with self.subTest("missing changelog"):
+                changelog = generate.Changelog(project)
+                self.assertEqual(changelog_path, changelog.update())
+                self.assertEqual(changelog.generate(), changelog_path.read_text())
+
+            with self.subTest("new tag"):
+                project._tags = [
+                    self.fake_tag("v1.2", "Third release\n", "     1\tOther"),
+                    *old_tags,
+                ]
+                project._tags[0].sha = "ccc"
+                project._tags[0]._shortlog_cmd = "git shortlog -s v1.1...v1.2"
+                project._tag_refs = None
+                expected = changelog.generate()
+                changelog.update(verify=True)
+                self.assertEqual(expected, changelog_path.read_text())
+
+            with self.subTest("unchanged sections are reused"):
+                old_tags[0]._message = "Rewritten"
+                with patch.object(Project, "prefetch") as prefetch_mock:
+                    changelog.update()
+                prefetch_mock.assert_called_once_with([])
+                result = changelog_path.read_text()
+                self.assertIn("Second release", result)
+                self.assertNotIn("Rewritten", result)
+
+            with self.subTest("verify falls back to full render"):
+                with patch.object(TagCache, "load", return_value=False):
+                    with self.assertLogs("attribution.generate", "WARNING"):
+                        changelog.update(verify=True)
+                self.assertEqual(changelog.generate(), changelog_path.read_text())
+
+            with self.subTest("modified tags"):
+                changelog.update()  # fingerprint sections again after verify
+                old_tags[0].sha = "ddd"
+                old_tags[0]._message = "Rewritten again"
+                project._tag_refs = None
+                with patch.object(Project, "prefetch") as prefetch_mock:
+                    changelog.update()
+                # any changed tag could be the base for any other
+                prefetch_mock.assert_called_once_with(project._tags)
+                self.assertEqual(changelog.generate(), changelog_path.read_text())
+
+            with self.subTest("edited sections"):
+                changelog_path.write_text(
+                    changelog_path.read_text().replace("Third", "Edited")
+                )
+                changelog.update()
+                self.assertEqual(changelog.generate(), changelog_path.read_text())
+
+            with self.subTest("modified tags without cache"):
+                project.cache = False
+                old_tags[1]._message = "Rewritten without cache\n"
+                changelog.update()
+                self.assertEqual(changelog.generate(), changelog_path.read_text())
+
+            with self.subTest("deleted tag"):
+                project._tags = project._tags[:1] + project._tags[2:]
+                project._tag_refs = None
+                changelog.update()
+                self.assertEqual(changelog.generate(), changelog_path.read_text())
+
+            with self.subTest("unknown content"):
+                changelog_path.write_text("# some other changelog\n")
+                changelog.update()
+                self.assertEqual(changelog.generate(), changelog_path.read_text())
+
+    def test_changelog_update_non_version_tag(self):
+        with TemporaryDirectory() as td:
+            tdp = Path(td).resolve()
+            git = init_repo(td)
+            sh(*git, "commit", "-q", "--allow-empty", "-m", "first")
+            sh(*git, "tag", "--annotate", "v1.0", "-m", "Release 1.0")
+            sh(*git, "commit", "-q", "--allow-empty", "-m", "second")
+            sh(*git, "commit", "-q", "--allow-empty", "-m", "third")
+            sh(*git, "tag", "--annotate", "v2.0", "-m", "Release 2.0")
+
+            def changelog(cache=True):
+                return generate.Changelog(
+                    Project("fluffy", "fluffy", root=tdp, cache=cache)
+                )
+
+            cwd = os.getcwd()
+            try:
+                os.chdir(td)
+                changelog().update()
+                self.assertIn("v1.0...v2.0", (tdp / "CHANGELOG.md").read_text())
+
+                # git describe now picks the non-version tag as the base for v2.0
+                sh(*git, "tag", "--annotate", "beta", "-m", "Beta", "HEAD~1")
+                changelog().update()
+                expected = changelog(cache=False).generate()
+                self.assertIn("beta...v2.0", expected)
+                self.assertEqual(expected, (tdp / "CHANGELOG.md").read_text())
+                self.assertEqual(expected, changelog().generate())
+            finally:
+                os.chdir(cwd)
+
+    def test_changelog_range(self):
+        with TemporaryDirectory() as td:
+            tdp = Path(td).resolve()
+            git = init_repo(td)
+            for version in ("0.1", "0.2", "1.0", "1.1", "2.0"):
+                sh(*git, "commit", "-q", "--allow-empty", "-m", f"commit {version}")
+                sh(*git, "tag", "--annotate", f"v{version}", "-m", f"Release {version}")
+
+            def changelog():
+                return generate.Changelog(
+                    Project("fluffy", "fluffy", root=tdp, cache=False)
+                )
+
+            cwd = os.getcwd()
+            try:
+                os.chdir(td)
+                full = changelog().generate()
+
+                # only tags in range are loaded, and match the full render
+                fetched = []
+                prefetch = Project.prefetch
+
+                def prefetch_spy(project, tags=None):
+                    fetched.extend(t.name for t in tags or project.tags)
+                    return prefetch(project, tags)
+
+                with patch.object(Project, "prefetch", prefetch_spy):
+                    generated = changelog()
+                    tags = generated.project.tag_range(Version("0.2"), Version("1.1"))
+                    backend = generated.project.backend
+                    with patch.object(
+                        backend, "walk", wraps=backend.walk
+                    ) as walk_mock, patch.object(
+                        backend, "read_tags", wraps=backend.read_tags
+                    ) as read_mock, patch.object(
+                        backend, "describe", side_effect=AssertionError
+                    ):
+                        result = generated.generate(tags)
+                self.assertEqual(["v1.1", "v1.0", "v0.2"], fetched)
+                self.assertEqual(["v1.1", "v1.0", "v0.2"], [t.name for t in tags])
+                self.assertIsNone(generated.project.get_tag(Version("2.0"))._message)
+                # history is only walked down to v0.1, and only tags in range are read
+                walk_mock.assert_called_once_with(["v1.1", "v1.0", "v0.2"], "v0.1")
+                read_mock.assert_called_once_with({t.sha: t for t in tags})
+
+                header, _, rest = result.partition("\nv1.1\n")
+                body, _, footer = rest.rpartition("\n[attribution-badge]")
+                self.assertTrue(full.startswith(header))
+                self.assertTrue(full.endswith(footer))
+                self.assertIn("\nv1.1\n" + body, full)
+                self.assertIn("$ git shortlog -s v0.1...v0.2", body)
+                self.assertNotIn("Release 2.0", result)
+                self.assertNotIn("Release 0.1", result)
+
+                generated = changelog()
+                self.assertEqual(
+                    full, "".join(generated.chunks(generated.project.tag_range()))
+                )
+            finally:
+                os.chdir(cwd)
+
+    def test_changelog_stream(self):
+        with TemporaryDirectory() as td:
+            tdp = Path(td)
+            project = Project("fluffy", "fluffy", root=tdp, cache=False)
+            project._tags = [
+                self.fake_tag("v1.1", "Second release\n", "     2\tSomeone"),
+                self.fake_tag("v1.0", "First release\n"),
+            ]
+            changelog = generate.Changelog(project)
+            expected = changelog.generate()
+
+            with patch.object(Project, "prefetch") as prefetch_mock:
+                chunks = changelog.chunks()
+                header = next(chunks)
+                self.assertTrue(expected.startswith(header))
+                self.assertNotIn("v1.1", header)
+                prefetch_mock.assert_not_called()
+                self.assertEqual(expected, header + "".join(chunks))
+                prefetch_mock.assert_called_once_with()
+
+            with self.subTest("macros don't render tags"):
+                with patch.object(
+                    Tag, "message", new_callable=PropertyMock
+                ) as message_mock:
+                    changelog.macros()
+                    message_mock.assert_not_called()
+
+            with self.subTest("stream"):
+                fp = io.StringIO()
+                changelog.stream(fp)
+                self.assertEqual(expected, fp.getvalue())
+
+            with self.subTest("write"):
+                self.assertEqual(tdp / "CHANGELOG.md", changelog.write())
+                self.assertEqual(expected, (tdp / "CHANGELOG.md").read_text())
+                self.assertEqual(["CHANGELOG.md"], os.listdir(td))
+
+            with self.subTest("failed write leaves file alone"):
+                with patch.object(
+                    generate.Changelog, "chunks", side_effect=RuntimeError
+                ):
+                    with self.assertRaises(RuntimeError):
+                        changelog.write()
+                self.assertEqual(expected, (tdp / "CHANGELOG.md").read_text())
+                self.assertEqual(["CHANGELOG.md"], os.listdir(td))
+
+    def test_templates(self):
+        with TemporaryDirectory() as td:
+            tdp = Path(td)
+            project = Project("fluffy", "fluffy", root=tdp, cache=False)
+            project._tags = [self.fake_tag("v1.0", "First release\n")]
+
+            with self.subTest("builtin templates are compiled once"):
+                changelog = generate.Changelog(project)
+                self.assertEqual(
+                    "attribution.generate.Changelog", changelog.template_name()
+                )
+                self.assertIs(changelog.template(), changelog.template())
+                self.assertIs(
+                    changelog.template(), generate.Changelog(project).template()
+                )
+                self.assertIsNot(
+                    changelog.template(), generate.Contributors(project).template()
+                )
+
+            with self.subTest("bytecode cache"):
+                cache = generate.TemplateBytecodeCache()
+                cache.use_directory(tdp / "bytecode")
+                env = Environment(
+                    loader=generate.TemplateLoader(), bytecode_cache=cache
+                )
+                name = changelog.template_name()
+                expected = env.get_template(name).render(**changelog.context())
+                self.assertEqual(1, len(cache.mapping))
+                self.assertEqual(1, len(list((tdp / "bytecode").iterdir())))
+
+                cache.mapping.clear()
+                env.cache.clear()
+                result = env.get_template(name).render(**changelog.context())
+                self.assertEqual(expected, result)
+                self.assertEqual(1, len(cache.mapping))
+
+                cache.clear()
+                cache.use_directory(None)
+                self.assertEqual({}, cache.mapping)
+                self.assertEqual([], list((tdp / "bytecode").iterdir()))
+
+            with self.subTest("template overrides"):
+                (tdp / "changelog.j2").write_text(
+                    "{% for tag in tags %}* {{ tag.name }}\n{% endfor %}"
+                )
+                project.config["templates"] = {"changelog": "changelog.j2"}
+                self.assertEqual(
+                    f"file:{tdp / 'changelog.j2'}", changelog.template_name()
+                )
+                self.assertEqual("* v1.0\n", changelog.generate())
+
+                (tdp / "CHANGELOG.md").write_text("old content")
+                changelog.update()
+                self.assertEqual("* v1.0\n", (tdp / "CHANGELOG.md").read_text())
+
+            with self.subTest("missing template override"):
+                project.config["templates"] = {"changelog": "missing.j2"}
+                with self.assertRaises(TemplateNotFound):
+                    changelog.generate()
+
     def test_cargo_file(self):
         with TemporaryDirectory() as td:
             tdp = Path(td)
@@ -81,6 +461,9 @@ class GenerateTest(TestCase):
             (tdp / "subdir" / "whatever" / "Cargo.toml").write_text(
                 FAKE_CARGO_TOML.replace('name = "fluffy"', 'name = "whatever"')
             )
+            (tdp / "subdir" / "Cargo.toml").write_text(
+                '[workspace]\nmembers = ["whatever"]  # not fluffy\n'
+            )
 
             project = Project(
                 "fluffy",
@@ -154,6 +537,104 @@ class GenerateTest(TestCase):
                 result = cargo_lock.read_text()
                 self.assertEqual(expected, result)
 
+    def test_cargo_workspace_lock(self):
+        with TemporaryDirectory() as td:
+            tdp = Path(td)
+            (tdp / "Cargo.toml").write_text('[workspace]\nmembers = ["crates/*"]\n')
+            (cargo_lock := tdp / "Cargo.lock").write_text(
+                FAKE_CARGO_LOCK
+                + '\n[[package]]\nname = "whatever"\nversion = "1.0"\n'
+                + '\n[[package]]\nname = "whatever"\nversion = "0.1"\n'
+                + 'source = "registry+https://github.com/rust-lang/crates.io-index"\n'
+            )
+            for name in ("fluffy", "whatever"):
+                (tdp / "crates" / name).mkdir(parents=True)
+                (tdp / "crates" / name / "Cargo.toml").write_text(
+                    FAKE_CARGO_TOML.replace('name = "fluffy"', f'name = "{name}"')
+                )
+
+            project = Project(
+                "fluffy",
+                "fluffy",
+                root=tdp,
+                _tags=[Tag("v2.1.3", Version("2.1.3"))],
+            )
+            cargo_files = generate.CargoFile.search(project, ["fluffy", "whatever"])
+            self.assertEqual(
+                [cargo_lock, cargo_lock],
+                [cargo_file.lock_file() for cargo_file in cargo_files],
+            )
+
+            with patch.object(
+                generate, "patch_cargo_lock", wraps=generate.patch_cargo_lock
+            ) as patch_mock:
+                paths = generate.CargoFile.write_all(cargo_files)
+            patch_mock.assert_called_once()
+            self.assertEqual(
+                [cargo_file.filename for cargo_file in cargo_files] + [cargo_lock],
+                paths,
+            )
+
+            content = cargo_lock.read_text()
+            self.assertIn('name = "fluffy"\nversion = "2.1.3"\n', content)
+            self.assertIn('name = "whatever"\nversion = "2.1.3"\n', content)
+            self.assertIn('name = "whatever"\nversion = "0.1"\n', content)
+            self.assertIn('name = "dog"\nversion = "3.1"\n', content)
+
+    def test_npm_workspace_lock(self):
+        with TemporaryDirectory() as td:
+            tdp = Path(td)
+            (tdp / "package.json").write_text(
+                '{"name": "root", "private": true, "workspaces": ["packages/*"]}\n'
+            )
+            packages = {"": {"name": "root", "workspaces": ["packages/*"]}}
+            for name in ("fluffy", "whatever", "other"):
+                (tdp / "packages" / name).mkdir(parents=True)
+                (tdp / "packages" / name / "package.json").write_text(
+                    FAKE_NPM_PACKAGE.replace('"name": "fluffy"', f'"name": "{name}"')
+                )
+                packages[f"packages/{name}"] = {"version": "1.0"}
+                packages[f"node_modules/{name}"] = {
+                    "resolved": f"packages/{name}",
+                    "link": True,
+                }
+            lock = {"name": "root", "lockfileVersion": 3, "packages": packages}
+            (npm_lock := tdp / "package-lock.json").write_text(
+                json.dumps(lock, indent=2) + "\n"
+            )
+
+            project = Project(
+                "fluffy",
+                "fluffy",
+                root=tdp,
+                _tags=[Tag("v2.1.3", Version("2.1.3"))],
+            )
+            npm_files = generate.NpmFile.search(project, ["fluffy", "whatever"])
+            self.assertEqual(
+                [npm_lock, npm_lock], [npm_file.lock_file() for npm_file in npm_files]
+            )
+
+            with patch.object(
+                generate, "patch_package_lock", wraps=generate.patch_package_lock
+            ) as patch_mock:
+                paths = generate.PackageFile.write_all(npm_files)
+            patch_mock.assert_called_once()
+            self.assertEqual(
+                [npm_file.filename for npm_file in npm_files] + [npm_lock], paths
+            )
+
+            # nothing is rewritten once versions are up to date
+            self.assertEqual([], generate.PackageFile.write_all(npm_files))
+            self.assertFalse(any(npm_file.changed for npm_file in npm_files))
+            with self.assertRaises(TypeError):
+                generate.PackageFile(  # type: ignore[abstract]
+                    project, package_name="fluffy", package_dir="."
+                )
+
+            packages["packages/fluffy"]["version"] = "2.1.3"
+            packages["packages/whatever"]["version"] = "2.1.3"
+            self.assertEqual(json.dumps(lock, indent=2) + "\n", npm_lock.read_text())
+
     def test_npm_file(self):
         with TemporaryDirectory() as td:
             tdp = Path(td)
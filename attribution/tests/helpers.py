@@ -1,13 +1,81 @@
 # Copyright 2022 Amethyst Reese
 # Licensed under the MIT license
 
+import asyncio
+import os
 import subprocess
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Optional
 from unittest import TestCase
+from unittest.mock import patch
 
 from .. import helpers
+from .refs import init_repo
 
 
 class HelpersTest(TestCase):
+    def test_slotted(self):
+        @helpers.slotted
+        @dataclass
+        class Point:
+            x: int
+            y: int = 0
+            label: Optional[str] = None
+
+            def total(self) -> int:
+                return self.x + self.y
+
+        point = Point(1)
+        self.assertEqual(("x", "y", "label"), Point.__slots__)
+        self.assertEqual(Point(1, 0, None), point)
+        self.assertEqual(1, point.total())
+        self.assertEqual("Point", Point.__name__)
+        self.assertFalse(hasattr(point, "__dict__"))
+        with self.assertRaises(AttributeError):
+            point.z = 3  # type: ignore[attr-defined]
+
+    def test_intern(self):
+        self.assertIsNone(helpers.intern(None))
+        first = helpers.intern("".join(["Some", "one"]))
+        self.assertIs(first, helpers.intern("".join(["Some", "o", "ne"])))
+
+    def test_write_file(self):
+        with TemporaryDirectory() as td:
+            path = Path(td) / "file.txt"
+            self.assertTrue(helpers.write_file(path, "hello\n"))
+            self.assertEqual("hello\n", path.read_text())
+
+            path.chmod(0o755)
+            os.utime(path, (1000000000, 1000000000))
+            self.assertFalse(helpers.write_file(path, b"hello\n"))
+            self.assertEqual(1000000000, path.stat().st_mtime)
+
+            self.assertTrue(helpers.write_file(path, "jello\n"))
+            self.assertEqual("jello\n", path.read_text())
+            self.assertEqual(0o755, path.stat().st_mode & 0o777)
+            self.assertEqual(["file.txt"], os.listdir(td))
+
+    def test_replace_file(self):
+        with TemporaryDirectory() as td:
+            path = Path(td) / "file.txt"
+            tmp = Path(td) / ".file.txt.tmp"
+            tmp.write_text("hello\n")
+            self.assertTrue(helpers.replace_file(tmp, path))
+            self.assertEqual("hello\n", path.read_text())
+
+            os.utime(path, (1000000000, 1000000000))
+            tmp.write_text("hello\n")
+            self.assertFalse(helpers.replace_file(tmp, path))
+            self.assertEqual(1000000000, path.stat().st_mtime)
+
+            tmp.write_text("jello\n")
+            self.assertTrue(helpers.replace_file(tmp, path))
+            self.assertEqual("jello\n", path.read_text())
+            self.assertEqual(["file.txt"], os.listdir(td))
+
     def test_sh(self):
         output = helpers.sh("echo", "foo bar")
         self.assertEqual(output, "foo bar\n")
@@ -21,3 +89,72 @@ class HelpersTest(TestCase):
             subprocess.CalledProcessError, "non-zero exit status 1"
         ):
             helpers.sh("false")
+
+    def test_sh_stdout(self):
+        output = helpers.sh_stdout("sh", "-c", "echo foo; echo bar >&2")
+        self.assertEqual(output, "foo\n")
+        with self.assertRaises(subprocess.CalledProcessError):
+            helpers.sh_stdout("false")
+
+    def test_ash(self):
+        async def run():
+            self.assertEqual("foo bar\n", await helpers.ash("echo", "foo bar"))
+            self.assertEqual("foo bar\n", await helpers.ash("echo foo bar"))
+
+            with TemporaryDirectory() as td:
+                output = await helpers.ash("pwd", cwd=Path(td))
+                self.assertEqual(Path(td).resolve(), Path(output.strip()).resolve())
+
+            with self.assertRaisesRegex(
+                subprocess.CalledProcessError, "non-zero exit status 1"
+            ):
+                await helpers.ash("false")
+
+            with self.assertRaises(subprocess.TimeoutExpired):
+                await helpers.ash(
+                    sys.executable, "-c", "import time; time.sleep(5)", timeout=0.1
+                )
+
+            # concurrency is limited per event loop
+            with patch("attribution.helpers.ASH_LIMIT", 2):
+                results = await asyncio.gather(
+                    *(helpers.ash("echo", str(i)) for i in range(5))
+                )
+            self.assertEqual([f"{i}\n" for i in range(5)], results)
+
+        asyncio.run(run())
+
+    def test_git_batch(self):
+        with TemporaryDirectory() as td:
+            tdp = Path(td).resolve()
+            git = init_repo(td)
+            helpers.sh(*git, "commit", "-q", "--allow-empty", "-m", "first")
+            helpers.sh(*git, "tag", "--annotate", "v1.0", "-m", "Tag message")
+            helpers.sh(*git, "tag", "v1.1")
+
+            batch = helpers.git_batch(tdp)
+            self.assertIs(batch, helpers.git_batch(tdp))
+            try:
+                with self.subTest("read annotated"):
+                    obj = batch.read("refs/tags/v1.0")
+                    self.assertIsNotNone(obj)
+                    self.assertEqual(obj.type, "tag")
+                    self.assertEqual(obj.size, len(obj.data))
+                    self.assertIn(b"tag v1.0\n", obj.data)
+                    self.assertTrue(obj.data.endswith(b"\n\nTag message\n"))
+
+                with self.subTest("read lightweight"):
+                    obj = batch.read("refs/tags/v1.1")
+                    self.assertEqual(obj.type, "commit")
+                    self.assertTrue(obj.data.endswith(b"\n\nfirst\n"))
+
+                with self.subTest("missing"):
+                    self.assertIsNone(batch.read("refs/tags/v9.9"))
+                    self.assertIsNone(batch.read("refs/tags/v9 9"))
+
+                with self.subTest("invalid"):
+                    with self.assertRaises(ValueError):
+                        batch.read("v1.0\nv1.1")
+
+            finally:
+                batch.close()
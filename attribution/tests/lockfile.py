@@ -0,0 +1,222 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT license
+
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import tomlkit
+
+from ..generate import CargoLock, LockFile, NpmLock
+from ..lockfile import (
+    json_members,
+    patch_cargo_lock,
+    patch_package_lock,
+    replace_spans,
+    UnsupportedLockfile,
+)
+
+CARGO_LOCK = b"""\
+# This file is automatically @generated by Cargo.
+# It is not intended for manual editing.
+version = 3
+
+[[package]]
+name = "dog"
+version = "3.1"
+source = "registry+https://github.com/rust-lang/crates.io-index"
+checksum = "abc123"
+
+[[package]]
+name = "fluffy"
+version = "1.0"
+dependencies = [
+ "dog",
+ "whatever 1.0",
+]
+
+[[package]]
+name = "whatever"
+version = "1.0"
+
+[[package]]
+name = "whatever"
+version = "0.5"
+source = "registry+https://github.com/rust-lang/crates.io-index"
+"""
+
+NPM_LOCK = b"""\
+{
+  "name": "fluffy",
+  "version": "1.0",
+  "lockfileVersion": 2,
+  "requires": true,
+  "packages": {
+    "": {
+      "name": "fluffy",
+      "version": "1.0",
+      "dependencies": {"version": "^1.0", "dog": "^3.1"}
+    },
+    "node_modules/dog": {"version": "3.1", "dev": true},
+    "whatever": {"version": "1.0"},
+    "node_modules/version": {"version": "1.0", "name": ["not", "a", "name"]}
+  },
+  "dependencies": {
+    "dog": {"version": "3.1", "dev": true}
+  }
+}
+"""
+
+
+class LockfileTest(TestCase):
+    def test_replace_spans(self):
+        self.assertEqual("a-c-e", replace_spans("abcde", [(3, 4), (1, 2)], "-"))
+        self.assertEqual(b"abcde", replace_spans(b"abcde", [], b"-"))
+
+    def test_patch_cargo_lock(self):
+        result = patch_cargo_lock(CARGO_LOCK, ["fluffy", "whatever"], "2.0")
+        self.assertEqual(
+            CARGO_LOCK.replace(b'version = "1.0"', b'version = "2.0"'), result
+        )
+
+        # matches a full parse of the same lockfile
+        data = tomlkit.loads(CARGO_LOCK.decode())
+        for package in data["package"]:
+            if package["name"] in ("fluffy", "whatever") and "source" not in package:
+                package["version"] = "2.0"
+        self.assertEqual(data, tomlkit.loads(result.decode()))
+
+        for content in (
+            CARGO_LOCK.replace(b"version = 3", b"version = 1"),
+            CARGO_LOCK.replace(b"version = 3\n", b""),
+            CARGO_LOCK.replace(b'name = "fluffy"\nversion', b'version = "1"\nname'),
+            CARGO_LOCK.replace(b"\n", b"\r\n"),
+        ):
+            with self.subTest(content):
+                with self.assertRaises(UnsupportedLockfile):
+                    patch_cargo_lock(content, ["fluffy"], "2.0")
+
+    def test_json_members(self):
+        text = '{"a": 1, "b": {"c": [1, {"d": 2}], "e": {}} , "f": "}"}'
+        members = [(path, value) for path, value, _, _ in json_members(text)]
+        self.assertEqual([(("a",), 1), (("b",), None), (("f",), "}")], members)
+
+        members = [
+            (path, value, text[start:end])
+            for path, value, start, end in json_members(text, expand=lambda path: True)
+        ]
+        self.assertEqual(
+            [
+                (("a",), 1, "1"),
+                (("b", "c"), None, '[1, {"d": 2}]'),
+                (("b", "e"), None, "{}"),
+                (("b",), None, '{"c": [1, {"d": 2}], "e": {}}'),
+                (("f",), "}", '"}"'),
+            ],
+            members,
+        )
+
+        text = r'{"a": ["]", "\\\"}", {"b": "{["}], "c": {"d": "\\"}, "e": 1}'
+        members = [
+            (path, text[start:end]) for path, _, start, end in json_members(text)
+        ]
+        self.assertEqual(
+            [
+                (("a",), r'["]", "\\\"}", {"b": "{["}]'),
+                (("c",), r'{"d": "\\"}'),
+                (("e",), "1"),
+            ],
+            members,
+        )
+        members = [
+            (path, value)
+            for path, value, _, _ in json_members(text, decode=lambda path: True)
+        ]
+        self.assertEqual(
+            [(("a",), ["]", '\\"}', {"b": "{["}]), (("c",), {"d": "\\"}), (("e",), 1)],
+            members,
+        )
+
+        for text in (
+            "[]",
+            '{"a" 1}',
+            '{"a": 1 "b": 2}',
+            '{"a": nope}',
+            "{1: 2}",
+            '{"a": ["b]}',
+            '{"a": [[]}',
+        ):
+            with self.subTest(text):
+                with self.assertRaises(UnsupportedLockfile):
+                    list(json_members(text))
+
+    def test_patch_package_lock(self):
+        result = patch_package_lock(NPM_LOCK, ["fluffy", "whatever"], "2.0")
+        expected = json.loads(NPM_LOCK)
+        expected["version"] = "2.0"
+        expected["packages"][""]["version"] = "2.0"
+        expected["packages"]["whatever"]["version"] = "2.0"
+        self.assertEqual(expected, json.loads(result))
+        self.assertEqual(NPM_LOCK.count(b"\n"), result.count(b"\n"))
+        self.assertIn(b'\n  "version": "2.0",\n', result)
+
+        # offsets are in characters, not bytes, when the lockfile isn't all ASCII
+        def accented(content):
+            return content.replace(
+                b'"fluffy",', '"fluffy", "x": "\u00e9t\u00e9",'.encode()
+            )
+
+        self.assertEqual(
+            accented(result),
+            patch_package_lock(accented(NPM_LOCK), ["fluffy", "whatever"], "2.0"),
+        )
+
+        # workspace packages are keyed by directory, and linked from node_modules
+        content = NPM_LOCK.replace(b'"lockfileVersion": 2', b'"lockfileVersion": 3')
+        content = content.replace(
+            b'"whatever": {"version": "1.0"}',
+            b'"packages/whatever": {"version": "1.0"},\n'
+            b'    "node_modules/whatever": {"resolved": "packages/whatever", "link": true}',
+        )
+        result = patch_package_lock(content, ["whatever"], "2.0", ["packages/whatever"])
+        packages = json.loads(result)["packages"]
+        self.assertEqual("2.0", packages["packages/whatever"]["version"])
+        self.assertEqual("1.0", packages[""]["version"])
+        self.assertEqual(content.replace(b'"1.0"},', b'"2.0"},'), result)
+
+        for content in (
+            NPM_LOCK.replace(b'"lockfileVersion": 2', b'"lockfileVersion": 1'),
+            NPM_LOCK.replace(b'"requires": true', b'"requires": nope'),
+            b"[]",
+        ):
+            with self.subTest(content):
+                with self.assertRaises(UnsupportedLockfile):
+                    patch_package_lock(content, ["fluffy"], "2.0")
+
+    def test_fallback(self):
+        with TemporaryDirectory() as td:
+            tdp = Path(td)
+            cargo_lock = tdp / "Cargo.lock"
+            cargo_lock.write_bytes(CARGO_LOCK.replace(b"\n", b"\r\n"))
+            lock = CargoLock(cargo_lock, "2.0")
+            lock.package_names.add("fluffy")
+            with self.assertLogs("attribution.generate", "DEBUG"):
+                lock.write()
+            data = tomlkit.loads(cargo_lock.read_text())
+            self.assertEqual("2.0", data["package"][1]["version"])
+            self.assertEqual("3.1", data["package"][0]["version"])
+
+            npm_lock = tdp / "package-lock.json"
+            content = NPM_LOCK.replace(b', "name": ["not", "a", "name"]', b"")
+            npm_lock.write_bytes(b"\xef\xbb\xbf" + content)
+            lock = NpmLock(npm_lock, "2.0")
+            lock.package_names.add("fluffy")
+            with self.assertLogs("attribution.generate", "DEBUG"):
+                lock.write()
+            data = json.loads(npm_lock.read_text())
+            self.assertEqual("2.0", data["packages"][""]["version"])
+            self.assertTrue(npm_lock.read_text().startswith('{\n    "name"'))
+
+            with self.assertRaises(TypeError):
+                LockFile(npm_lock, "2.0")  # type: ignore[abstract]
@@ -0,0 +1,70 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT license
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Optional, Set
+from unittest import TestCase
+
+from ..helpers import sh
+from .refs import init_repo
+
+# modules that should only be loaded by the commands that need them
+HEAVY_MODULES = {
+    "asyncio",
+    "attribution.generate",
+    "concurrent.futures",
+    "dulwich",
+    "jinja2",
+    "pygit2",
+    "tomlkit",
+}
+
+
+def imported_modules(*args: str, cwd: Optional[Path] = None) -> Set[str]:
+    """Run attribution with the given args, returning the names of imported modules"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [str(Path(__file__).parents[2]), env.get("PYTHONPATH")])
+    )
+    proc = subprocess.run(
+        (sys.executable, "-X", "importtime", "-m", "attribution", *args),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        encoding="utf-8",
+        cwd=cwd,
+        env=env,
+        check=True,
+    )
+    modules = set()
+    for line in proc.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            modules.add(line.rsplit("|", 1)[1].strip())
+    return modules
+
+
+class MainTest(TestCase):
+    def test_version_imports(self):
+        modules = imported_modules("--version")
+        self.assertIn("attribution.main", modules)
+        self.assertEqual(
+            set(), modules & (HEAVY_MODULES | {"attribution.project", "packaging"})
+        )
+
+    def test_log_imports(self):
+        with TemporaryDirectory() as td:
+            tdp = Path(td)
+            (tdp / "pyproject.toml").write_text(
+                '[tool.attribution]\nname = "fake"\npackage = "fake"\n'
+            )
+            git = init_repo(td)
+            sh(*git, "commit", "-q", "--allow-empty", "-m", "first")
+            sh(*git, "tag", "--annotate", "v1.0", "-m", "Release 1.0")
+            sh(*git, "commit", "-q", "--allow-empty", "-m", "second")
+
+            modules = imported_modules("log", cwd=tdp)
+            self.assertIn("attribution.project", modules)
+            self.assertEqual(set(), modules & HEAVY_MODULES)
@@ -0,0 +1,133 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT license
+
+import json
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from ..helpers import sh
+from ..profile import command_name, GIT, PARSE, profiled, PROFILER, Profiler
+
+
+class Named:
+    name = "fake"
+
+    @profiled(GIT)
+    def read(self, value: int) -> int:
+        return value * 2
+
+    @profiled(GIT)
+    def walk(self, count: int):
+        yield from range(count)
+
+
+class ProfileTest(TestCase):
+    def setUp(self):
+        PROFILER.enable()
+        self.addCleanup(PROFILER.disable)
+
+    def test_disabled(self):
+        profiler = Profiler()
+        with profiler.span(GIT, "status"):
+            pass
+        self.assertEqual([1, 2], list(profiler.iterate(GIT, "walk", [1, 2])))
+        profiler.record(GIT, "log", time.perf_counter())
+        self.assertEqual([], profiler.spans)
+
+    def test_span_self_time(self):
+        profiler = Profiler()
+        profiler.enable()
+        with profiler.span("outer", "render"):
+            with profiler.span(GIT, "log"):
+                time.sleep(0.01)
+            with profiler.span(GIT, "log"):
+                pass
+
+        inner, inner2, outer = profiler.spans
+        self.assertEqual(("outer", "render"), outer[:2])
+        self.assertGreaterEqual(outer.duration, inner.duration + inner2.duration)
+        self.assertAlmostEqual(
+            outer.self_time, outer.duration - inner.duration - inner2.duration
+        )
+        self.assertEqual(inner.duration, inner.self_time)
+
+        stats = {(s.category, s.name): s for s in profiler.stats()}
+        self.assertEqual(2, stats[(GIT, "log")].calls)
+        self.assertEqual(inner.duration, stats[(GIT, "log")].max)
+
+    def test_iterate(self):
+        profiler = Profiler()
+        profiler.enable()
+
+        def chunks():
+            for value in range(3):
+                with profiler.span(GIT, "cat-file"):
+                    pass
+                yield value
+
+        result = []
+        for value in profiler.iterate("template", "Changelog", chunks()):
+            time.sleep(0.01)  # consumer time isn't counted
+            result.append(value)
+
+        self.assertEqual([0, 1, 2], result)
+        self.assertEqual(4, len(profiler.spans))
+        span = profiler.spans[-1]
+        self.assertEqual("Changelog", span.name)
+        self.assertLess(span.duration, 0.02)
+        self.assertLessEqual(span.self_time, span.duration)
+
+    def test_record_summary_trace(self):
+        profiler = Profiler()
+        profiler.enable()
+        profiler.record(GIT, "shortlog", time.perf_counter() - 0.5)
+        with profiler.span(PARSE, "json"):
+            pass
+
+        summary = profiler.summary("generate", 1.0).splitlines()
+        self.assertEqual("profile: generate (1.000s)", summary[0])
+        self.assertEqual(
+            ["category", "name", "calls", "total", "self", "max"], summary[1].split()
+        )
+        self.assertEqual(["git", "shortlog", "1"], summary[2].split()[:3])
+        self.assertRegex(
+            summary[-1], r"^git=0\.5\d\ds  parse=0\.000s  other=0\.[45]\d\ds$"
+        )
+
+        with TemporaryDirectory() as td:
+            path = Path(td) / "trace.json"
+            profiler.write_trace(path)
+            trace = json.loads(path.read_text())
+        events = trace["traceEvents"]
+        self.assertEqual(["shortlog", "json"], [e["name"] for e in events])
+        self.assertEqual({"X"}, {e["ph"] for e in events})
+        self.assertGreaterEqual(events[0]["dur"], 500000)
+
+    def test_profiled(self):
+        obj = Named()
+        with patch.object(PROFILER, "spans", []):
+            self.assertEqual(4, obj.read(2))
+            self.assertEqual([0, 1], list(obj.walk(2)))
+            self.assertEqual(
+                ["fake read", "fake walk"], [span.name for span in PROFILER.spans]
+            )
+
+    def test_sh_spans(self):
+        with patch.object(PROFILER, "spans", []):
+            sh("git", "-C", ".", "rev-parse", "--git-dir")
+            self.assertEqual([(GIT, "rev-parse")], [s[:2] for s in PROFILER.spans])
+
+    def test_command_name(self):
+        for cmd, expected in (
+            (("git", "-C", "/repo", "-c", "a=b", "shortlog", "-s"), "shortlog"),
+            (("git", "--no-pager", "log"), "log"),
+            (("/usr/bin/git", "describe"), "describe"),
+            (("git", "--version"), "git"),
+            (("echo", "hi"), "echo"),
+            ((), ""),
+        ):
+            with self.subTest(cmd):
+                self.assertEqual(expected, command_name(cmd))
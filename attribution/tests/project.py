@@ -5,10 +5,13 @@ import subprocess
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from unittest import TestCase
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
+from ..backend import TagRef
+from ..helpers import sh
 from ..project import Project
 from ..tag import Tag, Version
+from .refs import init_repo
 
 
 class ProjectTest(TestCase):
@@ -55,29 +58,233 @@ class ProjectTest(TestCase):
         tag = project.latest
         self.assertEqual(tag, null_tag)
 
+    def test_tag_range(self):
+        versions = ["2.0", "1.10", "1.2", "1.1", "1.0", "0.1"]
+        project = Project(name="foo", package="foo", config={})
+        project._tags = [Tag(f"v{v}", Version(v)) for v in versions]
+
+        def names(tags):
+            return [tag.version.public for tag in tags]
+
+        for since, until, last, expected in (
+            (None, None, None, versions),
+            ("1.0", "1.2", None, ["1.2", "1.1", "1.0"]),
+            ("1.0.1", "1.5", None, ["1.2", "1.1"]),
+            ("1.1", None, None, ["2.0", "1.10", "1.2", "1.1"]),
+            (None, "1.0", None, ["1.0", "0.1"]),
+            (None, None, 2, ["2.0", "1.10"]),
+            (None, "1.2", 2, ["1.2", "1.1"]),
+            ("1.2", None, 10, ["2.0", "1.10", "1.2"]),
+            ("3.0", None, None, []),
+            ("1.2", "1.1", None, []),
+        ):
+            with self.subTest(since=since, until=until, last=last):
+                result = project.tag_range(
+                    Version(since) if since else None,
+                    Version(until) if until else None,
+                    last,
+                )
+                self.assertEqual(expected, names(result))
+
+        self.assertIs(project._tags[1], project.get_tag(Version("1.10")))
+        self.assertIs(project._tags[5], project.get_tag(Version("0.1")))
+        self.assertIsNone(project.get_tag(Version("1.5")))
+        self.assertIsNone(project.get_tag(Version("0.0")))
+        self.assertIsNone(project.get_tag(Version("9.0")))
+
+        # index is rebuilt when tags are replaced
+        project._tags = [Tag("v3.0", Version("3.0"))] + project._tags
+        self.assertEqual(["3.0", "2.0"], names(project.tag_range(last=2)))
+        self.assertIs(project._tags[0], project.get_tag(Version("3.0")))
+
+    def test_shortlog_context(self):
+        project = Project(name="foo", package="foo", config={})
+        project._tags = [
+            Tag("v2.0", Version("2.0"), sha="ddd"),
+            Tag("v1.1", Version("1.1"), sha="ccc"),
+            Tag("v1.0", Version("1.0"), sha="aaa"),
+        ]
+        v20, v11, v10 = project._tags
+        refs = [TagRef(tag.name, tag.sha or "", None) for tag in project._tags]
+        refs.append(TagRef("beta", "bbb", None))
+        backend = Mock()
+        backend.list_tags.return_value = refs
+        project._backend = backend
+
+        context = project.shortlog_context(v20, "v1.0")
+        self.assertEqual(context, project.shortlog_context(v20, "v1.0"))
+        self.assertNotEqual(context, project.shortlog_context(v20, "v1.1"))
+        self.assertNotEqual(context, project.shortlog_context(v20, "beta"))
+        self.assertNotEqual(context, project.shortlog_context(v20, ""))
+        self.assertIsNone(project.shortlog_context(v11, "stable"))
+        self.assertIsNone(project.shortlog_context(Tag("v3", Version("3")), ""))
+        backend.list_tags.assert_called_once()
+
+        # any new, moved, or deleted tag invalidates the context, versions or not
+        for changed in (
+            [*refs, TagRef("alpha", "eee", None)],
+            [*refs[:-1], TagRef("beta", "eee", None)],
+            refs[:-1],
+            [*refs[1:], TagRef("v3.0", "eee", None)],
+            [TagRef("v0.1", "eee", None), *refs],
+        ):
+            with self.subTest(changed=changed):
+                backend.list_tags.return_value = changed
+                project._tag_refs = None
+                self.assertNotEqual(context, project.shortlog_context(v20, "v1.0"))
+
+    def test_cache_salt(self):
+        with TemporaryDirectory() as td:
+            tdp = Path(td).resolve()
+            git = init_repo(td)
+            root = tdp / "python"
+            root.mkdir()
+            config = {"ignored_authors": ["bot"]}
+
+            def salt():
+                return Project("foo", "foo", config=config, root=root).cache_salt()
+
+            before = salt()
+            self.assertEqual("bot", before[0])
+            self.assertEqual(before, salt())
+
+            # git reads .mailmap from the top of the work tree, not the project root
+            (root / ".mailmap").write_text("Someone <a@b.c>\n")
+            self.assertEqual(before, salt())
+            (tdp / ".mailmap").write_text("Someone <a@b.c>\n")
+            after = salt()
+            self.assertNotEqual(before, after)
+
+            (tdp / "extra").write_text("Other <d@e.f>\n")
+            sh(*git, "config", "mailmap.file", "extra")
+            self.assertNotEqual(after, salt())
+            after = salt()
+            (tdp / "extra").write_text("Another <d@e.f>\n")
+            self.assertNotEqual(after, salt())
+
+            after = salt()
+            blob = sh(*git, "hash-object", "-w", "extra").strip()
+            sh(*git, "config", "mailmap.blob", blob)
+            self.assertNotEqual(after, salt())
+
+    @patch("attribution.project.TagCache")
+    @patch("attribution.project.Tag")
+    def test_prefetch(self, tag_mock, cache_mock):
+        tags = [
+            Tag("v1.1", Version("1.1"), sha="bbb"),
+            Tag("v1.0", Version("1.0"), sha="aaa"),
+        ]
+        tags[1]._shortlog = "cached"
+        cache = cache_mock.for_repo.return_value
+        cache.key.side_effect = lambda tag, salt: tag.name
+        cache.load.side_effect = lambda tag, key, context: key == "v1.0"
+
+        with TemporaryDirectory() as td:
+            tdp = Path(td)
+            (tdp / ".mailmap").write_text("Someone <a@b.c>\n")
+            project = Project("foo", "foo", root=tdp, _tags=tags)
+            project._tag_refs = ({"v1.1": "bbb", "v1.0": "aaa"}, "digest")
+            project.config["ignored_authors"] = ["bot"]
+
+            with patch.object(Tag, "fetch_message") as message_mock, patch.object(
+                Tag, "fetch_shortlog"
+            ) as shortlog_mock:
+                project.prefetch()
+            message_mock.assert_called_once_with(project.backend)
+            shortlog_mock.assert_called_once_with(project.backend)
+
+            cache_mock.for_repo.assert_called_once_with(tdp)
+            salt = project.cache_salt()
+            self.assertEqual(salt[0], "bot")
+            self.assertEqual(len(salt[1]), 64)
+            cache.key.assert_any_call(tags[0], salt)
+            cache.key.assert_any_call(tags[1], salt)
+            tag_mock.load_messages.assert_called_once_with([tags[0]], project.backend)
+            tag_mock.load_shortlogs.assert_called_once_with(
+                tags, project.backend, limit=False, base=None
+            )
+            cache.store.assert_called_once()
+            tag, key, context = cache.store.call_args.args
+            self.assertEqual((tags[0], "v1.1"), (tag, key))
+            self.assertEqual(project.shortlog_context(tags[0], "v1.0"), context("v1.0"))
+            cache.prune.assert_called_once()
+
+        with self.subTest("no cache"):
+            cache_mock.reset_mock()
+            tag_mock.reset_mock()
+            project = Project("foo", "foo", cache=False, _tags=tags)
+            project.prefetch()
+            cache_mock.for_repo.assert_not_called()
+            tag_mock.load_shortlogs.assert_called_once_with(
+                tags, project.backend, limit=False, base=None
+            )
+
+        with self.subTest("not a repo"):
+            cache_mock.for_repo.return_value = None
+            project = Project("foo", "foo", _tags=tags)
+            self.assertIsNone(project.tag_cache)
+            self.assertFalse(project.cache)
+
+    def test_fetch_tags(self):
+        def fake_read_tag(name):
+            if name == "v1.3":
+                raise RuntimeError("broken")
+            return None
+
+        backend = Mock()
+        backend.read_tag.side_effect = fake_read_tag
+        backend.describe.return_value = "v0.1"
+        backend.shortlog.side_effect = lambda rev, exclude: f"{exclude}...{rev}\n"
+        tags = [Tag(f"v1.{i}", Version(f"1.{i}")) for i in range(6, -1, -1)]
+        for tag in tags:
+            tag._message = f"message for {tag.name}"
+        tags[3]._message = None
+        tags[-1]._shortlog = "done already"
+
+        project = Project("foo", "foo", jobs=4, _tags=tags, _backend=backend)
+        with self.assertLogs("attribution.project", "WARNING") as logs:
+            project.fetch_tags(tags)
+
+        self.assertEqual(
+            logs.output, ["WARNING:attribution.project:failed to load tag v1.3: broken"]
+        )
+        self.assertEqual(
+            [tag._shortlog for tag in tags],
+            [
+                "v0.1...v1.6",
+                "v0.1...v1.5",
+                "v0.1...v1.4",
+                None,
+                "v0.1...v1.2",
+                "v0.1...v1.1",
+                "done already",
+            ],
+        )
+        self.assertEqual(backend.describe.call_count, 5)
+        self.assertEqual(backend.shortlog.call_count, 5)
+
     @patch("attribution.project.LOG")
-    @patch("attribution.project.sh")
-    def test_shortlog(self, sh_mock, log_mock):
-        sh_mock.side_effect = [
+    def test_shortlog(self, log_mock):
+        backend = Mock()
+        backend.shortlog.side_effect = [
             "  10 Foo Bar\n",
             subprocess.CalledProcessError(1, ()),
         ]
 
-        project = Project("foo", "foo")
+        project = Project("foo", "foo", _backend=backend)
         result = project.shortlog
-        sh_mock.assert_called_with(project.shortlog_cmd)
+        backend.shortlog.assert_called_with("HEAD")
         self.assertEqual(result, "  10 Foo Bar")
 
         # cached value
-        sh_mock.reset_mock()
+        backend.reset_mock()
         result = project.shortlog
-        sh_mock.assert_not_called()
+        backend.shortlog.assert_not_called()
         self.assertEqual(result, "  10 Foo Bar")
 
-        sh_mock.reset_mock()
-        project = Project("foo", "foo")
+        project = Project("foo", "foo", _backend=backend)
         result = project.shortlog
-        sh_mock.assert_called_with(project.shortlog_cmd)
+        backend.shortlog.assert_called_with("HEAD")
         log_mock.exception.assert_called_once()
         self.assertEqual(result, "")
 
@@ -217,6 +424,14 @@ package = "fizzbuzz"
                     },
                 )
 
+            with self.subTest("pyproject with invalid manifest_search"):
+                pyproject.write_text(
+                    fake_pyproject.strip() + '\nmanifest_search = "svn"'
+                )
+                with self.assertLogs("attribution.project", "WARNING"):
+                    project = Project.load(td)
+                self.assertNotIn("manifest_search", project.config)
+
             with self.subTest("empty pyproject"):
                 pyproject.write_text("\n")
                 project = Project.load(td)
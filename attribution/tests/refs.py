@@ -0,0 +1,107 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT license
+
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Tuple, Union
+from unittest import TestCase
+from unittest.mock import patch
+
+from ..helpers import sh
+from ..refs import find_git_dirs, read_tag_refs, UnsupportedLayout
+
+SHA_A = "a" * 40
+SHA_B = "b" * 40
+SHA_C = "c" * 40
+
+
+def init_repo(path: Union[str, Path]) -> Tuple[str, ...]:
+    """
+    Create an empty git repo at path, with a committer identity in its config.
+
+    Returns the command prefix for running git in that repo.
+    """
+    git = ("git", "-C", str(path))
+    sh(*git, "init", "-q", "-b", "main")
+    sh(*git, "config", "user.name", "A")
+    sh(*git, "config", "user.email", "a@b.c")
+    return git
+
+
+class RefsTest(TestCase):
+    def make_repo(self, path: Path) -> Path:
+        git_dir = path / ".git"
+        (git_dir / "refs" / "tags" / "nested").mkdir(parents=True)
+        (git_dir / "HEAD").write_text("ref: refs/heads/main\n")
+        (git_dir / "packed-refs").write_text(
+            "# pack-refs with: peeled fully-peeled sorted \n"
+            f"{SHA_A} refs/heads/main\n"
+            f"{SHA_A} refs/tags/v1.0\n"
+            f"^{SHA_C}\n"
+            f"{SHA_A} refs/tags/v1.1\n"
+        )
+        (git_dir / "refs" / "tags" / "v1.1").write_text(f"{SHA_B}\n")
+        (git_dir / "refs" / "tags" / "nested" / "v2.0").write_text(f"{SHA_C}\n")
+        (git_dir / "refs" / "tags" / "v3.0.lock").write_text(f"{SHA_C}\n")
+        return git_dir
+
+    @patch.dict(os.environ, clear=True)
+    def test_read_tag_refs(self):
+        with TemporaryDirectory() as td:
+            tdp = Path(td).resolve()
+            self.assertIsNone(read_tag_refs(tdp))
+
+            git_dir = self.make_repo(tdp)
+            (tdp / "src").mkdir()
+            expected = {"v1.0": SHA_A, "v1.1": SHA_B, "nested/v2.0": SHA_C}
+            self.assertEqual(expected, read_tag_refs(tdp))
+            self.assertEqual(expected, read_tag_refs(tdp / "src"))
+
+            with self.subTest("worktree"):
+                worktree_dir = git_dir / "worktrees" / "wt"
+                worktree_dir.mkdir(parents=True)
+                (worktree_dir / "commondir").write_text("../..\n")
+                (tdp / "wt").mkdir()
+                (tdp / "wt" / ".git").write_text(f"gitdir: {worktree_dir}\n")
+                self.assertEqual(
+                    (worktree_dir, worktree_dir / "../.."), find_git_dirs(tdp / "wt")
+                )
+                self.assertEqual(expected, read_tag_refs(tdp / "wt"))
+
+            with self.subTest("git environment"):
+                with patch.dict(os.environ, {"GIT_DIR": str(git_dir)}):
+                    self.assertIsNone(read_tag_refs(tdp))
+
+            with self.subTest("symbolic ref"):
+                (git_dir / "refs" / "tags" / "latest").write_text("ref: v1.1\n")
+                self.assertIsNone(read_tag_refs(tdp))
+                (git_dir / "refs" / "tags" / "latest").unlink()
+
+            with self.subTest("reftable"):
+                (git_dir / "reftable").mkdir()
+                with self.assertRaises(UnsupportedLayout):
+                    find_git_dirs(tdp)
+                self.assertIsNone(read_tag_refs(tdp))
+
+    def test_real_repo(self):
+        with TemporaryDirectory() as td:
+            git = init_repo(td)
+            sh(*git, "commit", "-q", "--allow-empty", "-m", "first")
+            sh(*git, "tag", "--annotate", "v1.0", "-m", "Release 1.0")
+            sh(*git, "pack-refs", "--all")
+            sh(*git, "commit", "-q", "--allow-empty", "-m", "second")
+            sh(*git, "tag", "--annotate", "v1.1", "-m", "Release 1.1")
+            sh(*git, "tag", "v1.1.1")
+
+            expected = dict(
+                line.split(" ")
+                for line in sh(
+                    *git,
+                    "for-each-ref",
+                    "--format=%(refname:strip=2) %(objectname)",
+                    "refs/tags",
+                ).splitlines()
+            )
+            self.assertEqual(3, len(expected))
+            self.assertEqual(expected, read_tag_refs(Path(td)))
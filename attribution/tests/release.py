@@ -0,0 +1,129 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT license
+
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from ..backend import CliBackend
+from ..generate import Changelog, VersionFile
+from ..helpers import git_batch, sh
+from ..project import Project
+from ..release import Release
+from ..tag import Tag
+from ..types import Version
+from .refs import init_repo
+
+
+class ReleaseTest(TestCase):
+    def setUp(self):
+        td = TemporaryDirectory()
+        self.addCleanup(td.cleanup)
+        self.root = Path(td.name).resolve()
+
+        cwd = os.getcwd()
+        os.chdir(self.root)
+        self.addCleanup(os.chdir, cwd)
+        self.addCleanup(lambda: git_batch(self.root).close())
+
+        self.git = init_repo(self.root)
+        (self.root / ".mailmap").write_text("Releaser <a@b.c>\n")
+        (self.root / "pyproject.toml").write_text(
+            '[tool.attribution]\nname = "foo"\npackage = "foo"\nversion_file = true\n'
+            "signed_tags = false\n"
+        )
+        (self.root / "foo").mkdir()
+        (self.root / "foo" / "__version__.py").write_text('__version__ = "0.0"\n')
+        sh(*self.git, "add", ".")
+        sh(*self.git, "commit", "-q", "-m", "initial")
+        sh(
+            *self.git,
+            "commit",
+            "-q",
+            "--allow-empty",
+            "-m",
+            "first",
+            "--author=B <b@c>",
+        )
+        sh(*self.git, "tag", "--annotate", "v1.0", "-m", "Release 1.0")
+        sh(*self.git, "commit", "-q", "--allow-empty", "-m", "second")
+        self.head = sh(*self.git, "rev-parse", "HEAD").strip()
+
+    def load(self) -> Project:
+        project = Project.load(self.root)
+        project.cache = False
+        return project
+
+    def test_release(self):
+        project = self.load()
+        release = Release(project, Version("1.1"), "Release 1.1\n\n# comment\n")
+        tag = release.run()
+        self.assertEqual("v1.1", tag.name)
+        rendered = (self.root / "CHANGELOG.md").read_text()
+
+        log = sh(*self.git, "log", "--format=%s", "v1.1").splitlines()
+        self.assertEqual(["Version bump v1.1", "second", "first", "initial"], log)
+        self.assertEqual(self.head, sh(*self.git, "rev-parse", "HEAD~1").strip())
+        self.assertEqual("", sh(*self.git, "status", "--porcelain"))
+        version_file = self.root / "foo" / "__version__.py"
+        self.assertIn('__version__ = "1.1"\n', version_file.read_text())
+
+        # rendering ahead of the commit and tag matches a full render afterwards
+        git_batch(self.root).close()
+        self.assertEqual(rendered, Changelog(self.load()).generate())
+        self.assertIn("Release 1.1\n", rendered)
+        self.assertNotIn("# comment", rendered)
+        self.assertIn("Releaser", rendered)
+
+    def test_release_unchanged(self):
+        version_file = self.root / "foo" / "__version__.py"
+        project = self.load()
+        project._tags.insert(0, Tag("v1.1", Version("1.1")))
+        VersionFile(project).write()
+        sh(*self.git, "commit", "-q", "-am", "version")
+        os.utime(version_file, (1000000000, 1000000000))
+
+        Release(self.load(), Version("1.1"), "Release 1.1").run()
+        self.assertEqual(1000000000, version_file.stat().st_mtime)
+        changed = sh(*self.git, "show", "--format=", "--name-only", "HEAD")
+        self.assertEqual("CHANGELOG.md\n", changed)
+
+    def test_release_incremental(self):
+        Release(self.load(), Version("1.1"), "Release 1.1").run()
+        sh(*self.git, "commit", "-q", "--allow-empty", "-m", "third")
+        Release(self.load(), Version("1.2"), "Release 1.2").run(verify=True)
+
+        git_batch(self.root).close()
+        rendered = (self.root / "CHANGELOG.md").read_text()
+        self.assertEqual(rendered, Changelog(self.load()).generate())
+
+    def test_rollback(self):
+        version_file = self.root / "foo" / "__version__.py"
+        (self.root / "staged.txt").write_text("staged\n")
+        sh(*self.git, "add", "staged.txt")
+
+        release = Release(self.load(), Version("1.1"), "Release 1.1")
+        with patch.object(CliBackend, "create_tag", side_effect=RuntimeError("no")):
+            with self.assertRaisesRegex(RuntimeError, "no"):
+                with self.assertLogs("attribution.release", "WARNING"):
+                    release.run()
+
+        self.assertEqual(self.head, sh(*self.git, "rev-parse", "HEAD").strip())
+        self.assertFalse((self.root / "CHANGELOG.md").exists())
+        self.assertEqual('__version__ = "0.0"\n', version_file.read_text())
+        self.assertEqual(
+            "A  staged.txt\n", sh(*self.git, "status", "--porcelain", "--untracked=no")
+        )
+        self.assertEqual("", sh(*self.git, "tag", "-l", "v1.1"))
+
+    def test_rollback_render(self):
+        release = Release(self.load(), Version("1.1"), "Release 1.1")
+        with patch.object(Changelog, "write", side_effect=RuntimeError("no")):
+            with self.assertRaisesRegex(RuntimeError, "no"):
+                with self.assertLogs("attribution.release", "WARNING"):
+                    release.run()
+
+        self.assertEqual(self.head, sh(*self.git, "rev-parse", "HEAD").strip())
+        self.assertEqual("", sh(*self.git, "status", "--porcelain"))
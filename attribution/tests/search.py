@@ -0,0 +1,290 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT license
+
+import os
+import subprocess
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from ..search import (
+    cargo_lock_file,
+    cargo_package_name,
+    cargo_workspace,
+    find_manifests,
+    git_manifests,
+    is_ignored,
+    npm_lock_file,
+    npm_package_name,
+    npm_workspaces,
+    parse_gitignore,
+    search_manifests,
+    translate,
+)
+
+
+class SearchTest(TestCase):
+    def test_translate(self):
+        for pattern, path, expected in (
+            ("target", "target", True),
+            ("target", "crates/foo/target", True),
+            ("target", "targets", False),
+            ("/target", "crates/foo/target", False),
+            ("/target", "target", True),
+            ("build/out", "build/out", True),
+            ("build/out", "src/build/out", False),
+            ("*.toml", "crates/Cargo.toml", True),
+            ("src/*.toml", "src/foo/Cargo.toml", False),
+            ("**/dist", "a/b/dist", True),
+            ("**/dist", "dist", True),
+            ("gen/**", "gen/a/b", True),
+            ("a/**/b", "a/b", True),
+            ("a/**/b", "a/x/y/b", True),
+            ("pkg?", "pkg1", True),
+            ("pkg[0-9]", "pkg1", True),
+            ("pkg[!0-9]", "pkg1", False),
+            ("\\#hash", "#hash", True),
+        ):
+            with self.subTest(pattern=pattern, path=path):
+                self.assertEqual(bool(translate(pattern).match(path)), expected)
+
+    def test_is_ignored(self):
+        rules = parse_gitignore("# comment\n\nbuild/\n*.log\n!keep.log\n")
+        self.assertEqual(len(rules), 3)
+        scoped = (("", rules),)
+        self.assertTrue(is_ignored(scoped, "build", True))
+        self.assertFalse(is_ignored(scoped, "build", False))
+        self.assertTrue(is_ignored(scoped, "logs/debug.log", False))
+        self.assertFalse(is_ignored(scoped, "logs/keep.log", False))
+        self.assertFalse(is_ignored(scoped, "src", True))
+
+        nested = scoped + (("web/", parse_gitignore("/dist\n!debug.log")),)
+        self.assertTrue(is_ignored(nested, "web/dist", True))
+        self.assertFalse(is_ignored(nested, "dist", True))
+        self.assertFalse(is_ignored(nested, "web/debug.log", False))
+
+    def test_find_manifests(self):
+        with TemporaryDirectory() as td:
+            tdp = Path(td)
+            for path in (
+                "Cargo.toml",
+                "package.json",
+                "crates/b/Cargo.toml",
+                "crates/a/Cargo.toml",
+                "crates/a/target/package/a-1.0/Cargo.toml",
+                "web/package.json",
+                "web/node_modules/dep/package.json",
+                "web/dist/package.json",
+                "generated/Cargo.toml",
+                ".git/Cargo.toml",
+                "vendor/thing/package.json",
+            ):
+                (tdp / path).parent.mkdir(parents=True, exist_ok=True)
+                (tdp / path).write_text("")
+            (tdp / ".gitignore").write_text("/generated/\n")
+            (tdp / "web" / ".gitignore").write_text("dist\n")
+
+            result = find_manifests(tdp)
+            self.assertEqual(
+                {
+                    "Cargo.toml": [
+                        tdp / "Cargo.toml",
+                        tdp / "crates/a/Cargo.toml",
+                        tdp / "crates/b/Cargo.toml",
+                    ],
+                    "package.json": [
+                        tdp / "package.json",
+                        tdp / "web/package.json",
+                    ],
+                },
+                result,
+            )
+
+            result = find_manifests(tdp, ["package.json"], skip=())
+            self.assertEqual(
+                [
+                    tdp / "package.json",
+                    tdp / "web/package.json",
+                    tdp / "vendor/thing/package.json",
+                    tdp / "web/node_modules/dep/package.json",
+                ],
+                result["package.json"],
+            )
+
+    def test_git_manifests(self):
+        with TemporaryDirectory() as td:
+            tdp = Path(td)
+            self.assertIsNone(git_manifests(tdp))
+
+            subprocess.run(["git", "init", "-q", td], check=True)
+            for path in (
+                "Cargo.toml",
+                "crates/b/Cargo.toml",
+                "crates/a/Cargo.toml",
+                "crates/a/target/package/a-1.0/Cargo.toml",
+                "deleted/package.json",
+                "untracked/package.json",
+                "web/package.json",
+            ):
+                (tdp / path).parent.mkdir(parents=True, exist_ok=True)
+                (tdp / path).write_text("")
+            subprocess.run(["git", "-C", td, "add", "--", "*.toml", "*.json"])
+            subprocess.run(["git", "-C", td, "rm", "-rq", "--cached", "untracked"])
+            (tdp / "deleted/package.json").unlink()
+
+            expected = {
+                "Cargo.toml": [
+                    tdp / "Cargo.toml",
+                    tdp / "crates/a/Cargo.toml",
+                    tdp / "crates/b/Cargo.toml",
+                ],
+                "package.json": [tdp / "web/package.json"],
+            }
+            self.assertEqual(expected, git_manifests(tdp))
+            with patch.dict(os.environ, {"GIT_TRACE": "1"}):
+                # trace output on stderr isn't mixed into the list of paths
+                self.assertEqual(expected, git_manifests(tdp))
+            self.assertEqual(expected, search_manifests(tdp))
+            self.assertEqual(expected, search_manifests(tdp, strategy="git"))
+            self.assertEqual(
+                {"package.json": [tdp / "web/package.json"]},
+                git_manifests(tdp / "web", ["package.json"]),
+            )
+
+            result = search_manifests(tdp, strategy="filesystem")
+            self.assertEqual(
+                [tdp / "untracked/package.json", tdp / "web/package.json"],
+                result["package.json"],
+            )
+
+            with self.assertRaises(ValueError):
+                search_manifests(tdp, strategy="svn")
+
+    def test_cargo_package_name(self):
+        for text, expected in (
+            ('[package]\nname = "fluffy"\nversion = "1.0"\n', "fluffy"),
+            ("[package]  # comment\n  name='fluffy'  # comment\n", "fluffy"),
+            ('[dependencies]\nname = "wrong"\n[package]\nname = "fluffy"\n', "fluffy"),
+            ('[workspace]\nmembers = ["fluffy"]\n', None),
+            ('[workspace.package]\nversion = "1.0"\n', None),
+            ('[package]\nversion = "1.0"\n[lib]\nname = "wrong"\n', None),
+            ('package = { name = "fluffy" }\n', "fluffy"),
+            ('[package]\nname = "fl\\u0075ffy"\n', "fluffy"),
+        ):
+            with self.subTest(text):
+                self.assertEqual(expected, cargo_package_name(text))
+
+    def test_cargo_workspace(self):
+        for text, expected in (
+            ('[package]\nname = "fluffy"\n', None),
+            ('[workspace]  # comment\nmembers = ["fluffy"]\n', "."),
+            ('[workspace.package]\nversion = "1.0"\n', "."),
+            ('[package]\nname = "fluffy"\nworkspace = "../.."\n', "../.."),
+            ('[package]\nname = "workspace"\n', None),
+        ):
+            with self.subTest(text):
+                self.assertEqual(expected, cargo_workspace(text))
+
+    def test_cargo_lock_file(self):
+        with TemporaryDirectory() as td:
+            tdp = Path(td)
+            for path, text in (
+                ("Cargo.toml", '[package]\nname = "root"\n'),
+                ("Cargo.lock", ""),
+                ("ws/Cargo.toml", '[workspace]\nmembers = ["crates/*"]\n'),
+                ("ws/Cargo.lock", ""),
+                ("ws/crates/a/Cargo.toml", '[package]\nname = "a"\n'),
+                ("ws/crates/b/Cargo.toml", '[package]\nname = "b"\n'),
+                ("ws/other/Cargo.toml", '[package]\nname = "c"\nworkspace = ".."\n'),
+                ("solo/Cargo.toml", '[package]\nname = "solo"\n'),
+                ("solo/Cargo.lock", ""),
+                ("nolock/Cargo.toml", '[package]\nname = "nolock"\n'),
+            ):
+                (tdp / path).parent.mkdir(parents=True, exist_ok=True)
+                (tdp / path).write_text(text)
+
+            workspaces = {}
+            for package_dir, expected in (
+                (".", "Cargo.lock"),
+                ("ws/crates/a", "ws/Cargo.lock"),
+                ("ws/crates/b", "ws/Cargo.lock"),
+                ("ws/other", "ws/Cargo.lock"),
+                ("solo", "solo/Cargo.lock"),
+                ("nolock", None),
+            ):
+                with self.subTest(package_dir):
+                    result = cargo_lock_file(tdp / package_dir, tdp, workspaces)
+                    self.assertEqual(expected and tdp / expected, result)
+            self.assertTrue(workspaces[tdp / "ws" / "Cargo.toml"])
+
+            with self.subTest("outside project root"):
+                self.assertIsNone(cargo_lock_file(tdp / "nolock", tdp / "nolock"))
+
+    def test_npm_package_name(self):
+        text = '{\n    "name": "fluffy",\n    "version": "1.0"\n}\n'
+        self.assertEqual("fluffy", npm_package_name(text, ["fluffy", "whatever"]))
+        self.assertIsNone(npm_package_name(text, ["whatever"]))
+        self.assertIsNone(npm_package_name("not json", ["whatever"]))
+
+        text = '{"name": "whatever", "dependencies": {"fluffy": "1.0"}}'
+        self.assertIsNone(npm_package_name(text, ["fluffy"]))
+
+    def test_npm_workspaces(self):
+        for text, paths, expected in (
+            ('{"name": "fluffy"}', [], None),
+            ('{"workspaces": "nope"}', [], None),
+            ('{"workspaces": ["packages/*", "./tools/cli/"]}', [], []),
+            (
+                '{"workspaces": ["packages/*", "./tools/cli/"]}',
+                ["packages/a", "tools/cli", "packages/a/b", "tools", "other/a"],
+                [True, True, False, False, False],
+            ),
+            (
+                '{"workspaces": {"packages": ["packages/**"], "nohoist": ["x"]}}',
+                ["packages/a", "packages/a/b", "x"],
+                [True, True, False],
+            ),
+        ):
+            with self.subTest(text):
+                patterns = npm_workspaces(text)
+                if expected is None:
+                    self.assertIsNone(patterns)
+                    continue
+                self.assertEqual(
+                    expected,
+                    [any(p.match(path) for p in patterns) for path in paths],
+                )
+
+    def test_npm_lock_file(self):
+        with TemporaryDirectory() as td:
+            tdp = Path(td)
+            for path, text in (
+                ("package.json", '{"name": "root", "workspaces": ["packages/*"]}'),
+                ("package-lock.json", "{}"),
+                ("packages/a/package.json", '{"name": "a"}'),
+                ("packages/a/package-lock.json", "{}"),
+                ("packages/a/nested/package.json", '{"name": "nested"}'),
+                ("other/package.json", '{"name": "other"}'),
+                ("other/package-lock.json", "{}"),
+                ("nolock/package.json", '{"name": "nolock"}'),
+            ):
+                (tdp / path).parent.mkdir(parents=True, exist_ok=True)
+                (tdp / path).write_text(text)
+
+            workspaces = {}
+            for package_dir, expected in (
+                (".", "package-lock.json"),
+                ("packages/a", "package-lock.json"),
+                ("packages/a/nested", None),
+                ("other", "other/package-lock.json"),
+                ("nolock", None),
+            ):
+                with self.subTest(package_dir):
+                    result = npm_lock_file(tdp / package_dir, tdp, workspaces)
+                    self.assertEqual(expected and tdp / expected, result)
+            self.assertIsNone(workspaces[tdp / "packages" / "a" / "package.json"])
+
+            with self.subTest("outside project root"):
+                result = npm_lock_file(tdp / "packages" / "a", tdp / "packages")
+                self.assertEqual(tdp / "packages" / "a" / "package-lock.json", result)
@@ -1,13 +1,20 @@
 # Copyright 2022 Amethyst Reese
 # Licensed under the MIT license
 
+import asyncio
 import subprocess
 from dataclasses import replace
+from pathlib import Path
+from tempfile import TemporaryDirectory
 from unittest import TestCase
 from unittest.mock import call, patch
 
+from ..backend import LOG_FORMAT, select_backend, TAG_FORMAT, TagData, TagRef
+from ..helpers import GitObject, sh
 from ..tag import Tag
 from ..types import Version
+from .backend import importable, MemoryBackend
+from .refs import init_repo
 
 
 class TagTest(TestCase):
@@ -22,6 +29,28 @@ class TagTest(TestCase):
         self.assertNotEqual(tag1, tag3)
         self.assertNotEqual(tag1, not_tag)
 
+    def test_tag_slots(self):
+        tag = Tag("v1.0", Version("1.0"), sha="abc123")
+        self.assertFalse(hasattr(tag, "__dict__"))
+        self.assertIn("_message", Tag.__slots__)
+        self.assertIsNone(tag.tagger)
+        with self.assertRaises(AttributeError):
+            tag.whatever = True  # type: ignore[attr-defined]
+
+        copy = replace(tag, sha="def456")
+        self.assertEqual(tag, copy)
+        self.assertEqual("def456", copy.sha)
+        self.assertIn("version=<Version('1.0')>", repr(tag))
+
+        tagger = "".join(["Some", "one <s@o.me>"])
+        tags = Tag._from_refs(
+            [
+                TagRef(name, f"sha-{name}", TagData("tag", tagger, "", "Message\n"))
+                for name in ("v1.0", "v1.1")
+            ]
+        )
+        self.assertIs(tags[0].tagger, tags[1].tagger)
+
     def test_tag_order(self):
         tag1 = Tag("v1.0", Version("1.0"))
         tag2 = Tag("v1.1", Version("1.1"))
@@ -61,28 +90,35 @@ class TagTest(TestCase):
             _ = 24 >= tag
 
     @patch("attribution.tag.LOG")
-    @patch("attribution.tag.sh")
-    def test_message(self, sh_mock, log_mock):
-        sh_mock.side_effect = [
-            (
+    @patch("attribution.backend.git_batch")
+    def test_message(self, batch_mock, log_mock):
+        def tag_object(content):
+            data = content.encode()
+            return GitObject("abc123", "tag", len(data), data)
+
+        read_mock = batch_mock.return_value.read
+        read_mock.side_effect = [
+            tag_object(
                 "object 123abc\ntype commit\ntag v1.0\ntagger Someone\n\n"
                 "Tag subject\n\nFoo Bar\n"
                 "-----BEGIN PGP SIGNATURE-----\n"
                 "lotsa gobbledy gook\n"
                 "-----END PGP SIGNATURE-----\n"
             ),
-            (
+            tag_object(
                 "object 123abc\ntype commit\ntag v1.0\ntagger Someone\n\n"
                 "Different subject\n"
             ),
-            "something weird that should never match",
+            tag_object("something weird that should never match"),
+            GitObject("123abc", "commit", 0, b""),
+            None,
         ]
 
         proto = Tag("v1.0", Version("1.0"))
 
         tag = replace(proto)
         result = tag.message
-        sh_mock.assert_called_with("git cat-file tag v1.0")
+        read_mock.assert_called_with("refs/tags/v1.0")
         self.assertEqual(result, "Tag subject\n\nFoo Bar\n")
         self.assertEqual(
             tag._signature,
@@ -92,9 +128,9 @@ class TagTest(TestCase):
         )
 
         # cached value
-        sh_mock.reset_mock()
+        read_mock.reset_mock()
         result = tag.message
-        sh_mock.assert_not_called()
+        read_mock.assert_not_called()
         self.assertEqual(result, "Tag subject\n\nFoo Bar\n")
 
         tag = replace(proto)
@@ -109,66 +145,112 @@ class TagTest(TestCase):
         self.assertEqual(result, "")
         self.assertIsNone(tag._signature)
 
+        # lightweight tag
+        log_mock.reset_mock()
+        tag = replace(proto)
+        result = tag.message
+        log_mock.warning.assert_not_called()
+        self.assertEqual(result, "")
+        self.assertEqual(tag._message, "")
+
+        # missing tag
+        tag = replace(proto)
+        result = tag.message
+        log_mock.warning.assert_called_once()
+        self.assertEqual(result, "")
+        self.assertIsNone(tag._message)
+
     @patch("attribution.tag.LOG")
-    @patch("attribution.tag.sh")
-    def test_shortlog(self, sh_mock, log_mock):
-        sh_mock.side_effect = [
-            "v0.5\n",
+    @patch("attribution.tag.CliBackend")
+    def test_shortlog(self, backend_mock, log_mock):
+        backend = backend_mock.return_value
+        backend.describe.side_effect = ["v0.5", "v0.5", None]
+        backend.shortlog.side_effect = [
             "shortlog for v0.5\n",
             subprocess.CalledProcessError(1, ()),
+            "shortlog for v1.0\n",
         ]
 
         proto = Tag("v1.0", Version("1.0"))
 
         tag = replace(proto)
         result = tag.shortlog
-        sh_mock.assert_has_calls(
-            [
-                call("git describe --tags --abbrev=0 --always v1.0~1"),
-                call("git shortlog -s v0.5...v1.0"),
-            ]
-        )
+        backend.describe.assert_called_with("v1.0~1")
+        backend.shortlog.assert_called_with("v1.0", "v0.5")
         log_mock.exception.assert_not_called()
         self.assertEqual(result, "shortlog for v0.5")
+        self.assertEqual(tag.shortlog_cmd, "git shortlog -s v0.5...v1.0")
 
         # cached values
-        sh_mock.reset_mock()
-        expected = tag._shortlog_cmd
-        result = tag.shortlog_cmd
-        self.assertEqual(result, expected)
+        backend.reset_mock()
         result = tag.shortlog
-        sh_mock.assert_not_called()
+        backend.describe.assert_not_called()
+        backend.shortlog.assert_not_called()
         self.assertEqual(result, "shortlog for v0.5")
+        self.assertFalse(tag._shortlog_failed)
 
         tag = replace(proto)
-        sh_mock.reset_mock()
         result = tag.shortlog
-        sh_mock.assert_called_with("git describe --tags --abbrev=0 --always v1.0~1")
         log_mock.exception.assert_called_once()
         self.assertEqual(result, "")
+        self.assertTrue(tag._shortlog_failed)
 
         # first tag in repo
         tag = replace(proto)
-        sh_mock.reset_mock()
-        sh_mock.side_effect = [
-            "abcdef123456\n",
-            "\n",
-            "shortlog for v1.0\n",
-        ]
         result = tag.shortlog
-        sh_mock.assert_has_calls(
-            [
-                call("git describe --tags --abbrev=0 --always v1.0~1"),
-                call("git tag -l abcdef123456"),
-            ]
-        )
-        log_mock.exception.assert_called_once()
+        backend.shortlog.assert_called_with("v1.0", None)
+        self.assertEqual(tag.shortlog_cmd, "git shortlog -s v1.0")
         self.assertEqual(result, "shortlog for v1.0")
 
+        # explicit backend
+        backend_mock.reset_mock()
+        memory = MemoryBackend()
+        memory.add_commit("c1", "Alice")
+        memory.add_tag("v0.5", "c1", "Initial\n")
+        memory.add_commit("c2", "Bob", "c1")
+        memory.add_commit("c3", "Alice", "c2")
+        memory.add_tag("v1.0", "c3", "Release\n")
+        tag = replace(proto)
+        self.assertEqual("Release\n", tag.fetch_message(memory))
+        self.assertEqual("     1\tAlice\n     1\tBob", tag.fetch_shortlog(memory))
+        self.assertEqual("git shortlog -s v0.5...v1.0", tag.shortlog_cmd)
+        # a tag on the root commit has no parent to describe
+        first = Tag("v0.5", Version("0.5"))
+        self.assertEqual("", first.fetch_shortlog(memory))
+        self.assertIsNone(first._shortlog_cmd)
+        backend_mock.assert_not_called()
+
+    @patch("attribution.backend.read_tag_refs")
     @patch("attribution.tag.LOG")
-    @patch("attribution.tag.sh")
-    def test_all_tags(self, sh_mock, log_mock):
-        sh_mock.return_value = "v0.0\nv0.5\nv1.0\nfeature-branch\nv1.1\nv1.2\n"
+    @patch("attribution.backend.sh")
+    def test_all_tags(self, sh_mock, log_mock, refs_mock):
+        refs_mock.return_value = None
+
+        def record(name, sha, kind="tag", content=""):
+            tagger, date = ("Someone <a@b.c>", "2022-01-01T00:00:00+00:00")
+            if kind != "tag":
+                tagger, date = (" ", "")
+            return f"{name}\0{sha}\0{kind}\0{tagger}\0{date}\0{content}\0\n"
+
+        sh_mock.return_value = "".join(
+            [
+                record("feature-branch", "fff"),
+                record("v0.0", "000", content="Initial\n"),
+                record("v0.5", "555", kind="commit", content="commit message\n"),
+                record("v1.0", "100", content="One point oh\n"),
+                record(
+                    "v1.1",
+                    "110",
+                    content=(
+                        "Signed\n"
+                        "-----BEGIN PGP SIGNATURE-----\n"
+                        "lotsa gobbledy gook\n"
+                        "-----END PGP SIGNATURE-----\n"
+                    ),
+                ),
+                record("v1.2", "120", content="Latest\n\nWith body\n"),
+            ]
+        )
         expected = [
             Tag("v1.2", Version("1.2")),
             Tag("v1.1", Version("1.1")),
@@ -177,11 +259,285 @@ class TagTest(TestCase):
             Tag("v0.0", Version("0.0")),
         ]
         result = Tag.all_tags()
-        sh_mock.assert_called_with("git tag")
+        sh_mock.assert_called_once_with(
+            "git", "for-each-ref", f"--format={TAG_FORMAT}", "refs/tags"
+        )
         log_mock.warning.assert_called_with("Skipping tag feature-branch")
         self.assertEqual(result, expected)
 
-    @patch("attribution.tag.sh")
+        # tag contents are loaded without further git calls
+        sh_mock.reset_mock()
+        self.assertEqual(
+            [tag.message for tag in result],
+            ["Latest\n\nWith body\n", "Signed\n", "One point oh\n", "", "Initial\n"],
+        )
+        sh_mock.assert_not_called()
+
+        self.assertEqual(result[0].sha, "120")
+        self.assertEqual(result[0].tagger, "Someone <a@b.c>")
+        self.assertEqual(result[0].date, "2022-01-01T00:00:00+00:00")
+        self.assertIsNone(result[0]._signature)
+        self.assertEqual(
+            result[1]._signature,
+            "-----BEGIN PGP SIGNATURE-----\n"
+            "lotsa gobbledy gook\n"
+            "-----END PGP SIGNATURE-----\n",
+        )
+        self.assertEqual(result[3].sha, "555")
+        self.assertIsNone(result[3].tagger)
+
+        with self.subTest("read from refs"):
+            refs_mock.return_value = {
+                "v1.0": "100",
+                "feature-branch": "fff",
+                "v1.2": "120",
+                "v0.5": "555",
+            }
+            sh_mock.reset_mock()
+            result = Tag.all_tags()
+            sh_mock.assert_not_called()
+            self.assertEqual(result, [expected[0], expected[2], expected[3]])
+            self.assertEqual(["120", "100", "555"], [tag.sha for tag in result])
+            self.assertIsNone(result[0]._message)
+
+            def tag_object(content):
+                data = (
+                    "object 123abc\ntype commit\ntag v1\n"
+                    f"tagger Someone <a@b.c> 1640995200 +0000\n\n{content}"
+                ).encode()
+                return GitObject("abc123", "tag", len(data), data)
+
+            objects = {
+                "120": tag_object("Latest\n\nWith body\n"),
+                "100": tag_object("One point oh\n"),
+                "555": GitObject("555", "commit", 0, b""),
+            }
+            with patch("attribution.backend.git_batch") as batch_mock:
+                read_mock = batch_mock.return_value.read
+                read_mock.side_effect = objects.get
+                Tag.load_messages(result[:2])
+                self.assertEqual([call("120"), call("100")], read_mock.call_args_list)
+                self.assertIsNone(result[2]._message)
+
+                Tag.load_messages(result)
+                read_mock.assert_called_with("555")
+                self.assertEqual(
+                    ["Latest\n\nWith body\n", "One point oh\n", ""],
+                    [tag._message for tag in result],
+                )
+                self.assertEqual(result[0].tagger, "Someone <a@b.c>")
+                self.assertEqual(result[0].date, "2022-01-01T00:00:00+00:00")
+
+                read_mock.reset_mock()
+                Tag.load_messages(result)
+                read_mock.assert_not_called()
+
+                read_mock.side_effect = subprocess.CalledProcessError(1, ())
+                Tag.load_messages([Tag("v2.0", Version("2.0"), sha="200")])
+                log_mock.exception.assert_called_with("failed to load tag messages")
+            sh_mock.assert_not_called()
+
+    @patch("attribution.backend.sh")
+    def test_load_shortlogs(self, sh_mock):
+        def commit(sha, parents, author, *tags):
+            decorations = ", ".join(f"tag: {tag}" for tag in tags)
+            return f"{sha}\0{' '.join(parents)}\0{author}\0{decorations}\n"
+
+        sh_mock.return_value = "".join(
+            [
+                commit("a", [], "Alice", "v0.1"),
+                commit("b", ["a"], "Bob"),
+                commit("c", ["b"], "Alice", "v0.2", "stable"),
+                commit("d", ["c"], "Carol"),
+                commit("e", ["d"], "Bob", "v1.0"),
+                commit("g", ["c"], "Dave"),
+                commit("f", ["e"], "Bob"),
+                commit("h", ["f", "g"], "Alice"),
+                commit("i", ["h"], "Alice", "v1.1"),
+                commit("j", ["e"], "Zed", "v1.0.1"),
+                commit("k", ["i", "j"], "Alice", "v1.2"),
+                commit("m", ["x"], "Eve", "v1.3"),
+            ]
+        )
+        tags = [
+            Tag("v1.3", Version("1.3")),
+            Tag("v1.2", Version("1.2")),
+            Tag("v1.1", Version("1.1")),
+            Tag("v1.0.1", Version("1.0.1")),
+            Tag("v1.0", Version("1.0")),
+            Tag("v0.2", Version("0.2")),
+            Tag("v0.1", Version("0.1")),
+            Tag("v0.0", Version("0.0")),
+        ]
+        tags[1]._shortlog = "precomputed"
+
+        Tag.load_shortlogs(tags)
+        sh_mock.assert_called_once_with(
+            "git",
+            "log",
+            "--tags",
+            "--topo-order",
+            "--reverse",
+            "--decorate-refs=refs/tags/",
+            f"--format={LOG_FORMAT}",
+        )
+        result = {tag.name: (tag._shortlog_cmd, tag._shortlog) for tag in tags}
+        expected = {
+            # missing parent commit
+            "v1.3": (None, None),
+            # already computed
+            "v1.2": (None, "precomputed"),
+            "v1.1": (
+                "git shortlog -s v1.0...v1.1",
+                "     2\tAlice\n     1\tBob\n     1\tDave",
+            ),
+            "v1.0.1": ("git shortlog -s v1.0...v1.0.1", "     1\tZed"),
+            # multiple names for preceding tag
+            "v1.0": (None, None),
+            "v0.2": ("git shortlog -s v0.1...v0.2", "     1\tAlice\n     1\tBob"),
+            # root commit
+            "v0.1": (None, None),
+            # not in history
+            "v0.0": (None, None),
+        }
+        self.assertEqual(expected, result)
+
+        with self.subTest("nothing pending"):
+            sh_mock.reset_mock()
+            Tag.load_shortlogs(tags[1:3])
+            sh_mock.assert_not_called()
+
+        with self.subTest("merged tags"):
+            sh_mock.return_value = "".join(
+                [
+                    commit("a", [], "Alice", "v0.1"),
+                    commit("b", ["a"], "Bob", "v0.2"),
+                    commit("c", ["a"], "Carol", "v0.2.1"),
+                    commit("d", ["b", "c"], "Alice"),
+                    commit("e", ["d"], "Alice", "v0.3"),
+                ]
+            )
+            tag = Tag("v0.3", Version("0.3"))
+            Tag.load_shortlogs([tag])
+            self.assertIsNone(tag._shortlog)
+
+        with self.subTest("git failure"):
+            sh_mock.side_effect = subprocess.CalledProcessError(1, ())
+            tag = Tag("v0.2", Version("0.2"))
+            with self.assertLogs("attribution.tag", "ERROR"):
+                Tag.load_shortlogs([tag])
+            self.assertIsNone(tag._shortlog)
+
+    def check_branch_shortlogs(self, *steps):
+        """Build a repo from git commands, and compare shortlogs to git itself"""
+        with TemporaryDirectory() as td:
+            root = Path(td)
+            git = init_repo(td)
+            for step in steps:
+                sh(*git, *step)
+
+            expected = {}
+            for name in sh(*git, "tag", "-l").split():
+                base = sh(
+                    *git, "describe", "--tags", "--abbrev=0", "--always", f"{name}~1"
+                )
+                base = base.strip()
+                spec = (
+                    f"{base}...{name}" if sh(*git, "tag", "-l", base).strip() else name
+                )
+                shortlog = sh(*git, "shortlog", "-s", spec).rstrip()
+                expected[name] = (f"git shortlog -s {spec}", shortlog)
+
+            def check(tags):
+                for tag in tags:
+                    if tag._shortlog is not None:
+                        result = (tag._shortlog_cmd, tag._shortlog)
+                        self.assertEqual(expected[tag.name], result, tag.name)
+
+            def check_ranges(load):
+                # walk only from each run of one or two tags, down to the next tag
+                tags = Tag.all_tags(root)
+                ranged = {}
+                for size in (2, 1):
+                    for index in range(len(tags)):
+                        window = [replace(tag) for tag in tags[index : index + size]]
+                        base = tags[index + size :][:1]
+                        load(window, base[0].name if base else None)
+                        check(window)
+                        ranged.update((tag.name, tag._shortlog_cmd) for tag in window)
+                return ranged
+
+            names = ["cli"] + [n for n in ("pygit2", "dulwich") if importable(n)]
+            for name in names:
+                with self.subTest(name):
+                    backend = select_backend(root, name)
+                    tags = Tag.all_tags(backend=backend)
+                    Tag.load_shortlogs(tags, backend)
+                    check(tags)
+                    ranged = check_ranges(
+                        lambda tags, base, backend=backend: Tag.load_shortlogs(
+                            tags, backend, limit=True, base=base
+                        )
+                    )
+
+            check_ranges(
+                lambda tags, base: asyncio.run(
+                    Tag.aload_shortlogs(tags, root, limit=True, base=base)
+                )
+            )
+            tags = Tag.all_tags(root)
+            asyncio.run(Tag.aload_shortlogs(tags, root))
+            check(tags)
+            return {tag.name: tag._shortlog_cmd for tag in tags}, ranged
+
+    def test_shortlogs_sibling_branches(self):
+        commit = ("commit", "-q", "--allow-empty", "-m")
+        result, ranged = self.check_branch_shortlogs(
+            (*commit, "root", "--author=Alice <alice@a>"),
+            ("checkout", "-q", "-b", "old"),
+            (*commit, "one", "--author=Bob <bob@b>"),
+            ("tag", "--annotate", "v1.0", "-m", "1.0"),
+            ("checkout", "-q", "main"),
+            (*commit, "two", "--author=Dave <dave@d>"),
+            ("tag", "--annotate", "v2.0", "-m", "2.0"),
+            (*commit, "three", "--author=Dave <dave@d>"),
+            ("tag", "--annotate", "v2.1", "-m", "2.1"),
+        )
+        # whichever of v1.0 or v2.0 comes first claims the shared root commit
+        self.assertIn(None, (result["v1.0"], result["v2.0"]))
+        self.assertEqual("git shortlog -s v2.0...v2.1", result["v2.1"])
+        # alone, v1.0 owns all of its history, and v2.0 runs past v1.0's commit
+        self.assertEqual("git shortlog -s v1.0", ranged["v1.0"])
+        self.assertIsNone(ranged["v2.0"])
+        self.assertEqual("git shortlog -s v2.0...v2.1", ranged["v2.1"])
+
+    def test_shortlogs_merged_hotfix(self):
+        commit = ("commit", "-q", "--allow-empty", "-m")
+        result, ranged = self.check_branch_shortlogs(
+            (*commit, "root", "--author=Alice <alice@a>"),
+            (*commit, "one", "--author=Bob <bob@b>"),
+            ("tag", "--annotate", "v1.0", "-m", "1.0"),
+            (*commit, "two", "--author=Carol <carol@c>"),
+            ("checkout", "-q", "-b", "hotfix"),
+            (*commit, "fix", "--author=Zed <zed@z>"),
+            ("tag", "--annotate", "v1.2.1", "-m", "1.2.1"),
+            ("checkout", "-q", "main"),
+            (*commit, "three", "--author=Dave <dave@d>"),
+            ("tag", "--annotate", "v1.1", "-m", "1.1"),
+            ("merge", "-q", "--no-ff", "hotfix", "-m", "merge"),
+            (*commit, "four", "--author=Eve <eve@e>"),
+            ("tag", "--annotate", "v1.3", "-m", "1.3"),
+            (*commit, "five", "--author=Eve <eve@e>"),
+            ("tag", "--annotate", "v1.4", "-m", "1.4"),
+        )
+        # v1.1 and v1.2.1 share a commit after v1.0, claimed by whichever is first
+        self.assertIn(None, (result["v1.1"], result["v1.2.1"]))
+        self.assertIsNone(result["v1.3"])  # merge of two tags, left to describe
+        self.assertEqual("git shortlog -s v1.3...v1.4", result["v1.4"])
+        self.assertEqual("git shortlog -s v1.0...v1.1", ranged["v1.1"])
+        self.assertEqual("git shortlog -s v1.3...v1.4", ranged["v1.4"])
+
+    @patch("attribution.backend.sh")
     def test_create(self, sh_mock):
         sh_mock.return_value = ""
         expected = Tag("v1.1", Version("1.1"))
@@ -197,7 +553,7 @@ class TagTest(TestCase):
         )
         self.assertEqual(result, expected)
 
-    @patch("attribution.tag.sh")
+    @patch("attribution.backend.sh")
     def test_update(self, sh_mock):
         sh_mock.return_value = ""
         tag = Tag("v1.1", Version("1.1"))
@@ -215,11 +571,11 @@ class TagTest(TestCase):
         )
         self.assertIsNone(tag._message)
 
-    @patch("attribution.tag.sh")
-    def test_null_tag(self, sh_mock):
+    @patch("attribution.tag.CliBackend")
+    def test_null_tag(self, backend_mock):
         tag = Tag.null()
         self.assertEqual(tag.name, "v0")
         self.assertEqual(tag.version, Version("0"))
         self.assertEqual(tag.message, "")
         self.assertEqual(tag.shortlog, "")
-        sh_mock.assert_not_called()
+        backend_mock.assert_not_called()
@@ -0,0 +1,36 @@
+# Copyright 2022 Amethyst Reese
+# Licensed under the MIT license
+
+import random
+from unittest import TestCase
+
+from ..types import parse_version, Version, version_key
+
+
+class TypesTest(TestCase):
+    def test_parse_version(self):
+        for value, expected in (
+            ("v1.0", Version("1.0")),
+            ("1.2.3rc1", Version("1.2.3rc1")),
+            ("  V2!1.0.post3.dev4  ", Version("2!1.0.post3.dev4")),
+            ("v1.0+local.7", Version("1.0+local.7")),
+            ("stable", None),
+            ("nightly-2022-01-01", None),
+            ("v1.0-weird-stuff", None),
+            ("", None),
+        ):
+            with self.subTest(value):
+                self.assertEqual(expected, parse_version(value))
+
+        self.assertIs(parse_version("v3.4.5"), parse_version("v3.4.5"))
+
+    def test_version_key(self):
+        names = ["0.1", "1.0", "1.0.post1", "1.0a1", "1.0rc1", "1.0.dev1", "2!0.1"]
+        names += ["1.10", "1.9", "1.0+local", "1.0.0"]
+        versions = [Version(name) for name in names]
+        random.Random(42).shuffle(versions)
+        self.assertEqual(sorted(versions), sorted(versions, key=version_key))
+        self.assertEqual(
+            sorted(versions, reverse=True),
+            sorted(versions, key=version_key, reverse=True),
+        )
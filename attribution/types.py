@@ -1,9 +1,40 @@
 # Copyright 2022 Amethyst Reese
 # Licensed under the MIT license
 
+import re
+from functools import lru_cache
+from typing import Any, Optional
+
 from packaging.version import InvalidVersion, Version
 
 __all__ = [
     "InvalidVersion",
+    "parse_version",
     "Version",
+    "version_key",
+    "VERSION_PREFIX_RE",
 ]
+
+# every valid version starts with an optional "v" and then a release or epoch number,
+# so this rejects most other tag names cheaply, without raising an exception
+VERSION_PREFIX_RE = re.compile(r"\s*v?[0-9]", re.IGNORECASE)
+
+
+@lru_cache(maxsize=65536)
+def parse_version(value: str) -> Optional[Version]:
+    """
+    Parse a version string, or return None if it isn't a valid version.
+
+    Results are cached, so repeated names share the same immutable Version object.
+    """
+    if not VERSION_PREFIX_RE.match(value):
+        return None
+    try:
+        return Version(value)
+    except InvalidVersion:
+        return None
+
+
+def version_key(version: Version) -> Any:
+    """Precomputed sort key for a version, avoiding rich comparisons when sorting"""
+    return getattr(version, "_key", version)